@@ -1,23 +1,24 @@
 import logging
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import datetime, timedelta, timezone
 from uuid import uuid4
 from typing import Optional
+import time
 import jwt
-import redis.asyncio as redis
+from cachetools import TTLCache
 import httpx
-from pydantic import ValidationError
 
 # Gerekli tüm şemaları, modülleri, modelleri ve bağımlılıkları import edelim
-from .schemas.user import Token, TokenData, LoginRequest, UserResponse, LoginResponse
+from .schemas.user import Token, LoginRequest, UserResponse, LoginResponse
 from ..modules.aksis import AksisClient, AksisAuthError, AksisSessionError
 from ..models.db_models import User
 # --- Refactor Değişikliği: UserRedis -> UserSessionRedis ---
 from ..models.redis_models import UserSessionRedis
 from ..db.redis_client import RedisClient
 from ..config.config import settings
-from .dependencies import get_redis_pool
+from .dependencies import get_redis_client, get_aksis_transport
 from .utilities.limiter import limiter
 
 # Bu modül için özel bir logger oluşturuyoruz.
@@ -30,6 +31,38 @@ router = APIRouter(
 )
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token")
 
+# JWT imzalama anahtarı ve algoritma listesi modül yüklenirken bir kez hazırlanır;
+# her encode/decode çağrısında string -> bytes dönüşümü tekrarlanmaz.
+_SIGNING_KEY = settings.SECRET_KEY.encode('utf-8')
+_ALGORITHM = settings.ALGORITHM
+_ALGORITHMS = [_ALGORITHM]
+
+# Oturum süreleri ve bunlara karşılık gelen timedelta'lar da login başına
+# yeniden hesaplanmak yerine modül yüklenirken sabitlenir.
+_TEACHER_TTL = settings.TEACHER_SESSION_TTL_SECONDS
+_STUDENT_TTL = settings.STUDENT_SESSION_TTL_SECONDS
+_TEACHER_TTL_DELTA = timedelta(seconds=_TEACHER_TTL)
+_STUDENT_TTL_DELTA = timedelta(seconds=_STUDENT_TTL)
+_ISTANBUL_TZ = timezone(timedelta(hours=3))
+
+# Doğrulanmış token önbelleği: token -> (user_school_number, exp).
+# İstemciler aynı token'ı ömrü boyunca tekrar kullandığı için, her istekte
+# jwt.decode + Pydantic doğrulamasını tekrarlamak yerine sonucu kısa süre saklıyoruz.
+# Başarısız doğrulamalar asla önbelleğe alınmaz.
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+# Kullanıcı oturumu önbelleği: user_school_number -> UserSessionRedis.
+# Yoğun polling'de her istek için Redis'e gitmemek adına birkaç saniyelik bir pencere.
+# Giriş (login) sırasında yeni oturum doğrudan önbelleğe yazılır (write-through),
+# çıkış (logout) sırasında ise ilgili kayıt hemen silinir.
+_session_cache: TTLCache = TTLCache(maxsize=10_000, ttl=3)
+
+
+async def _store_session(redis_client: RedisClient, session: UserSessionRedis, ttl: int) -> None:
+    """Oturumu Redis'e kaydeder ve aynı nesneyle yerel önbelleği günceller."""
+    await redis_client.save_user_session(session, ttl=ttl)
+    _session_cache[session.user_data.user_school_number] = session
+
 
 # --- Yardımcı Fonksiyonlar ---
 def create_access_token(data: dict, expires_delta: timedelta):
@@ -37,17 +70,26 @@ def create_access_token(data: dict, expires_delta: timedelta):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + expires_delta
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _SIGNING_KEY, algorithm=_ALGORITHM)
     return encoded_jwt
 
 
+def _user_response(user: User) -> UserResponse:
+    """Zaten doğrulanmış bir User nesnesinden, doğrulamayı tekrar çalıştırmadan UserResponse üretir."""
+    return UserResponse.model_construct(
+        user_school_number=user.user_school_number,
+        user_full_name=user.user_full_name,
+        role=user.role
+    )
+
+
 # --- Korunmuş Rotalar için Bağımlılık (GÜNCELLENDİ) ---
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    redis_pool: redis.ConnectionPool = Depends(get_redis_pool)
+    redis_client: RedisClient = Depends(get_redis_client)
 ) -> User:
     """
-    Token'ı decode eder, Pydantic ile doğrular, Redis'te aktif bir oturum 
+    Token'ı decode eder, içeriğini kontrol eder, Redis'te aktif bir oturum 
     olup olmadığını kontrol eder ve güncel User nesnesini döndürür.
     """
     credentials_exception = HTTPException(
@@ -55,38 +97,47 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        
-        # --- Pydantic ile Doğrulama ---
-        # Gelen token içeriğini TokenData modeli ile doğruluyoruz.
-        # Bu, token'ın beklenen yapıda olduğunu garanti eder.
-        token_data = TokenData.model_validate(payload)
-        
-        if token_data.user_school_number is None:
+    cached = _token_cache.get(token)
+    if cached is not None and cached[1] > time.time():
+        user_school_number = cached[0]
+    else:
+        try:
+            payload = jwt.decode(token, _SIGNING_KEY, algorithms=_ALGORITHMS)
+        except jwt.PyJWTError as e:
+            # JWT hatalarını (süre dolması, imza hatası) yakalıyoruz.
+            logger.warning(f"Token validation error: {e}")
+            raise credentials_exception
+
+        # Payload'ı create_access_token ile kendimiz imzaladığımız için Pydantic
+        # doğrulamasına gerek yok; yalnızca tek bir string alan okunur.
+        user_school_number = payload.get("user_school_number")
+        if not isinstance(user_school_number, str) or not user_school_number:
             logger.warning(f"Token is valid but missing 'user_school_number': {payload}")
             raise credentials_exception
-        
-        # --- Redis Oturum Kontrolü ---
-        redis_client = RedisClient(pool=redis_pool)
-        user_session = await redis_client.get_user_session(token_data.user_school_number)
-        
+
+        # Token'ın kendi 'exp' değerinden sonra önbellekten asla kullanılmaması için saklıyoruz.
+        if payload.get("exp"):
+            _token_cache[token] = (user_school_number, payload["exp"])
+
+    # --- Redis Oturum Kontrolü ---
+    user_session = _session_cache.get(user_school_number)
+    if user_session is None:
+        user_session = await redis_client.get_user_session(user_school_number)
+
         if user_session is None:
-            logger.warning(f"User '{token_data.user_school_number}' has a valid token but no active session in Redis. Denying access.")
+            logger.warning(f"User '{user_school_number}' has a valid token but no active session in Redis. Denying access.")
             raise credentials_exception
-            
-        # Her zaman Redis'teki en güncel kullanıcı verisini döndür
-        return user_session.user_data
-        
-    except (jwt.PyJWTError, ValidationError) as e:
-        # Hem JWT hatalarını (süre dolması, imza hatası) hem de Pydantic doğrulama
-        # hatalarını (eksik alan, yanlış tip) yakalıyoruz.
-        logger.warning(f"Token validation error: {e}")
-        raise credentials_exception
+        _session_cache[user_school_number] = user_session
+
+    # Her zaman Redis'teki en güncel kullanıcı verisini döndür
+    return user_session.user_data
 
 
 # --- Merkezi Login Mantığı (YENİDEN YAPILANDIRILDI) ---
 
+# Demo hesaplarının kullanıcı adı önekleri. Gerçek kullanıcı adları bu dala hiç girmez.
+_DEMO_PREFIXES = ("demo_teacher_", "demo_student_")
+
 async def _handle_demo_login(username: str, password: str, redis_client: RedisClient) -> Optional[LoginResponse]:
     """Demo kullanıcılar için giriş mantığını yönetir. Artık 10 öğretmen ve 10 öğrenci oluşturur."""
     if password != "password":
@@ -102,13 +153,14 @@ async def _handle_demo_login(username: str, password: str, redis_client: RedisCl
                 user_data = User(user_school_number=school_number, user_full_name=f"Demo Teacher {user_id}", role=role)
                 
                 # --- Refactor Değişikliği: TTL ile oturum kaydı ---
-                ttl = settings.TEACHER_SESSION_TTL_SECONDS
-                redis_session = UserSessionRedis(user_data=user_data, session_id=uuid4(), session_start_time=datetime.now(timezone.utc), session_end_time=datetime.now(timezone.utc) + timedelta(seconds=ttl))
-                await redis_client.save_user_session(redis_session, ttl=ttl)
+                ttl, ttl_delta = _TEACHER_TTL, _TEACHER_TTL_DELTA
+                now = datetime.now(timezone.utc)
+                redis_session = UserSessionRedis(user_data=user_data, session_id=uuid4(), session_start_time=now, session_end_time=now + ttl_delta)
+                await _store_session(redis_client, redis_session, ttl)
                 
-                token_payload = {"user_school_number": school_number} # Sadeleştirilmiş payload
-                access_token = create_access_token(data=token_payload, expires_delta=timedelta(seconds=ttl))
-                return LoginResponse(token=Token(access_token=access_token, token_type="bearer"), user=UserResponse.model_validate(user_data), schedule=None)
+                token_payload = {"user_school_number": school_number, "role": role} # Sadeleştirilmiş payload
+                access_token = create_access_token(data=token_payload, expires_delta=ttl_delta)
+                return LoginResponse(token=Token(access_token=access_token, token_type="bearer"), user=_user_response(user_data), schedule=None)
         except (ValueError, IndexError):
             return None # Geçersiz format
 
@@ -122,73 +174,78 @@ async def _handle_demo_login(username: str, password: str, redis_client: RedisCl
                 user_data = User(user_school_number=school_number, user_full_name=f"Demo Student {user_id}", role=role)
                 
                 # --- Refactor Değişikliği: TTL ile oturum kaydı ---
-                ttl = settings.STUDENT_SESSION_TTL_SECONDS
-                redis_session = UserSessionRedis(user_data=user_data, session_id=uuid4(), session_start_time=datetime.now(timezone.utc), session_end_time=datetime.now(timezone.utc) + timedelta(seconds=ttl), image_url=f"https://placehold.co/150x150/EFEFEF/333?text=DS{user_id}")
-                await redis_client.save_user_session(redis_session, ttl=ttl)
+                ttl, ttl_delta = _STUDENT_TTL, _STUDENT_TTL_DELTA
+                now = datetime.now(timezone.utc)
+                redis_session = UserSessionRedis(user_data=user_data, session_id=uuid4(), session_start_time=now, session_end_time=now + ttl_delta, image_url=f"https://placehold.co/150x150/EFEFEF/333?text=DS{user_id}")
+                await _store_session(redis_client, redis_session, ttl)
                 
-                token_payload = {"user_school_number": school_number} # Sadeleştirilmiş payload
-                access_token = create_access_token(data=token_payload, expires_delta=timedelta(seconds=ttl))
+                token_payload = {"user_school_number": school_number, "role": role} # Sadeleştirilmiş payload
+                access_token = create_access_token(data=token_payload, expires_delta=ttl_delta)
                 demo_schedule = [{"lesson_name": "Yazılım Mühendisliği", "teacher_name": "Dr. Ada Lovelace", "start_time": "09:00", "end_time": "11:00"}]
-                return LoginResponse(token=Token(access_token=access_token, token_type="bearer"), user=UserResponse.model_validate(user_data), schedule=demo_schedule)
+                return LoginResponse(token=Token(access_token=access_token, token_type="bearer"), user=_user_response(user_data), schedule=demo_schedule)
         except (ValueError, IndexError):
             return None
 
     return None
 
-async def _perform_login(username: str, password: str, redis_pool: redis.ConnectionPool) -> LoginResponse:
+async def _perform_login(username: str, password: str, redis_client: RedisClient, aksis_transport: httpx.AsyncHTTPTransport) -> LoginResponse:
     """Tüm giriş mantığını yürüten merkezi fonksiyon."""
     logger.info(f"Login attempt for user '{username}'.")
-    redis_client = RedisClient(pool=redis_pool)
 
     try:
-        if "demo" in username:
+        if username.startswith(_DEMO_PREFIXES):
             demo_response = await _handle_demo_login(username, password, redis_client)
             if demo_response:
                 logger.info(f"Demo user '{username}' logged in successfully.")
                 return demo_response
 
-        # Isolated HTTP client for this specific login session
-        async with httpx.AsyncClient(
+        # Bağlantı havuzu (transport) paylaşılır, çerez kutusu ise bu login'e özeldir.
+        # Client'ı kapatmıyoruz; kapatmak paylaşılan transport'u da kapatırdı.
+        http_client = httpx.AsyncClient(
+            transport=aksis_transport,
             timeout=30.0,
             follow_redirects=True,
             cookies=httpx.Cookies(),  # Fresh cookie jar for complete isolation
-            limits=httpx.Limits(max_keepalive_connections=5, max_connections=10)
-        ) as http_client:
-            aksis_client = AksisClient(school_number=username, password=password, http_client=http_client)
-            user_info = await aksis_client.login()
-            role = user_info.get("role")
-            
-            image_url, daily_schedule = None, None
-            school_number, full_name = "", ""
-
-            if role == "Teacher":
-                school_number = user_info.get("school_number", username)
-                full_name = user_info.get("full_name", "Unknown Teacher")
-                ttl = settings.TEACHER_SESSION_TTL_SECONDS
-            elif role == "Student":
-                profile_data = await aksis_client.get_obs_profile()
-                school_number = profile_data.get("school_number", username)
-                full_name = profile_data.get("full_name", "Unknown Student")
-                image_url = profile_data.get("image_url")
-                daily_schedule = await aksis_client.get_daily_schedule(datetime.now(timezone(timedelta(hours=3))))
-                ttl = settings.STUDENT_SESSION_TTL_SECONDS
-            else:
-                logger.error(f"Unexpected role from Aksis: {role}")
-                raise HTTPException(status_code=403, detail="Unknown user role from Aksis.")
-
-            user_data = User(user_school_number=school_number, user_full_name=full_name, role=role)
-            
-            # --- Refactor Değişikliği: UserSessionRedis ve TTL kullanımı ---
-            redis_session = UserSessionRedis(user_data=user_data, session_id=uuid4(), session_start_time=datetime.now(timezone.utc), session_end_time=datetime.now(timezone.utc) + timedelta(seconds=ttl), image_url=image_url)
-            await redis_client.save_user_session(redis_session, ttl=ttl)
-            logger.info(f"Redis session created for user '{username}' with a TTL of {ttl} seconds.")
-
-            # --- Refactor Değişikliği: Sadeleştirilmiş token payload ---
-            token_payload = {"user_school_number": school_number}
-            access_token = create_access_token(data=token_payload, expires_delta=timedelta(seconds=ttl))
-            
-            logger.info(f"User '{username}' ({role}) logged in successfully.")
-            return LoginResponse(token=Token(access_token=access_token, token_type="bearer"), user=UserResponse.model_validate(user_data), schedule=daily_schedule)
+        )
+        aksis_client = AksisClient(school_number=username, password=password, http_client=http_client)
+        user_info = await aksis_client.login()
+        role = user_info.get("role")
+        
+        image_url, daily_schedule = None, None
+        school_number, full_name = "", ""
+
+        if role == "Teacher":
+            school_number = user_info.get("school_number", username)
+            full_name = user_info.get("full_name", "Unknown Teacher")
+            ttl, ttl_delta = _TEACHER_TTL, _TEACHER_TTL_DELTA
+        elif role == "Student":
+            # Profil ve ders programı birbirinden bağımsızdır; aynı oturum çerezleriyle eşzamanlı çekilir.
+            profile_data, daily_schedule = await asyncio.gather(
+                aksis_client.get_obs_profile(),
+                aksis_client.get_daily_schedule(datetime.now(_ISTANBUL_TZ)),
+            )
+            school_number = profile_data.get("school_number", username)
+            full_name = profile_data.get("full_name", "Unknown Student")
+            image_url = profile_data.get("image_url")
+            ttl, ttl_delta = _STUDENT_TTL, _STUDENT_TTL_DELTA
+        else:
+            logger.error(f"Unexpected role from Aksis: {role}")
+            raise HTTPException(status_code=403, detail="Unknown user role from Aksis.")
+
+        user_data = User(user_school_number=school_number, user_full_name=full_name, role=role)
+        
+        # --- Refactor Değişikliği: UserSessionRedis ve TTL kullanımı ---
+        now = datetime.now(timezone.utc)
+        redis_session = UserSessionRedis(user_data=user_data, session_id=uuid4(), session_start_time=now, session_end_time=now + ttl_delta, image_url=image_url)
+        await _store_session(redis_client, redis_session, ttl)
+        logger.info(f"Redis session created for user '{username}' with a TTL of {ttl} seconds.")
+
+        # --- Refactor Değişikliği: Sadeleştirilmiş token payload ---
+        token_payload = {"user_school_number": school_number, "role": role}
+        access_token = create_access_token(data=token_payload, expires_delta=ttl_delta)
+        
+        logger.info(f"User '{username}' ({role}) logged in successfully.")
+        return LoginResponse(token=Token(access_token=access_token, token_type="bearer"), user=_user_response(user_data), schedule=daily_schedule)
 
     except AksisAuthError:
         logger.warning(f"Aksis authentication failed for user '{username}' (invalid credentials).")
@@ -208,10 +265,11 @@ async def _perform_login(username: str, password: str, redis_pool: redis.Connect
 async def login_for_access_token(
     request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    redis_pool: redis.ConnectionPool = Depends(get_redis_pool)
+    redis_client: RedisClient = Depends(get_redis_client),
+    aksis_transport: httpx.AsyncHTTPTransport = Depends(get_aksis_transport)
 ):
     """Standard OAuth2 endpoint for Swagger UI."""
-    login_response = await _perform_login(form_data.username, form_data.password, redis_pool)
+    login_response = await _perform_login(form_data.username, form_data.password, redis_client, aksis_transport)
     return login_response.token
 
 
@@ -220,27 +278,27 @@ async def login_for_access_token(
 async def login(
     request: Request,
     login_request: LoginRequest,
-    redis_pool: redis.ConnectionPool = Depends(get_redis_pool)
+    redis_client: RedisClient = Depends(get_redis_client),
+    aksis_transport: httpx.AsyncHTTPTransport = Depends(get_aksis_transport)
 ):
     """Login endpoint for mobile/web clients."""
-    return await _perform_login(login_request.username, login_request.password, redis_pool)
+    return await _perform_login(login_request.username, login_request.password, redis_client, aksis_transport)
 
 
-@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT, response_class=Response)
 @limiter.limit("2000/minute")
 async def logout(
     request: Request,
-    redis_pool: redis.ConnectionPool = Depends(get_redis_pool),
+    redis_client: RedisClient = Depends(get_redis_client),
     current_user: User = Depends(get_current_user)
 ):
     """User logout, deletes the session from Redis."""
     logger.info(f"User '{current_user.user_school_number}' logging out.")
+    _session_cache.pop(current_user.user_school_number, None)
     try:
-        redis_client = RedisClient(pool=redis_pool)
-        # --- Refactor Değişikliği: Yeni metot adı ---
+        # Gövdesiz 204 yanıtı dekoratördeki status_code'dan üretilir.
         await redis_client.delete_user_session(current_user.user_school_number)
         logger.info(f"Session for user '{current_user.user_school_number}' successfully deleted from Redis.")
-        return Response(status_code=status.HTTP_204_NO_CONTENT)
     except Exception as e:
         logger.error(f"Error during logout for user '{current_user.user_school_number}'.", exc_info=True)
         raise HTTPException(status_code=500, detail="An error occurred during logout.")
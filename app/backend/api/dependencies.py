@@ -1,63 +1,59 @@
 #app/backend/api/dependencies.py
-from fastapi import Request,Depends
-import redis.asyncio as redis
-import asyncpg
+import logging
+from fastapi import Request
+import httpx
 
 # Servis ve istemci sınıflarını import etmemiz gerekiyor
 from ..db.redis_client import RedisClient
-from ..db.db_client import AsyncPostgresClient
+from ..db.db_client import request_connection_scope
 from ..services.teacher_service import TeacherService
 from ..services.student_service import StudentService # YENİ: StudentService import edildi
 
+logger = logging.getLogger(__name__)
 
-def get_redis_pool(request: Request) -> redis.ConnectionPool:
+# İstemci IP'sinin okunacağı proxy başlıkları, tercih sırasına göre.
+_IP_HEADERS = ("cf-connecting-ip", "x-real-ip", "x-forwarded-for")
+
+
+async def get_aksis_transport(request: Request) -> httpx.AsyncHTTPTransport:
     """
-    Uygulamanın state'inden Redis bağlantı havuzunu alır ve bir bağımlılık olarak sağlar.
+    Uygulamanın state'inden Aksis için paylaşılan HTTP bağlantı havuzunu (transport) alır.
     """
-    return request.app.state.redis_pool
+    return request.app.state.aksis_transport
 
-def get_postgres_pool(request: Request) -> asyncpg.Pool:
+async def get_redis_client(request: Request) -> RedisClient:
     """
-    Uygulamanın state'inden PostgreSQL bağlantı havuzunu alır ve bir bağımlılık olarak sağlar.
+    Uygulama başlangıcında havuz başına bir kez oluşturulan RedisClient nesnesini döndürür.
     """
-    return request.app.state.postgres_pool
+    return request.app.state.redis_client
 
 
-def get_teacher_service(
-    redis_pool: redis.ConnectionPool = Depends(get_redis_pool),
-    postgres_pool: asyncpg.Pool = Depends(get_postgres_pool)
-) -> TeacherService:
+async def db_connection_scope():
     """
-    Her istek için yeni bir TeacherService nesnesi oluşturur.
-    
-    Bu fonksiyon, FastAPI'nin Bağımlılık Enjeksiyonu sistemi tarafından kullanılır.
-    Her endpoint çağrıldığında, FastAPI bu fonksiyonu çalıştırır. Fonksiyon,
-    uygulama başlangıcında oluşturulan paylaşımlı bağlantı havuzlarını (pools)
-    kullanarak yeni istemci ve servis nesneleri oluşturur ve bunları endpoint'e verir.
+    İstek boyunca tüm veritabanı çağrılarının tek bir havuz bağlantısını paylaşmasını sağlar.
+    Bağlantı ilk sorguda alınır, istek bitince havuza iade edilir.
     """
-    # 1. Paylaşımlı havuzları kullanarak istemcileri (clients) oluştur
-    redis_client = RedisClient(pool=redis_pool)
-    db_client = AsyncPostgresClient(pool=postgres_pool)
-    
-    # 2. İstemcileri kullanarak servisi oluştur ve döndür
-    return TeacherService(redis_client=redis_client, db_client=db_client)
+    async with request_connection_scope():
+        yield
 
 
-def get_student_service(
-    redis_pool: redis.ConnectionPool = Depends(get_redis_pool),
-    postgres_pool: asyncpg.Pool = Depends(get_postgres_pool)
-) -> StudentService:
+async def get_teacher_service(request: Request) -> TeacherService:
     """
-    Her istek için yeni bir StudentService nesnesi oluşturur.
+    Uygulama başlangıcında bir kez oluşturulan TeacherService nesnesini döndürür.
     
-    TeacherService ile aynı mantıkla çalışır: Paylaşımlı havuzları kullanarak
-    her istek için taze bir servis nesnesi yaratır ve bunu öğrenci endpoint'lerine
-    sağlar.
+    Servisler durumsuzdur (yalnızca paylaşımlı istemcileri tutarlar); bu yüzden
+    her istek için yeni bir nesne grafiği kurmak yerine tek bir örnek kullanılır.
+    """
+    return request.app.state.teacher_service
+
+
+async def get_student_service(request: Request) -> StudentService:
     """
-    redis_client = RedisClient(pool=redis_pool)
-    db_client = AsyncPostgresClient(pool=postgres_pool)
+    Uygulama başlangıcında bir kez oluşturulan StudentService nesnesini döndürür.
     
-    return StudentService(redis_client=redis_client, db_client=db_client)
+    TeacherService ile aynı mantıkla çalışır.
+    """
+    return request.app.state.student_service
 
 
 
@@ -66,22 +62,18 @@ async def get_client_ip(request: Request) -> str | None:
     İstemcinin gerçek IP adresini proxy başlıklarından okur.
     Nginx, CloudFlare gibi proxy'ler için çoklu başlık desteği.
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Debug: Log all headers to see what's available
-    logger.info(f"All request headers: {dict(request.headers)}")
-    
-    # Try multiple headers in order of preference
-    for header_name in ["cf-connecting-ip", "x-real-ip", "x-forwarded-for"]:
-        header = request.headers.get(header_name)
-        if header:
-            # X-Forwarded-For can be "client, proxy1, proxy2" - take the first (leftmost) IP
-            client_ip = header.split(",")[0].strip()
-            logger.info(f"Found client IP '{client_ip}' from header '{header_name}': '{header}'")
-            return client_ip
+    headers = request.headers
+    header_name = next((h for h in _IP_HEADERS if headers.get(h)), None)
+    if header_name:
+        header = headers[header_name]
+        # X-Forwarded-For can be "client, proxy1, proxy2" - take the first (leftmost) IP
+        # str.find ilk virgülde durur; split'in aksine liste oluşturmaz.
+        idx = header.find(",")
+        client_ip = (header[:idx] if idx >= 0 else header).strip()
+        logger.debug("Found client IP '%s' from header '%s': '%s'", client_ip, header_name, header)
+        return client_ip
     
     # Fallback to direct connection IP
     direct_ip = request.client.host if request.client else None
-    logger.info(f"Using direct client IP: '{direct_ip}'")
-    return direct_ip
\ No newline at end of file
+    logger.debug("Using direct client IP: '%s'", direct_ip)
+    return direct_ip
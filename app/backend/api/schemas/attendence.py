@@ -4,6 +4,9 @@ from datetime import datetime
 from typing import Optional
 import re
 
+# Matches the exact YYYY-MM-DDTHH:MM:SS.sssZ format, including 3 millisecond digits.
+_UTC_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z$")
+
 class AttendanceCreateRequest(BaseModel):
     """Request model for creating a new attendance session."""
     lesson_name: str = Field(..., description="The name of the lesson, e.g., 'Calculus I'.")
@@ -18,9 +21,8 @@ class AttendanceCreateRequest(BaseModel):
         YYYY-MM-DDTHH:MM:SS.sssZ format.
         """
         if isinstance(v, str):
-            # This regex ensures the exact format, including 3 millisecond digits.
-            utc_format_regex = r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z$"
-            if not re.match(utc_format_regex, v):
+            # Cheap structural checks first; the regex only runs on plausible strings.
+            if not (len(v) == 24 and v[-1] == 'Z' and v[4] == '-' and v[10] == 'T') or not _UTC_RE.match(v):
                 raise ValueError("Invalid format. Must be YYYY-MM-DDTHH:MM:SS.sssZ")
             
             # The format is correct, so we can now safely parse it.
@@ -4,6 +4,7 @@ from fastapi import (
 )
 from typing import List, Optional
 from uuid import UUID
+from functools import lru_cache
 
 from ..services.student_service import StudentService, ServiceError
 from ..models.db_models import User
@@ -18,9 +19,18 @@ from .utilities.limiter import limiter
 
 router = APIRouter(prefix="/student", tags=["Student Endpoints"])
 
+@lru_cache(maxsize=10_000)
+def _user_response_for(school_number: str, full_name: str, role: str) -> UserResponse:
+    """
+    Memoizes the response block for a user. The key is the full (number, name, role)
+    tuple, so a changed name or role simply produces a new entry and no explicit
+    invalidation is needed on logout.
+    """
+    return UserResponse.model_construct(user_school_number=school_number, user_full_name=full_name, role=role)
+
 def _verify_student_role(user: User):
     """Helper function to verify the current user is a student."""
-    if "Student" not in user.role:
+    if user.role != "Student":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="This operation is only valid for students."
@@ -71,20 +81,20 @@ async def attend_to_attendance(
     """
     _verify_student_role(user)
 
-    normal_image_bytes = await normal_image.read() if normal_image else None
-    
     try:
+        # The upload is handed over unread; the service reads it only when the session
+        # actually requires face verification and the attend lock is held.
         created_record = await service.attend_to_attendance(
             student=user,
             attendance_id=attendance_id,
             student_ip=client_ip,
-            normal_image_bytes=normal_image_bytes
+            normal_image=normal_image
         )
         
         # Enrich the response with the student's own user data
         return AttendanceRecordResponse(
             **created_record.model_dump(),
-            student=UserResponse.model_validate(user)
+            student=_user_response_for(user.user_school_number, user.user_full_name, user.role)
         )
     except ServiceError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
@@ -120,5 +130,5 @@ async def get_my_attendance_status(
 
     return AttendanceRecordResponse(
         **record.model_dump(),
-        student=UserResponse.model_validate(user)
+        student=_user_response_for(user.user_school_number, user.user_full_name, user.role)
     )
@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
+from fastapi.responses import ORJSONResponse
 from typing import List, Union, Optional
 from uuid import UUID
 from datetime import datetime, timezone
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 
 # --- Gerekli tüm şemalar, servisler, modeller ve bağımlılıklar ---
-from ..services.teacher_service import TeacherService, ServiceError, AuthorizationError
+from ..services.teacher_service import TeacherService, ServiceError, AuthorizationError, EnrichedAttendanceRecord
 from ..models.db_models import User, Attendance
 from ..models.redis_models import AttendanceRedis
 from .schemas.attendence import (
@@ -19,7 +20,7 @@ from .schemas.attendence_record import (
 )
 from .schemas.user import UserResponse
 from .auth import get_current_user
-from .dependencies import get_teacher_service, get_client_ip
+from .dependencies import get_teacher_service, get_client_ip, db_connection_scope
 from .utilities.limiter import limiter
 
 # --- Endpoint'e Özel İstek Modelleri ---
@@ -35,15 +36,38 @@ class AddStudentToHistoricalRequest(BaseModel):
     reason: Optional[str] = Field(None, description="Eğer katılmadıysa, başarısızlık nedeni.")
 
 
-router = APIRouter(prefix="/teacher", tags=["Teacher Endpoints"])
-
 # --- YARDIMCI (HELPER) FONKSİYONLAR ---
 
-def _verify_teacher_role(user: User):
-    if "Teacher" not in user.role:
+async def require_teacher(user: User = Depends(get_current_user)) -> User:
+    """
+    Router seviyesinde çalışan rol kontrolü. Rol her zaman tam olarak "Teacher" ya da "Student"
+    olduğu için alt dize araması yerine eşitlik karşılaştırması yapılır.
+    """
+    if user.role != "Teacher":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="This operation is only valid for teachers.")
+    return user
+
+
+router = APIRouter(prefix="/teacher", tags=["Teacher Endpoints"], default_response_class=ORJSONResponse, dependencies=[Depends(db_connection_scope), Depends(require_teacher)])
 
-async def _get_and_verify_owner(attendance_id: UUID, user: User, service: TeacherService) -> Union[Attendance, AttendanceRedis]:
+# AttendanceRecordResponse'un alanları; liste endpoint'inde kayıtlar doğrudan bu alanlarla dump edilir.
+# İç içe 'student' da tam User modeli yerine yalnızca UserResponse alanlarıyla sınırlanır.
+_RECORD_RESPONSE_FIELDS = {
+    **{name: True for name in AttendanceRecordResponse.model_fields if name != "student"},
+    "student": set(UserResponse.model_fields),
+}
+
+# Liste endpoint'leri için derlenmiş serileştiriciler: pydantic-core listeyi ara dict
+# oluşturmadan doğrudan JSON byte'larına yazar.
+_ATTENDANCE_LIST_ADAPTER = TypeAdapter(List[AttendanceResponse])
+_RECORD_LIST_ADAPTER = TypeAdapter(List[EnrichedAttendanceRecord])
+
+async def verified_attendance_owner(attendance_id: UUID, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)) -> Union[Attendance, AttendanceRedis]:
+    """
+    Sahiplik kontrolünü tek bir bağımlılıkta yapar ve bulunan yoklamayı döndürür. Rol kontrolü router
+    seviyesindeki require_teacher'da yapılır; get_current_user ve get_teacher_service, FastAPI'nin
+    istek içi önbelleği sayesinde endpoint ile paylaşılır.
+    """
     try:
         return await service.get_and_verify_attendance_owner(attendance_id, user)
     except AuthorizationError as e:
@@ -56,7 +80,6 @@ async def _get_and_verify_owner(attendance_id: UUID, user: User, service: Teache
 @router.post("/attendances", response_model=AttendanceResponse, status_code=status.HTTP_201_CREATED, summary="Start a new attendance session")
 @limiter.limit("5/minute")
 async def start_attendance(request: Request, create_request: AttendanceCreateRequest, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service), client_ip: str = Depends(get_client_ip)):
-    _verify_teacher_role(user)
     try:
         new_session = await service.start_attendance(teacher=user, lesson_name=create_request.lesson_name, ip_address=client_ip, start_time=create_request.start_time, end_time=create_request.end_time, security_option=create_request.security_option)
         return new_session
@@ -65,9 +88,7 @@ async def start_attendance(request: Request, create_request: AttendanceCreateReq
 
 @router.post("/attendances/{attendance_id}/finish", status_code=status.HTTP_204_NO_CONTENT, summary="Finish an active attendance session")
 @limiter.limit("5/minute")
-async def finish_attendance(request: Request, attendance_id: UUID, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    await _get_and_verify_owner(attendance_id, user, service)
+async def finish_attendance(request: Request, attendance_id: UUID, _: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
     try:
         await service.finish_attendance(teacher=user, attendance_id=attendance_id)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -77,27 +98,33 @@ async def finish_attendance(request: Request, attendance_id: UUID, user: User =
 @router.get("/attendances/live", response_model=Optional[AttendanceResponse], summary="Get the single active attendance session for the teacher")
 @limiter.limit("60/minute")
 async def get_live_attendance(request: Request, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
     live_session = await service.get_live_attendance_by_teacher(teacher=user)
     return live_session
 
 @router.get("/attendances/historical", response_model=List[AttendanceResponse], summary="List all past (historical) attendances for the teacher")
 @limiter.limit("10/minute")
 async def get_historical_attendances(request: Request, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
     attendances_from_db = await service.get_historical_attendances(teacher=user)
-    response = []
-    for att in attendances_from_db:
-        att_dict = att.model_dump()
-        att_dict['teacher_full_name'] = user.user_full_name
-        response.append(AttendanceResponse(**att_dict))
-    return response
+    # Veritabanından gelen veriler zaten doğrulanmış; dump + yeniden doğrulama yerine model_construct.
+    teacher_full_name = user.user_full_name
+    response = [
+        AttendanceResponse.model_construct(
+            attendance_id=att.attendance_id,
+            teacher_school_number=att.teacher_school_number,
+            teacher_full_name=teacher_full_name,
+            lesson_name=att.lesson_name,
+            start_time=att.start_time,
+            end_time=att.end_time,
+            security_option=att.security_option,
+            ip_address=att.ip_address,
+        )
+        for att in attendances_from_db
+    ]
+    return Response(content=_ATTENDANCE_LIST_ADAPTER.dump_json(response), media_type="application/json")
 
 @router.delete("/attendances/{attendance_id}", status_code=status.HTTP_204_NO_CONTENT, summary="Delete a historical attendance session")
 @limiter.limit("5/minute")
-async def delete_attendance(request: Request, attendance_id: UUID, delete_request: AttendanceDeleteRequest, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    await _get_and_verify_owner(attendance_id, user, service)
+async def delete_attendance(request: Request, attendance_id: UUID, delete_request: AttendanceDeleteRequest, _: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), service: TeacherService = Depends(get_teacher_service)):
     await service.delete_attendance(attendance_id=attendance_id, reason=delete_request.reason)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -105,20 +132,18 @@ async def delete_attendance(request: Request, attendance_id: UUID, delete_reques
 
 @router.get("/attendances/{attendance_id}/records", response_model=List[AttendanceRecordResponse], summary="Get all records for a specific attendance session")
 @limiter.limit("60/minute")
-async def get_attendance_records(request: Request, attendance_id: UUID, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    attendance = await _get_and_verify_owner(attendance_id, user, service)
-    is_live = isinstance(attendance, AttendanceRedis)
-    enriched_records = await service.get_live_attendance_records(attendance_id) if is_live else await service.get_historical_attendance_records(attendance_id)
-    return enriched_records
+async def get_attendance_records(request: Request, attendance_id: UUID, attendance: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), service: TeacherService = Depends(get_teacher_service)):
+    enriched_records = await service.get_records(attendance)
+    return Response(
+        content=_RECORD_LIST_ADAPTER.dump_json(enriched_records, include={"__all__": _RECORD_RESPONSE_FIELDS}),
+        media_type="application/json",
+    )
 
 # --- Canlı Yoklama Kayıt İşlemleri ---
 
 @router.post("/attendances/{attendance_id}/live/records/{student_school_number}/accept", response_model=AttendanceRecordResponse, summary="Manually accept a student's attendance in a live session")
 @limiter.limit("200/minute")
-async def accept_student_in_live_attendance(request: Request, attendance_id: UUID, student_school_number: str, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    await _get_and_verify_owner(attendance_id, user, service)
+async def accept_student_in_live_attendance(request: Request, attendance_id: UUID, student_school_number: str, _: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), service: TeacherService = Depends(get_teacher_service)):
     try:
         updated_record = await service.accept_student_attendance(attendance_id, student_school_number)
         if not updated_record:
@@ -129,9 +154,7 @@ async def accept_student_in_live_attendance(request: Request, attendance_id: UUI
 
 @router.post("/attendances/{attendance_id}/live/records/{student_school_number}/fail", response_model=AttendanceRecordResponse, summary="Manually fail a student in a live session")
 @limiter.limit("200/minute")
-async def fail_student_in_live_attendance(request: Request, attendance_id: UUID, student_school_number: str, fail_request: FailStudentRequest, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    await _get_and_verify_owner(attendance_id, user, service)
+async def fail_student_in_live_attendance(request: Request, attendance_id: UUID, student_school_number: str, fail_request: FailStudentRequest, _: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), service: TeacherService = Depends(get_teacher_service)):
     try:
         updated_record = await service.fail_student_in_live_attendance(attendance_id, student_school_number, fail_request.reason)
         if not updated_record:
@@ -145,9 +168,7 @@ async def fail_student_in_live_attendance(request: Request, attendance_id: UUID,
 # --- REFACTORED ENDPOINT ---
 @router.post("/attendances/{attendance_id}/historical/records", status_code=status.HTTP_201_CREATED, summary="Manually add a student to a historical attendance")
 @limiter.limit("200/minute")
-async def add_student_to_historical_attendance(request: Request, attendance_id: UUID, add_request: AddStudentToHistoricalRequest, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    await _get_and_verify_owner(attendance_id, user, service)
+async def add_student_to_historical_attendance(request: Request, attendance_id: UUID, add_request: AddStudentToHistoricalRequest, _: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), service: TeacherService = Depends(get_teacher_service)):
     try:
         # Use the provided full name instead of a placeholder.
         student_to_add = User(
@@ -162,9 +183,7 @@ async def add_student_to_historical_attendance(request: Request, attendance_id:
 
 @router.post("/attendances/{attendance_id}/historical/records/{student_school_number}/accept", summary="Manually accept a student in a historical attendance", status_code=status.HTTP_200_OK)
 @limiter.limit("200/minute")
-async def accept_student_in_historical_attendance(request: Request, attendance_id: UUID, student_school_number: str, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    await _get_and_verify_owner(attendance_id, user, service)
+async def accept_student_in_historical_attendance(request: Request, attendance_id: UUID, student_school_number: str, _: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), service: TeacherService = Depends(get_teacher_service)):
     try:
         await service.accept_student_in_historical_attendance(attendance_id, student_school_number)
         return {"status": "success", "detail": f"Student {student_school_number} in attendance {attendance_id} marked as successful."}
@@ -173,9 +192,7 @@ async def accept_student_in_historical_attendance(request: Request, attendance_i
 
 @router.post("/attendances/{attendance_id}/historical/records/{student_school_number}/fail", summary="Manually fail a student in a historical attendance", status_code=status.HTTP_200_OK)
 @limiter.limit("200/minute")
-async def fail_student_in_historical_attendance(request: Request, attendance_id: UUID, student_school_number: str, fail_request: FailStudentRequest, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    await _get_and_verify_owner(attendance_id, user, service)
+async def fail_student_in_historical_attendance(request: Request, attendance_id: UUID, student_school_number: str, fail_request: FailStudentRequest, _: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), service: TeacherService = Depends(get_teacher_service)):
     try:
         await service.fail_student_in_historical_attendance(attendance_id, student_school_number, fail_request.reason)
         return {"status": "success", "detail": f"Student {student_school_number} in attendance {attendance_id} marked as failed."}
@@ -184,9 +201,7 @@ async def fail_student_in_historical_attendance(request: Request, attendance_id:
 
 @router.delete("/attendances/{attendance_id}/records/{student_school_number}", status_code=status.HTTP_204_NO_CONTENT, summary="Delete a student's record from a historical attendance")
 @limiter.limit("200/minute")
-async def delete_student_from_attendance(request: Request, attendance_id: UUID, student_school_number: str, delete_request: AttendanceRecordDeleteRequest, user: User = Depends(get_current_user), service: TeacherService = Depends(get_teacher_service)):
-    _verify_teacher_role(user)
-    await _get_and_verify_owner(attendance_id, user, service)
+async def delete_student_from_attendance(request: Request, attendance_id: UUID, student_school_number: str, delete_request: AttendanceRecordDeleteRequest, _: Union[Attendance, AttendanceRedis] = Depends(verified_attendance_owner), service: TeacherService = Depends(get_teacher_service)):
     try:
         rows_deleted = await service.delete_student_from_attendance(attendance_id, student_school_number, delete_request.reason)
         if not rows_deleted:
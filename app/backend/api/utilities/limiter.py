@@ -1,7 +1,9 @@
 # app/backend/api/utilities/limiter.py
 
+from typing import Optional, Tuple
 from fastapi import Request
 import jwt
+from cachetools import TTLCache
 
 # Gerekli slowapi ve ayar importları
 from slowapi import Limiter
@@ -10,6 +12,55 @@ from slowapi.util import get_remote_address
 # config.py'den ayarları import et
 from ...config.config import settings
 
+# Token -> (okul numarası, rol). Aynı token her istekte tekrar geldiği için
+# HMAC + base64 + JSON çözümlemesi yalnızca ilk istekte yapılır.
+_key_cache: TTLCache = TTLCache(maxsize=65_536, ttl=60)
+
+# Anahtar ve algoritma listesi modül yüklenirken bir kez hazırlanır.
+# İmza doğrulaması bilerek atlanmaz: doğrulanmamış bir token ile her istekte farklı bir
+# okul numarası uydurularak (ör. login denemelerinde) IP bazlı limit aşılabilirdi.
+_SIGNING_KEY = settings.SECRET_KEY.encode('utf-8')
+_ALGORITHMS = [settings.ALGORITHM]
+_DECODE_OPTIONS = {"verify_exp": False}
+
+
+def _decode_claims(token: str) -> Optional[Tuple[str, Optional[str]]]:
+    """Token'dan (okul numarası, rol) çiftini çözer; geçersizse None döner."""
+    try:
+        # Token'ın süresinin dolup dolmadığını kontrol etmeye gerek yok,
+        # sadece içindeki kullanıcı kimliğini almak istiyoruz.
+        payload = jwt.decode(token, _SIGNING_KEY, algorithms=_ALGORITHMS, options=_DECODE_OPTIONS)
+    except jwt.PyJWTError:
+        return None
+    user_school_number = payload.get("user_school_number")
+    if not user_school_number:
+        return None
+    return user_school_number, payload.get("role")
+
+
+def bearer_token(auth_header: Optional[str]) -> Optional[str]:
+    """Authorization başlığından bearer token'ı döndürür."""
+    # Yalnızca 7 karakterlik önek küçük harfe çevrilir; token liste oluşturmadan dilimlenir.
+    if auth_header and auth_header[:7].lower() == "bearer ":
+        return auth_header[7:].strip()
+    return None
+
+
+def token_claims(token: str) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    İmzası doğrulanmış token'ın (okul numarası, rol) bilgisini önbellekten ya da
+    çözümleyerek döndürür. Rol, eski token'larda bulunmadığı için None olabilir.
+    """
+    # Anahtar tüm token'dır: yalnızca imza segmenti kullanılsaydı, başlığı ya da payload'ı
+    # değiştirilip imzası yeniden kullanılan bir token başka bir kullanıcının kimliğini alırdı.
+    claims = _key_cache.get(token)
+    if claims is None:
+        claims = _decode_claims(token)
+        if claims:
+            _key_cache[token] = claims
+    return claims
+
+
 def get_limiter_key(request: Request) -> str:
     """
     Rate limit için bir anahtar döndürür.
@@ -17,24 +68,12 @@ def get_limiter_key(request: Request) -> str:
     Yoksa, istemcinin IP adresini kullanır. Bu, hem giriş yapmış hem de yapmamış
     kullanıcılar için esnek bir limit stratejisi sağlar.
     """
-    auth_header = request.headers.get("authorization")
-    if auth_header and auth_header.lower().startswith("bearer "):
-        token = auth_header.split(" ")[1]
-        try:
-            # Token'ın süresinin dolup dolmadığını kontrol etmeye gerek yok,
-            # sadece içindeki kullanıcı kimliğini almak istiyoruz.
-            payload = jwt.decode(
-                token, 
-                settings.SECRET_KEY, 
-                algorithms=[settings.ALGORITHM], 
-                options={"verify_exp": False}
-            )
-            user_school_number: str = payload.get("user_school_number")
-            if user_school_number:
-                return user_school_number
-        except jwt.PyJWTError:
-            # Token geçersizse veya decode edilemezse, IP bazlı limite geri dön.
-            pass
+    token = bearer_token(request.headers.get("authorization"))
+    if token:
+        claims = token_claims(token)
+        if claims:
+            return claims[0]
+        # Token geçersizse veya decode edilemezse, IP bazlı limite geri dön.
             
     # Güvenli fallback: Her zaman bir anahtar döndür.
     return get_remote_address(request)
@@ -0,0 +1,63 @@
+# app/backend/api/utilities/role_guard.py
+
+import time
+from typing import Optional, Tuple
+
+import jwt
+from cachetools import TTLCache
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ...config.config import settings
+from .limiter import bearer_token
+
+# Token -> (rol, son geçerlilik zamanı). Limiter'ın önbelleğinden ayrıdır: orada süre
+# kontrolü bilerek atlanır, burada ise yetki kararı verildiği için süresi dolmuş bir
+# token'ın rolüne güvenilmez. Anahtar tüm token'dır.
+_role_cache: TTLCache = TTLCache(maxsize=65_536, ttl=60)
+_SIGNING_KEY = settings.SECRET_KEY.encode('utf-8')
+_ALGORITHMS = [settings.ALGORITHM]
+
+
+def _token_role(token: str) -> Optional[str]:
+    """Süresi dolmamış ve imzası geçerli token'ın rolünü döndürür; aksi halde None."""
+    cached: Optional[Tuple[Optional[str], float]] = _role_cache.get(token)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+    try:
+        payload = jwt.decode(token, _SIGNING_KEY, algorithms=_ALGORITHMS)
+    except jwt.PyJWTError:
+        # Süresi dolmuş token'lar da buraya düşer; 401'i get_current_user verir.
+        return None
+    # Token'ın kendi 'exp' değerinden sonra önbellekten asla kullanılmaması için saklıyoruz.
+    if payload.get("exp"):
+        _role_cache[token] = (payload.get("role"), payload["exp"])
+    return payload.get("role")
+
+
+class TeacherRoleGuard:
+    """
+    Öğretmen rotalarına gelen ve token'ındaki 'role' claim'i "Teacher" olmayan istekleri,
+    bağımlılık zinciri (Redis oturum kontrolü, servisler) çalışmadan 403 ile reddeder.
+
+    Bu yalnızca erken bir kısayoldur; asıl yetki kontrolü router'daki require_teacher'dadır.
+    Token yoksa, geçersizse, süresi dolmuşsa ya da rol claim'i taşımıyorsa (eski token'lar)
+    istek olduğu gibi geçer; bu durumlarda doğru yanıtı (ör. 401) bağımlılık zinciri verir.
+    """
+
+    def __init__(self, app: ASGIApp, path_prefix: str = "/api/v1/teacher"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(self.path_prefix):
+            token = bearer_token(Headers(scope=scope).get("authorization"))
+            role = _token_role(token) if token else None
+            if role is not None and role != "Teacher":
+                response = ORJSONResponse(
+                    {"detail": "This operation is only valid for teachers."}, status_code=403
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
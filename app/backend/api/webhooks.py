@@ -1,38 +1,44 @@
-import hmac
-import hashlib
-import json
-import uuid
-from datetime import datetime, timezone
-from fastapi import APIRouter, Request, HTTPException, Header, Depends
+from fastapi import APIRouter, Request, HTTPException, Header, Depends, Path
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, ValidationError
-from uuid import UUID
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, hmac
 
 
 # Bağımlılıkları ve modelleri doğru yerden import edelim
 from ..db.redis_client import RedisClient
 from ..config.config import settings
-from .dependencies import get_redis_pool
-import redis.asyncio as redis
+from ..tools.clock import utcnow_ms
+from .dependencies import get_redis_client
 from .utilities.limiter import limiter
 
 # .env dosyanıza ekleyeceğiniz gizli anahtar
 WEBHOOK_SECRET_KEY = settings.WEBHOOK_SECRET_KEY.encode('utf-8')
+# Doğrulama sonucu birkaç yüz byte'lık bir JSON; bunun çok üzerindeki gövdeler reddedilir.
+MAX_WEBHOOK_BODY_BYTES = 64 * 1024
 
-router = APIRouter(prefix="/webhooks",tags=["Microservice Webhooks"])
+# Doğrulama ID'leri 22 karakterlik URL-güvenli base64; eski sürümün oluşturduğu UUID'ler (36 karakter) de kabul edilir.
+VERIFICATION_ID_PATTERN = r"^[A-Za-z0-9_-]{22,36}$"
+
+router = APIRouter(prefix="/webhooks",tags=["Microservice Webhooks"], default_response_class=ORJSONResponse)
 
 class VerificationResultPayload(BaseModel):
     verification_passed: bool
     reason: str
 
-def get_webhook_redis_client(redis_pool: redis.ConnectionPool = Depends(get_redis_pool)) -> RedisClient:
-    return RedisClient(pool=redis_pool)
+class WebhookBody(BaseModel):
+    """Mikroservisin gönderdiği gövde; ham JSON tek geçişte bu modele çözülür."""
+    overall_result: VerificationResultPayload
+
+async def get_webhook_redis_client(redis_client: RedisClient = Depends(get_redis_client)) -> RedisClient:
+    return redis_client
 
 
 @router.post("/verification-result/{verification_id}")
 @limiter.limit("200/minute")
 async def update_attendance_from_webhook(
-    verification_id: uuid.UUID,
     request: Request,
+    verification_id: str = Path(..., pattern=VERIFICATION_ID_PATTERN),
     x_webhook_signature: str = Header(..., description="HMAC-SHA256 imzası"),
     redis_client: RedisClient = Depends(get_webhook_redis_client)
 ):
@@ -40,48 +46,61 @@ async def update_attendance_from_webhook(
     Mikroservisten gelen sonucu alır, doğrular ve yoklama kaydını günceller.
     """
     # 1. GÜVENLİK: İmzanın doğruluğunu kontrol et
-    raw_body = await request.body()
-    expected_signature = hmac.new(key=WEBHOOK_SECRET_KEY, msg=raw_body, digestmod=hashlib.sha256).hexdigest()
+    try:
+        received_signature = bytes.fromhex(x_webhook_signature)
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Geçersiz webhook imzası.")
 
-    if not hmac.compare_digest(expected_signature, x_webhook_signature):
+    # Gövde parça parça okunur: her parça aynı geçişte hem HMAC'e beslenir hem de
+    # ayrıştırma için biriktirilir. Beklenenden büyük gövdeler okunmadan reddedilir.
+    # cryptography'nin HMAC'i OpenSSL EVP üzerinde çalışır; verify() sabit zamanlı karşılaştırma yapar.
+    mac = hmac.HMAC(WEBHOOK_SECRET_KEY, hashes.SHA256())
+    raw_body = bytearray()
+    async for chunk in request.stream():
+        if len(raw_body) + len(chunk) > MAX_WEBHOOK_BODY_BYTES:
+            raise HTTPException(status_code=413, detail="Webhook gövdesi çok büyük.")
+        mac.update(chunk)
+        raw_body += chunk
+
+    try:
+        mac.verify(received_signature)
+    except InvalidSignature:
         raise HTTPException(status_code=403, detail="Geçersiz webhook imzası.")
 
     # 2. PAYLOAD'I AYRIŞTIR
+    # model_validate_json, ara bir dict oluşturmadan doğrudan ham byte'lardan doğrular.
     try:
-        data = json.loads(raw_body)
-        payload = VerificationResultPayload(**data.get('overall_result', {}))
-    except (json.JSONDecodeError, ValidationError, KeyError) as e:
+        payload = WebhookBody.model_validate_json(raw_body).overall_result
+    except ValidationError as e:
         raise HTTPException(status_code=422, detail=f"Hatalı payload formatı: {e}")
 
     # 3. MANTIK: MEVCUT REDIS METODLARINI KULLAN
     # Bu doğrulama ID'sine karşılık gelen öğrenci ve yoklama bilgilerini al
-    verification_data = await redis_client.get_user_and_attendance_for_verification(str(verification_id))
+    # Eşleşme okunurken silinir (GETDEL); aynı sonucun tekrar gönderilmesi "işlenmiş" sayılır.
+    verification_data = await redis_client.pop_user_and_attendance_for_verification(verification_id)
     if not verification_data:
         return {"status": "İşlem bulunamadı veya zaten işlenmiş."}
 
     user_school_number = verification_data["user_school_number"]
-    attendance_id = UUID(verification_data["attendance_id"])
+    # Yoklama ID'si yalnızca anahtar oluşturmak için kullanıldığından UUID'ye geri çevrilmez.
+    attendance_id = verification_data["attendance_id"]
 
     # Mevcut yoklama kaydını getir
     attendance_record = await redis_client.get_attendance_record_by_id(attendance_id, user_school_number)
     if not attendance_record:
-        # Bu bir "edge case" ama yine de handle edelim
-        await redis_client.delete_verification_mapping(str(verification_id))
+        # Bu bir "edge case" ama yine de handle edelim (eşleşme zaten silindi)
         raise HTTPException(status_code=404, detail="Yoklama kaydı bulunamadı.")
 
     # Kaydı güncelle
     if payload.verification_passed:
         attendance_record.is_attended = True
-        attendance_record.attendance_time = datetime.now(timezone.utc)
+        attendance_record.attendance_time = utcnow_ms()
         attendance_record.fail_reason = None
     else:
         attendance_record.is_attended = False
         attendance_record.fail_reason = f"FACE_VERIFICATION_FAILED: {payload.reason}"
 
-    # Güncellenmiş kaydı Redis'e geri yaz
+    # Güncellenmiş kaydı Redis'e geri yaz (geçici eşleşme okunurken zaten silindi)
     await redis_client.update_attendance_record(attendance_record)
 
-    # 4. TEMİZLİK: Geçici eşleşmeyi sil
-    await redis_client.delete_verification_mapping(str(verification_id))
-
     return {"status": "success"}
\ No newline at end of file
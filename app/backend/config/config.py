@@ -1,11 +1,14 @@
 import os
+from dataclasses import dataclass
 from dotenv import load_dotenv
 
 load_dotenv()
 
+@dataclass(frozen=True, slots=True)
 class Config:
     """
     Ortam değişkenlerinden ayarları doğrudan ve basit bir şekilde tutan sınıf.
+    Ayarlar başlangıçta bir kez okunur; örnek değiştirilemez (frozen) ve __dict__ taşımaz (slots).
     """
     # Veritabanı
     DATABASE_URL: str = os.environ.get("DATABASE_URL")
@@ -28,6 +31,10 @@ class Config:
     TEACHER_TOKEN_EXPIRE_MINUTES: int = int(os.environ.get("TEACHER_TOKEN_EXPIRE_MINUTES", 60))
     TEACHER_SESSION_TTL_SECONDS: int = int(os.environ.get("TEACHER_SESSION_TTL_SECONDS", 3600))
     STUDENT_SESSION_TTL_SECONDS: int = int(os.environ.get("STUDENT_SESSION_TTL_SECONDS", 600))
+    # Doğrulama eşleşmesinin ömrü; yüz tanıma servisinin sonucu bu süre içinde göndermesi beklenir.
+    VERIFICATION_TTL_SECONDS: int = int(os.environ.get("VERIFICATION_TTL_SECONDS", 300))
+    # Açıksa yüz tanıma işleri kısa bir pencerede biriktirilip mikroservisin toplu uç noktasına tek istekle gönderilir.
+    FACE_VERIFIER_BATCH_ENABLED: bool = os.environ.get("FACE_VERIFIER_BATCH_ENABLED", "false").lower() == "true"
 
 # Ayarların tek ve içe aktarılabilir bir örneğini oluştur
 settings = Config()
\ No newline at end of file
@@ -1,19 +1,93 @@
+import asyncio
 import logging
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, List, Optional
 from uuid import UUID
 import asyncpg
-from datetime import datetime, timezone
+from datetime import datetime
 from ..models.db_models import User, Attendance, AttendanceRecord
+from ..tools.clock import utcnow_ms
 
 logger = logging.getLogger(__name__)
 
+# Bu sayının üzerindeki toplu yazmalar COPY + geçici tablo üzerinden yapılır.
+# Küçük yığınlarda geçici tablo oluşturma maliyeti executemany'den daha pahalıdır.
+COPY_THRESHOLD = 100
+
+
+class _ConnectionSlot:
+    """Bir HTTP isteği boyunca paylaşılan, ilk sorguda tembel (lazy) olarak alınan bağlantı."""
+    __slots__ = ("pool", "connection", "lock")
+
+    def __init__(self):
+        self.pool: Optional[asyncpg.Pool] = None
+        self.connection: Optional[asyncpg.Connection] = None
+        # Aynı bağlantı üzerinde eşzamanlı iki sorgu çalışamaz; erişim sıraya sokulur.
+        self.lock = asyncio.Lock()
+
+
+_connection_slot: ContextVar[Optional[_ConnectionSlot]] = ContextVar("_connection_slot", default=None)
+
+
+@asynccontextmanager
+async def request_connection_scope() -> AsyncIterator[None]:
+    """
+    Bu kapsam içindeki tüm AsyncPostgresClient çağrıları havuzdan tek bir bağlantı alır ve
+    onu paylaşır. Bağlantı yalnızca gerçekten bir sorgu çalışırsa alınır ve kapsam bitince iade edilir.
+    """
+    slot = _ConnectionSlot()
+    token = _connection_slot.set(slot)
+    try:
+        yield
+    finally:
+        _connection_slot.reset(token)
+        if slot.connection is not None:
+            await slot.pool.release(slot.connection)
+
+
 class AsyncPostgresClient:
     """
     Tüm veritabanı operasyonlarını yöneten PostgreSQL istemcisi.
     """
+    # Okuma metodları satırları model_construct ile modele çevirir: veriler tablo şemasından
+    # tipli olarak geldiği için alan başına Pydantic doğrulaması tekrar çalıştırılmaz.
+    # Sık çalışan okuma sorguları sınıf sabitleri olarak tutulur. asyncpg, hazırlanmış
+    # ifadeleri bağlantı başına sorgu metnine göre önbelleğe aldığından metnin her çağrıda
+    # birebir aynı olması, her bağlantıda yalnızca bir kez parse/prepare yapılmasını sağlar.
+    _GET_USERS = "SELECT * FROM Users WHERE user_school_number = ANY($1::text[]);"
+    _GET_ATTENDANCES = "SELECT * FROM Attendances WHERE teacher_school_number = $1 AND is_deleted = FALSE;"
+    _GET_ATTENDANCE_BY_ID = "SELECT * FROM Attendances WHERE attendance_id = $1 AND is_deleted = FALSE;"
+    _GET_ATTENDANCE_RECORDS = "SELECT * FROM AttendanceRecords WHERE attendance_id = $1 AND is_deleted = FALSE;"
+
     def __init__(self, pool: asyncpg.Pool):
         self._pool = pool
 
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[asyncpg.Connection]:
+        """İstek kapsamında paylaşılan bağlantıyı, kapsam yoksa havuzdan yeni bir bağlantıyı verir."""
+        slot = _connection_slot.get()
+        if slot is None:
+            async with self._pool.acquire() as connection:
+                yield connection
+            return
+        async with slot.lock:
+            if slot.connection is None:
+                slot.pool = self._pool
+                slot.connection = await self._pool.acquire()
+            yield slot.connection
+
+    async def _copy_merge(self, table: str, columns: List[str], rows: List[tuple], merge_query: str):
+        """
+        Satırları ikili COPY protokolü ile geçici bir tabloya yükler, ardından tek bir
+        INSERT ... SELECT ile hedef tabloya birleştirir. merge_query geçici tabloya `_stage` adıyla erişir.
+        """
+        async with self._connection() as connection:
+            async with connection.transaction():
+                await connection.execute(f"CREATE TEMP TABLE _stage (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;")
+                await connection.copy_records_to_table("_stage", records=rows, columns=columns)
+                await connection.execute(merge_query)
+
     async def add_users(self, users: List[User]):
         """Yeni kullanıcıları Users tablosuna ekler. Çakışma durumunda bir şey yapmaz."""
         if not users:
@@ -24,17 +98,26 @@ class AsyncPostgresClient:
             ON CONFLICT (user_school_number) DO NOTHING;
         """
         user_data = [(u.user_school_number, u.user_full_name, u.role) for u in users]
-        async with self._pool.acquire() as connection:
+        if len(user_data) > COPY_THRESHOLD:
+            await self._copy_merge("Users", ["user_school_number", "user_full_name", "role"], user_data, """
+                INSERT INTO Users (user_school_number, user_full_name, role)
+                SELECT user_school_number, user_full_name, role FROM _stage
+                ON CONFLICT (user_school_number) DO NOTHING;
+            """)
+            return
+        async with self._connection() as connection:
             await connection.executemany(query, user_data)
 
     async def get_users(self, user_school_numbers: List[str]) -> List[User]:
         """Verilen okul numaralarına göre kullanıcı listesi döndürür."""
         if not user_school_numbers:
             return []
-        query = "SELECT * FROM Users WHERE user_school_number = ANY($1);"
-        async with self._pool.acquire() as connection:
-            records = await connection.fetch(query, user_school_numbers)
-            return [User(**record) for record in records]
+        # Tekrarlanan numaralar sırayı koruyarak ayıklanır; dizi tek bir bind parametresi olarak
+        # gönderildiği için büyük listeler de bölünmeden tek sorguda çalışır.
+        unique_numbers = list(dict.fromkeys(user_school_numbers))
+        async with self._connection() as connection:
+            records = await connection.fetch(self._GET_USERS, unique_numbers)
+        return [User.model_construct(**record) for record in records]
 
     async def add_attendances(self, attendances: List[Attendance]):
         """Yeni yoklama oturumlarını Attendances tablosuna ekler."""
@@ -49,22 +132,30 @@ class AsyncPostgresClient:
             att.attendance_id, att.teacher_school_number, att.lesson_name,
             att.ip_address, att.start_time, att.end_time, att.security_option
         ) for att in attendances]
-        async with self._pool.acquire() as connection:
+        if len(attendance_data) > COPY_THRESHOLD:
+            await self._copy_merge("Attendances", [
+                "attendance_id", "teacher_school_number", "lesson_name",
+                "ip_address", "start_time", "end_time", "security_option"
+            ], attendance_data, """
+                INSERT INTO Attendances (attendance_id, teacher_school_number, lesson_name, ip_address, start_time, end_time, security_option)
+                SELECT attendance_id, teacher_school_number, lesson_name, ip_address, start_time, end_time, security_option FROM _stage
+                ON CONFLICT (attendance_id) DO NOTHING;
+            """)
+            return
+        async with self._connection() as connection:
             await connection.executemany(query, attendance_data)
 
     async def get_attendances(self, teacher_school_number: str) -> List[Attendance]:
         """Bir öğretmenin silinmemiş tüm geçmiş yoklamalarını getirir."""
-        query = "SELECT * FROM Attendances WHERE teacher_school_number = $1 AND is_deleted = FALSE;"
-        async with self._pool.acquire() as connection:
-            records = await connection.fetch(query, teacher_school_number)
-            return [Attendance(**record) for record in records]
+        async with self._connection() as connection:
+            records = await connection.fetch(self._GET_ATTENDANCES, teacher_school_number)
+        return [Attendance.model_construct(**record) for record in records]
 
     async def get_attendance_by_id(self, attendance_id: UUID) -> Optional[Attendance]:
         """Tek bir yoklamayı ID ile getirir."""
-        query = "SELECT * FROM Attendances WHERE attendance_id = $1 AND is_deleted = FALSE;"
-        async with self._pool.acquire() as connection:
-            record = await connection.fetchrow(query, attendance_id)
-            return Attendance(**record) if record else None
+        async with self._connection() as connection:
+            record = await connection.fetchrow(self._GET_ATTENDANCE_BY_ID, attendance_id)
+        return Attendance.model_construct(**record) if record else None
 
     # --- REFACTORED METHOD ---
     async def add_attendance_records(self, records: List[AttendanceRecord]):
@@ -91,16 +182,67 @@ class AsyncPostgresClient:
             rec.attendance_id, rec.student_number, rec.is_attended,
             rec.attendance_time, rec.fail_reason
         ) for rec in records]
-        
-        async with self._pool.acquire() as connection:
+
+        if len(record_data) > COPY_THRESHOLD:
+            # ON CONFLICT DO UPDATE aynı satırı tek komutta iki kez güncelleyemez; yığındaki
+            # tekrar eden (attendance_id, student_number) çiftlerinden sonuncusu tutulur.
+            unique_rows = list({(row[0], row[1]): row for row in record_data}.values())
+            await self._copy_merge("AttendanceRecords", [
+                "attendance_id", "student_number", "is_attended", "attendance_time", "fail_reason"
+            ], unique_rows, """
+                INSERT INTO AttendanceRecords (attendance_id, student_number, is_attended, attendance_time, fail_reason)
+                SELECT attendance_id, student_number, is_attended, attendance_time, fail_reason FROM _stage
+                ON CONFLICT (attendance_id, student_number) DO UPDATE SET
+                    is_attended = EXCLUDED.is_attended,
+                    attendance_time = EXCLUDED.attendance_time,
+                    fail_reason = EXCLUDED.fail_reason,
+                    is_deleted = FALSE,
+                    deletion_reason = NULL,
+                    deletion_time = NULL;
+            """)
+            return
+
+        async with self._connection() as connection:
             await connection.executemany(query, record_data)
 
+    async def add_student_to_attendance(self, attendance_id: UUID, student: User, is_attended: bool,
+                                        attendance_time: Optional[datetime], fail_reason: Optional[str]) -> bool:
+        """
+        Geçmiş bir yoklamaya öğrenci ekler: yoklamanın varlık kontrolü, kullanıcı ekleme ve
+        kaydın eklenmesi/güncellenmesi tek bir CTE ile, tek bir round-trip'te yapılır.
+        Yoklama bulunamazsa hiçbir şey yazılmaz ve False döner.
+        """
+        query = """
+            WITH att AS (
+                SELECT attendance_id FROM Attendances WHERE attendance_id = $1 AND is_deleted = FALSE
+            ), new_user AS (
+                INSERT INTO Users (user_school_number, user_full_name, role)
+                SELECT $2, $3, $4 FROM att
+                ON CONFLICT (user_school_number) DO NOTHING
+            ), new_record AS (
+                INSERT INTO AttendanceRecords (attendance_id, student_number, is_attended, attendance_time, fail_reason)
+                SELECT attendance_id, $2, $5, $6, $7 FROM att
+                ON CONFLICT (attendance_id, student_number) DO UPDATE SET
+                    is_attended = EXCLUDED.is_attended,
+                    attendance_time = EXCLUDED.attendance_time,
+                    fail_reason = EXCLUDED.fail_reason,
+                    is_deleted = FALSE,
+                    deletion_reason = NULL,
+                    deletion_time = NULL
+            )
+            SELECT EXISTS (SELECT 1 FROM att);
+        """
+        async with self._connection() as connection:
+            return await connection.fetchval(
+                query, attendance_id, student.user_school_number, student.user_full_name, student.role,
+                is_attended, attendance_time, fail_reason
+            )
+
     async def get_attendance_records(self, attendance_id: UUID) -> List[AttendanceRecord]:
         """Bir yoklamanın tüm öğrenci kayıtlarını getirir."""
-        query = "SELECT * FROM AttendanceRecords WHERE attendance_id = $1 AND is_deleted = FALSE;"
-        async with self._pool.acquire() as connection:
-            records = await connection.fetch(query, attendance_id)
-            return [AttendanceRecord(**record) for record in records]
+        async with self._connection() as connection:
+            records = await connection.fetch(self._GET_ATTENDANCE_RECORDS, attendance_id)
+        return [AttendanceRecord.model_construct(**record) for record in records]
             
     async def accept_historical_attendance_record(self, attendance_id: UUID, student_number: str):
         """Geçmiş bir yoklama kaydını 'başarılı' olarak günceller."""
@@ -114,8 +256,8 @@ class AsyncPostgresClient:
                 deletion_time = NULL
             WHERE attendance_id = $1 AND student_number = $2;
         """
-        async with self._pool.acquire() as connection:
-            return await connection.execute(query, attendance_id, student_number, datetime.now(timezone.utc))
+        async with self._connection() as connection:
+            return await connection.execute(query, attendance_id, student_number, utcnow_ms())
 
     async def fail_historical_attendance_record(self, attendance_id: UUID, student_number: str, reason: str):
         """Geçmiş bir yoklama kaydını 'başarısız' olarak günceller."""
@@ -129,7 +271,7 @@ class AsyncPostgresClient:
                 deletion_time = NULL
             WHERE attendance_id = $1 AND student_number = $2;
         """
-        async with self._pool.acquire() as connection:
+        async with self._connection() as connection:
             return await connection.execute(query, attendance_id, student_number, reason)
 
     async def delete_attendance(self, attendance_id: UUID, reason: str):
@@ -139,8 +281,8 @@ class AsyncPostgresClient:
             SET is_deleted = TRUE, deletion_reason = $2, deletion_time = $3
             WHERE attendance_id = $1;
         """
-        async with self._pool.acquire() as connection:
-            return await connection.execute(query, attendance_id, reason, datetime.now(timezone.utc))
+        async with self._connection() as connection:
+            return await connection.execute(query, attendance_id, reason, utcnow_ms())
 
     async def delete_attendance_record(self, attendance_id: UUID, student_number: str, reason: str):
         """Tek bir öğrenci kaydını 'yumuşak silme' ile siler."""
@@ -149,5 +291,5 @@ class AsyncPostgresClient:
             SET is_deleted = TRUE, deletion_reason = $3, deletion_time = $4
             WHERE attendance_id = $1 AND student_number = $2;
         """
-        async with self._pool.acquire() as connection:
-            return await connection.execute(query, attendance_id, student_number, reason, datetime.now(timezone.utc))
+        async with self._connection() as connection:
+            return await connection.execute(query, attendance_id, student_number, reason, utcnow_ms())
@@ -1,15 +1,88 @@
+import asyncio
 import logging
 from typing import List, Optional, Dict
-from uuid import UUID
+from pydantic import TypeAdapter
+from uuid import UUID, uuid4
+from functools import partial
 import redis.asyncio as redis
-import asyncio
+import time
 from datetime import datetime, timezone
+from cachetools import TTLCache
+
+from ..config.config import settings
 
 # --- Gerekli tüm modeller ---
 from ..models.redis_models import UserSessionRedis, AttendanceRedis, AttendanceRecordRedis
 
 logger = logging.getLogger(__name__)
 
+# Toplu okumalarda (MGET) gelen JSON değerleri tek bir dizi olarak birleştirilip
+# pydantic-core'un JSON ayrıştırıcısıyla tek geçişte doğrulanır.
+_SESSION_LIST_ADAPTER = TypeAdapter(List[AttendanceRedis])
+_RECORD_LIST_ADAPTER = TypeAdapter(List[AttendanceRecordRedis])
+
+# Oturum nesnelerinin süreç içi önbellekte kalma süresi (saniye).
+# Durum sorgulama (polling) fırtınalarında aynı oturum için Redis'e tekrar tekrar gidilmez;
+# bu süre kadar eskimiş veri (ör. başka bir worker'da bitirilen oturum) kabul edilir.
+SESSION_CACHE_TTL_SECONDS = 2
+
+# Öğrenci referans fotoğraflarının önbellekte kalma süresi (1 gün).
+REFERENCE_IMAGE_TTL_SECONDS = 86400
+
+# Oturum ID'lerini bitiş zamanına (epoch saniye) göre tutan sıralı küme.
+# Süre kontrolü ve süresi dolmuş oturumların bulunması JSON çözümlemeden yapılır.
+SESSIONS_BY_END_TIME_KEY = "attendance_sessions:by_end_time"
+
+# Öğretmenin indeksindeki oturum ID'sini bulup oturum JSON'unu tek komutta döndürür.
+# SMEMBERS + GET, iki ayrı round-trip yerine Redis içinde çalışır. Süresi dolmuş oturumlar
+# (skoru ARGV[1]'den küçük olanlar) hiç gönderilmez; skoru olmayan eski oturumlar
+# için karar Python tarafındaki kontrole bırakılır.
+_TEACHER_SESSION_LUA = """
+local ids = redis.call('SMEMBERS', KEYS[1])
+if #ids == 0 then
+    return false
+end
+local score = redis.call('ZSCORE', KEYS[2], ids[1])
+if score and tonumber(score) <= tonumber(ARGV[1]) then
+    return false
+end
+return redis.call('GET', 'attendance_session:' .. ids[1])
+"""
+
+# Tek seferlik anahtar düzeni geçişlerinin durumunu tutan anahtarların öneki.
+# Değer "running" (TTL'li; yarıda kalan geçiş süre dolunca tekrar denenir) ya da "done" (kalıcı) olur.
+MIGRATION_KEY_PREFIX = "migration:"
+
+# Kilidi yalnızca sahibi (aynı token'ı tutan) silebilir; GET + DEL atomik çalışır.
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def _json_array(values: List[Optional[str]]) -> str:
+    """MGET sonucundaki JSON nesnelerini tek bir JSON dizisinde birleştirir."""
+    # Okuma sırasında silinen anahtarlar None döner; bunlar atlanır.
+    return "[" + ",".join(value for value in values if value) + "]"
+
+
+def _name_index_key(lesson_name: str, teacher_name: str) -> str:
+    """Ders adı + öğretmen adı için bitiş zamanına göre sıralı oturum indeksinin anahtarı."""
+    # Eski SET tipindeki "attendance_index:name:*" anahtarlarıyla WRONGTYPE çakışmaması için ayrı ad.
+    return f"attendance_index:name_by_end_time:{lesson_name}:{teacher_name}"
+
+
+def _parse_verification_value(value: Optional[str]) -> Optional[Dict[str, str]]:
+    """Eşleşme değerini ("okul_numarası:yoklama_id") sözlüğe çevirir; hatalıysa None döner."""
+    if not value:
+        return None
+    user_school_number, sep, attendance_id = value.partition(':')
+    if not sep or not attendance_id or ':' in attendance_id:
+        return None # Hatalı format
+    return {"user_school_number": user_school_number, "attendance_id": attendance_id}
+
+
 class RedisClient:
     """
     Tüm cache ve oturum operasyonlarını yöneten Redis istemcisi.
@@ -17,11 +90,23 @@ class RedisClient:
     
     def __init__(self, pool: redis.ConnectionPool):
         self._redis = redis.Redis(connection_pool=pool, decode_responses=True)
+        # register_script ilk çağrıdan sonra EVALSHA kullanır; betik gövdesi tekrar gönderilmez.
+        self._teacher_session_script = self._redis.register_script(_TEACHER_SESSION_LUA)
+        self._release_lock_script = self._redis.register_script(_RELEASE_LOCK_LUA)
+        # attendance_id -> AttendanceRedis. Aynı süreçteki kayıt/silme işlemleri kaydı hemen geçersiz kılar.
+        self._session_cache: TTLCache = TTLCache(maxsize=1024, ttl=SESSION_CACHE_TTL_SECONDS)
+        # attendance_id -> devam eden GET görevi. Önbellek boşken aynı oturum için gelen eşzamanlı
+        # istekler tek bir Redis GET'ini bekler (single-flight).
+        self._session_inflight: Dict[str, asyncio.Task] = {}
 
     # ===== User Session Management =====
 
     async def save_user_session(self, user: UserSessionRedis, ttl: int):
-        """Kullanıcı oturumunu TTL ile Redis'e kaydeder."""
+        """
+        Kullanıcı oturumunu TTL ile Redis'e kaydeder.
+        TTL, SET komutunun EX parametresiyle verilir; ayrı bir EXPIRE çağrısı
+        (ve dolayısıyla ikinci bir round-trip) gerekmez.
+        """
         key = f"users:{user.user_data.user_school_number}"
         await self._redis.set(key, user.model_dump_json(), ex=ttl)
 
@@ -36,40 +121,111 @@ class RedisClient:
         key = f"users:{user_school_number}"
         return await self._redis.delete(key)
 
+    # ===== Distributed Locks =====
+
+    async def acquire_lock(self, key: str, ttl: int) -> Optional[str]:
+        """
+        SET NX EX ile kısa ömürlü bir kilit almaya çalışır.
+        Başarılıysa kilidi bırakmak için gereken token'ı, kilit başkasındaysa None döndürür.
+        """
+        token = uuid4().hex
+        acquired = await self._redis.set(key, token, nx=True, ex=ttl)
+        return token if acquired else None
+
+    async def release_lock(self, key: str, token: str) -> bool:
+        """Kilidi, yalnızca hala bu token'a aitse siler (süresi dolup başkası almışsa dokunmaz)."""
+        return bool(await self._release_lock_script(keys=[key], args=[token]))
+
+    # ===== Reference Image Cache =====
+
+    async def get_reference_image(self, user_school_number: str) -> Optional[str]:
+        """Öğrencinin önbellekteki referans fotoğrafını (base64) döndürür."""
+        return await self._redis.get(f"ref_image:{user_school_number}")
+
+    async def save_reference_image(self, user_school_number: str, image_b64: str, ttl: int = REFERENCE_IMAGE_TTL_SECONDS):
+        """
+        Referans fotoğrafı TTL ile önbelleğe yazar.
+        Havuz decode_responses=True kullandığından ham byte yerine base64 metni saklanır.
+        """
+        await self._redis.set(f"ref_image:{user_school_number}", image_b64, ex=ttl)
+
     # ===== Full Attendance Session Management =====
 
     async def save_attendance_session(self, attendance: AttendanceRedis):
         """
         Tam yoklama oturumu nesnesini Redis'e kaydeder ve arama için indeksler oluşturur.
         """
-        session_key = f"attendance_session:{attendance.attendance_id}"
-        index_key_by_name = f"attendance_index:name:{attendance.lesson_name}:{attendance.teacher_full_name}"
+        # ID bir kez string'e çevrilir; anahtar ve küme üyeleri için tekrar kullanılır.
+        aid_str = str(attendance.attendance_id)
+        session_key = f"attendance_session:{aid_str}"
+        index_key_by_name = _name_index_key(attendance.lesson_name, attendance.teacher_full_name)
         index_key_by_teacher = f"attendance_index:teacher:{attendance.teacher_school_number}"
+        end_ts = attendance.end_time.timestamp()
 
-        async with self._redis.pipeline(transaction=True) as pipe:
+        async with self._redis.pipeline(transaction=False) as pipe:
             pipe.set(session_key, attendance.model_dump_json())
-            pipe.sadd(index_key_by_name, str(attendance.attendance_id))
-            pipe.sadd(index_key_by_teacher, str(attendance.attendance_id))
+            # Ad indeksi de bitiş zamanına göre sıralıdır; aktif oturumlar Redis tarafında süzülür.
+            pipe.zadd(index_key_by_name, {aid_str: end_ts})
+            pipe.sadd(index_key_by_teacher, aid_str)
+            # Oturum yeniden kaydedildiğinde (ör. erken bitirme) skor da güncellenir.
+            pipe.zadd(SESSIONS_BY_END_TIME_KEY, {aid_str: end_ts})
             await pipe.execute()
+        self._invalidate_session(aid_str)
 
-    async def get_attendance_session(self, attendance_id: UUID) -> Optional[AttendanceRedis]:
-        """Tam yoklama oturumu nesnesini ID ile alır."""
-        key = f"attendance_session:{attendance_id}"
-        session_json = await self._redis.get(key)
+    def _invalidate_session(self, aid_str: str):
+        """Oturumu önbellekten ve devam eden yüklemelerden düşürür (eski veri yazılmasın diye)."""
+        self._session_cache.pop(aid_str, None)
+        self._session_inflight.pop(aid_str, None)
+
+    async def _load_attendance_session(self, aid_str: str) -> Optional[AttendanceRedis]:
+        session_json = await self._redis.get(f"attendance_session:{aid_str}")
         return AttendanceRedis.model_validate_json(session_json) if session_json else None
 
-    async def get_attendance_sessions_by_name(self, lesson_name: str, teacher_name: str) -> List[AttendanceRedis]:
-        """Ders adı ve öğretmen adına göre aktif yoklama oturumlarını bulur."""
-        index_key = f"attendance_index:name:{lesson_name}:{teacher_name}"
-        attendance_ids = await self._redis.smembers(index_key)
+    def _on_session_loaded(self, aid_str: str, task: asyncio.Task):
+        """Yükleme hala geçerliyse (arada kayıt/silme olmadıysa) sonucu önbelleğe alır."""
+        if self._session_inflight.get(aid_str) is not task:
+            return
+        del self._session_inflight[aid_str]
+        # Bulunamayan oturumlar önbelleğe alınmaz; yeni açılan oturum hemen görünür.
+        if not task.cancelled() and task.exception() is None and task.result() is not None:
+            self._session_cache[aid_str] = task.result()
+
+    async def get_attendance_session(self, attendance_id: UUID) -> Optional[AttendanceRedis]:
+        """
+        Tam yoklama oturumu nesnesini ID ile alır.
+        Sonuç kısa bir süre süreç içinde önbelleklenir; dönen nesne paylaşıldığı için
+        çağıranlar onu yerinde değiştirmemeli (model_copy kullanmalı).
+        """
+        aid_str = str(attendance_id)
+        session = self._session_cache.get(aid_str)
+        if session is not None:
+            return session
+        task = self._session_inflight.get(aid_str)
+        if task is None:
+            task = asyncio.ensure_future(self._load_attendance_session(aid_str))
+            self._session_inflight[aid_str] = task
+            task.add_done_callback(partial(self._on_session_loaded, aid_str))
+        # shield: bekleyenlerden biri iptal edilirse ortak GET diğerleri için iptal olmaz.
+        return await asyncio.shield(task)
+
+    async def get_attendance_sessions_by_name(self, lesson_name: str, teacher_name: str, now: Optional[float] = None) -> List[AttendanceRedis]:
+        """
+        Ders adı ve öğretmen adına göre yoklama oturumlarını bulur.
+        `now` (epoch saniye) verilirse yalnızca bitiş zamanı bu andan sonra olan (aktif)
+        oturumlar döner; süresi dolmuşlar Redis'ten hiç okunmaz.
+        """
+        index_key = _name_index_key(lesson_name, teacher_name)
+        if now is None:
+            attendance_ids = await self._redis.zrange(index_key, 0, -1)
+        else:
+            attendance_ids = await self._redis.zrangebyscore(index_key, f"({now}", "+inf")
         if not attendance_ids:
             return []
         
-        # NOTE: Bu kısım da zaman kontrolü eklenerek daha da iyileştirilebilir.
-        # Şimdilik sadece öğretmenin aktif ders kontrolüne odaklanıyoruz.
-        tasks = [self.get_attendance_session(UUID(att_id)) for att_id in attendance_ids]
-        sessions = await asyncio.gather(*tasks)
-        return [session for session in sessions if session is not None]
+        # Oturum başına ayrı GET (ve task) yerine tüm oturumlar tek bir MGET ile okunur.
+        keys = [f"attendance_session:{att_id}" for att_id in attendance_ids]
+        sessions_json = await self._redis.mget(keys)
+        return _SESSION_LIST_ADAPTER.validate_json(_json_array(sessions_json))
 
     # --- REFACTORED METHOD WITH TIME CHECK ---
     async def get_attendance_session_of_teacher(self, teacher_school_number: str) -> Optional[AttendanceRedis]:
@@ -78,12 +234,13 @@ class RedisClient:
         Bu metod artık oturumun süresinin dolup dolmadığını da kontrol eder.
         """
         index_key = f"attendance_index:teacher:{teacher_school_number}"
-        attendance_ids = await self._redis.smembers(index_key)
-        if not attendance_ids:
+        session_json = await self._teacher_session_script(
+            keys=[index_key, SESSIONS_BY_END_TIME_KEY], args=[time.time()]
+        )
+        if not session_json:
             return None
         
-        attendance_id = attendance_ids.pop()
-        session = await self.get_attendance_session(UUID(attendance_id))
+        session = AttendanceRedis.model_validate_json(session_json)
         
         # EKLENEN KONTROL: Oturum bulunduysa, süresinin geçip geçmediğini kontrol et.
         # Süresi dolmuşsa, "aktif değil" kabul et ve None döndür. Cron job onu daha sonra temizleyecektir.
@@ -92,38 +249,171 @@ class RedisClient:
         
         return None
 
+    async def get_expired_attendance_ids(self, now: float) -> List[str]:
+        """Bitiş zamanı `now` (epoch saniye) anına kadar olan oturumların ID'lerini döndürür."""
+        return await self._redis.zrangebyscore(SESSIONS_BY_END_TIME_KEY, 0, now)
+
+    async def try_begin_migration(self, name: str, ttl: int) -> bool:
+        """
+        Tek seferlik bir geçişi başlatmak için SET NX ile işaret koyar. Geçiş daha önce
+        tamamlanmışsa ya da başka bir worker onu şu an çalıştırıyorsa False döner.
+        """
+        return bool(await self._redis.set(f"{MIGRATION_KEY_PREFIX}{name}", "running", nx=True, ex=ttl))
+
+    async def finish_migration(self, name: str):
+        """Geçişi kalıcı olarak tamamlandı işaretler; sonraki açılışlarda tekrar çalışmaz."""
+        await self._redis.set(f"{MIGRATION_KEY_PREFIX}{name}", "done")
+
+    async def backfill_session_indexes(self) -> int:
+        """
+        Eski anahtar düzeninden kalan oturumları yeni indekslere taşır ve indekse eklenen
+        oturum sayısını döndürür. Tüm keyspace'i taradığı için try_begin_migration ile
+        korunarak çalıştırılır:
+        - bitiş zamanı indeksinde bulunmayan oturumlar bu indekse eklenir,
+        - ad indeksi, oturumların kendisinden bitiş zamanı sıralı ZSET olarak yeniden kurulur,
+        - eski SET tipindeki "attendance_index:name:*" anahtarları silinir.
+        """
+        added = 0
+        keys: List[str] = []
+        # COUNT ipucu SCAN round-trip sayısını azaltır (varsayılan 10); TYPE filtresi
+        # (Redis 6.0+) hash/set tipindeki kayıt ve indeks anahtarlarını sunucu tarafında eler.
+        async for key in self._redis.scan_iter(match="attendance_session:*", count=500, _type="STRING"):
+            keys.append(key)
+            if len(keys) >= 500:
+                added += await self._index_session_keys(keys)
+                keys = []
+        if keys:
+            added += await self._index_session_keys(keys)
+
+        # Ad indeksi yukarıda oturumlardan yeniden kurulduğu için eski kümelere artık gerek yok.
+        legacy_name_keys = [
+            key async for key in self._redis.scan_iter(match="attendance_index:name:*", count=500, _type="SET")
+        ]
+        if legacy_name_keys:
+            await self._redis.unlink(*legacy_name_keys)
+        return added
+
+    async def _index_session_keys(self, keys: List[str]) -> int:
+        sessions = _SESSION_LIST_ADAPTER.validate_json(_json_array(await self._redis.mget(keys)))
+        if not sessions:
+            return 0
+        async with self._redis.pipeline(transaction=False) as pipe:
+            # NX: indekste zaten olan oturumların (ör. erken bitirilmiş) skoru değiştirilmez.
+            pipe.zadd(
+                SESSIONS_BY_END_TIME_KEY,
+                {str(session.attendance_id): session.end_time.timestamp() for session in sessions},
+                nx=True,
+            )
+            for session in sessions:
+                pipe.zadd(
+                    _name_index_key(session.lesson_name, session.teacher_full_name),
+                    {str(session.attendance_id): session.end_time.timestamp()},
+                    nx=True,
+                )
+            results = await pipe.execute()
+        return results[0]
+
+    async def migrate_legacy_attendance_records(self) -> int:
+        """
+        Öğrenci başına ayrı string anahtarda ("attendance_records:{aid}:{sn}") tutulan eski
+        kayıtları yoklamanın hash'ine taşır ve taşınan kayıt sayısını döndürür.
+        Tüm keyspace'i taradığı için try_begin_migration ile korunarak çalıştırılır.
+        """
+        moved = 0
+        keys: List[str] = []
+        # Yeni kayıtlar hash tipinde olduğundan TYPE filtresi yalnızca eski anahtarları döndürür.
+        async for key in self._redis.scan_iter(match="attendance_records:*", count=500, _type="STRING"):
+            keys.append(key)
+            if len(keys) >= 500:
+                moved += await self._move_record_keys(keys)
+                keys = []
+        if keys:
+            moved += await self._move_record_keys(keys)
+        return moved
+
+    async def _move_record_keys(self, keys: List[str]) -> int:
+        values = await self._redis.mget(keys)
+        moved = 0
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key, value in zip(keys, values):
+                parts = key.split(":", 2)
+                if value is not None and len(parts) == 3:
+                    # NX: taşıma sırasında yeni düzende yazılmış (daha güncel) kayıt ezilmez.
+                    pipe.hsetnx(f"attendance_records:{parts[1]}", parts[2], value)
+                    moved += 1
+            pipe.unlink(*keys)
+            await pipe.execute()
+        return moved
+
+    async def remove_from_end_time_index(self, attendance_ids: List[str]):
+        """Oturum anahtarı artık bulunmayan ID'leri bitiş zamanı indeksinden çıkarır."""
+        await self._redis.zrem(SESSIONS_BY_END_TIME_KEY, *attendance_ids)
+
     async def delete_attendance_session(self, attendance: AttendanceRedis):
-        """Tam yoklama oturumu nesnesini ve ilgili indekslerini Redis'ten siler."""
-        session_key = f"attendance_session:{attendance.attendance_id}"
-        index_key_by_name = f"attendance_index:name:{attendance.lesson_name}:{attendance.teacher_full_name}"
+        """
+        Tam yoklama oturumu nesnesini, ilgili indekslerini ve öğrenci kayıtlarını
+        Redis'ten tek bir pipeline ile (tek round-trip) siler.
+        """
+        # ID bir kez string'e çevrilir; anahtar ve küme üyeleri için tekrar kullanılır.
+        aid_str = str(attendance.attendance_id)
+        session_key = f"attendance_session:{aid_str}"
+        index_key_by_name = _name_index_key(attendance.lesson_name, attendance.teacher_full_name)
         index_key_by_teacher = f"attendance_index:teacher:{attendance.teacher_school_number}"
         
-        async with self._redis.pipeline(transaction=True) as pipe:
-            pipe.delete(session_key)
-            pipe.srem(index_key_by_name, str(attendance.attendance_id))
-            pipe.srem(index_key_by_teacher, str(attendance.attendance_id))
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.delete(session_key, f"attendance_records:{aid_str}")
+            pipe.zrem(index_key_by_name, aid_str)
+            pipe.srem(index_key_by_teacher, aid_str)
+            pipe.zrem(SESSIONS_BY_END_TIME_KEY, aid_str)
             await pipe.execute()
-        
+        self._invalidate_session(aid_str)
+
     # ===== Attendance Record Management (Öğrenci Kayıtları) =====
 
     async def add_attendance_record(self, record: AttendanceRecordRedis):
-        """Öğrencinin yoklama kaydını kaydeder."""
-        key = f"attendance_records:{record.attendance_id}:{record.student_number}"
-        await self._redis.set(key, record.model_dump_json())
+        """
+        Öğrencinin yoklama kaydını kaydeder.
+        Bir yoklamanın tüm kayıtları tek bir hash'te (alan = öğrenci numarası) tutulur;
+        böylece keyspace taranmadan tek komutla okunabilir.
+        """
+        await self._redis.hset(
+            f"attendance_records:{record.attendance_id}", record.student_number, record.model_dump_json()
+        )
 
     async def get_attendance_records(self, attendance_id: UUID) -> List[AttendanceRecordRedis]:
-        """Bir yoklamanın tüm öğrenci kayıtlarını getirir."""
-        records = []
-        async for key in self._redis.scan_iter(f"attendance_records:{attendance_id}:*"):
-            record_json = await self._redis.get(key)
-            if record_json:
-                records.append(AttendanceRecordRedis.model_validate_json(record_json))
-        return records
+        """Bir yoklamanın tüm öğrenci kayıtlarını tek bir HVALS ile getirir."""
+        values = await self._redis.hvals(f"attendance_records:{attendance_id}")
+        if not values:
+            return []
+        return _RECORD_LIST_ADAPTER.validate_json(_json_array(values))
     
+    async def get_many_attendance_sessions(self, attendance_ids: List[str]) -> List[AttendanceRedis]:
+        """Birden çok yoklama oturumunu tek bir MGET ile getirir; bulunamayanlar atlanır."""
+        if not attendance_ids:
+            return []
+        sessions_json = await self._redis.mget([f"attendance_session:{aid}" for aid in attendance_ids])
+        return _SESSION_LIST_ADAPTER.validate_json(_json_array(sessions_json))
+
+    async def get_many_attendance_records(self, attendance_ids: List[str]) -> Dict[str, List[AttendanceRecordRedis]]:
+        """
+        Birden çok yoklamanın öğrenci kayıtlarını tek bir pipeline ile getirir
+        ve yoklama ID'sine göre gruplar.
+        """
+        grouped: Dict[str, List[AttendanceRecordRedis]] = {str(aid): [] for aid in attendance_ids}
+        if not grouped:
+            return grouped
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for aid in grouped:
+                pipe.hvals(f"attendance_records:{aid}")
+            results = await pipe.execute()
+        for aid, values in zip(grouped, results):
+            if values:
+                grouped[aid] = _RECORD_LIST_ADAPTER.validate_json(_json_array(values))
+        return grouped
+
     async def get_attendance_record_by_id(self, attendance_id: UUID, student_number: str) -> Optional[AttendanceRecordRedis]:
         """Tek bir öğrenci kaydını getirir."""
-        key = f"attendance_records:{attendance_id}:{student_number}"
-        record_json = await self._redis.get(key)
+        record_json = await self._redis.hget(f"attendance_records:{attendance_id}", student_number)
         return AttendanceRecordRedis.model_validate_json(record_json) if record_json else None
 
     async def update_attendance_record(self, record: AttendanceRecordRedis):
@@ -133,30 +423,43 @@ class RedisClient:
    
  # ===== Webhook Verification Mapping =====
 
-    async def map_verification_to_user(self, verification_id: str, user_school_number: str, attendance_id: str):
+    async def map_verification_to_user(self, verification_id: str, user_school_number: str, attendance_id: str,
+                                       pending_record: Optional[AttendanceRecordRedis] = None):
         """
         Geçici olarak bir doğrulama ID'sini bir kullanıcıya ve yoklama ID'sine bağlar.
-        Bu anahtarın ömrü kısa olmalı (örn: 5 dakika), işlenmeyen isteklerin birikmemesi için.
+        Anahtar, SET ile aynı komutta verilen TTL (VERIFICATION_TTL_SECONDS) sonunda kendiliğinden silinir;
+        sonucu hiç gelmeyen (ör. gönderimi başarısız olan) eşleşmeler birikmez.
+        `pending_record` verilirse öğrencinin bekleme kaydı da aynı pipeline ile (tek round-trip) yazılır.
         """
         key = f"verification:{verification_id}"
         # Hem okul numarası hem de yoklama ID'sini tek bir string'de saklıyoruz.
         value = f"{user_school_number}:{attendance_id}"
-        await self._redis.set(key, value, ex=300) # 300 saniye = 5 dakika
+        if pending_record is None:
+            await self._redis.set(key, value, ex=settings.VERIFICATION_TTL_SECONDS)
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(key, value, ex=settings.VERIFICATION_TTL_SECONDS)
+            pipe.hset(
+                f"attendance_records:{pending_record.attendance_id}",
+                pending_record.student_number,
+                pending_record.model_dump_json(),
+            )
+            await pipe.execute()
 
     async def get_user_and_attendance_for_verification(self, verification_id: str) -> Optional[Dict[str, str]]:
         """Bir doğrulama ID'sine karşılık gelen kullanıcıyı ve yoklama ID'sini getirir."""
         key = f"verification:{verification_id}"
-        value = await self._redis.get(key)
-        if not value:
-            return None
-        
-        parts = value.split(':')
-        if len(parts) != 2:
-            return None # Hatalı format
-        
-        return {"user_school_number": parts[0], "attendance_id": parts[1]}
+        return _parse_verification_value(await self._redis.get(key))
+
+    async def pop_user_and_attendance_for_verification(self, verification_id: str) -> Optional[Dict[str, str]]:
+        """
+        Doğrulama eşleşmesini okur ve aynı komutta (GETDEL) siler.
+        Ayrı bir silme round-trip'i gerekmez; aynı sonucun ikinci kez işlenmesi de engellenir.
+        """
+        key = f"verification:{verification_id}"
+        return _parse_verification_value(await self._redis.getdel(key))
 
     async def delete_verification_mapping(self, verification_id: str):
         """İşlem tamamlandığında geçici eşleşmeyi siler."""
         key = f"verification:{verification_id}"
-        await self._redis.delete(key)
\ No newline at end of file
+        await self._redis.delete(key)
@@ -1,13 +1,34 @@
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
+import orjson
+
 # Projenin ana dizininde bir 'logs' klasörü oluştur (varsa es geçer)
 # Docker volume ile bu klasörü sunucudaki kalıcı bir dizine bağlayacağız.
 log_dir = Path("logs")
 log_dir.mkdir(exist_ok=True)
 
+# Handler'ları arka plan thread'inde çalıştıran dinleyici; kapanışta durdurulur.
+_listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Log kayıtlarını tek satırlık JSON olarak biçimlendirir.
+    Zaman damgası strftime ile metne çevrilmez; epoch saniye olarak yazılır.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        return orjson.dumps({
+            "t": record.created,
+            "name": record.name,
+            "lvl": record.levelname,
+            "msg": record.getMessage(),
+        }).decode()
+
 
 def setup_logging():
     """
@@ -16,8 +37,8 @@ def setup_logging():
     Bu fonksiyon, logları hem konsola (geliştirme için) hem de belirli bir boyuta
     ulaştığında otomatik olarak eskiyen/dönen bir dosyaya (üretim ortamı için) yazar.
     """
-    # Log mesajlarımızın formatını belirliyoruz: Zaman - Modül Adı - Seviye - Mesaj
-    log_format = "%(asctime)s - [%(name)s] - %(levelname)s - %(message)s"
+    # Her kayıt {"t": epoch, "name": modül, "lvl": seviye, "msg": mesaj} biçiminde yazılır.
+    formatter = JsonFormatter()
     
     # Kök logger'ı alıyoruz, tüm loglama bu logger üzerinden dallanacak.
     logger = logging.getLogger()
@@ -30,8 +51,7 @@ def setup_logging():
 
     # 1. Konsol Handler: Logları terminale (standart çıktıya) yazar.
     stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setFormatter(logging.Formatter(log_format))
-    logger.addHandler(stdout_handler)
+    stdout_handler.setFormatter(formatter)
 
     # 2. Dönen Dosya Handler: Logları bir dosyaya yazar.
     # Dosya boyutu 5MB'ı geçtiğinde, eski logları app.log.1, app.log.2
@@ -41,5 +61,23 @@ def setup_logging():
         maxBytes=5*1024*1024,  # 5 MB
         backupCount=5          # En fazla 5 eski log dosyası tut
     )
-    file_handler.setFormatter(logging.Formatter(log_format))
-    logger.addHandler(file_handler)
+    file_handler.setFormatter(formatter)
+
+    # 3. Kök logger'a yalnızca bir QueueHandler eklenir; kayıtlar kuyruğa bırakılır.
+    # Asıl yazma (konsol, dosya, rotasyon) QueueListener'ın thread'inde yapılır,
+    # böylece event loop disk I/O'su yüzünden hiç bloklanmaz.
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    log_queue: queue.Queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(log_queue, stdout_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Arka plan dinleyicisini durdurur; kuyrukta kalan kayıtlar yazıldıktan sonra döner."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,10 +1,13 @@
 # app/backend/main.py
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 import redis.asyncio as redis
 import asyncpg
+import httpx
 from apscheduler.schedulers.asyncio import AsyncIOScheduler as Scheduler
 import logging
+import orjson
 
 # Rate limiting için gerekli importlar
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -17,9 +20,15 @@ from .api import auth, teacher, student,webhooks
 # Gerekli istemci ve görev (task) fonksiyonlarını import edelim
 from .db.redis_client import RedisClient
 from .db.db_client import AsyncPostgresClient
-from .tasks.cron import  unified_persistence_task
+from .services.teacher_service import TeacherService
+from .services.student_service import StudentService
+from .tasks.cron import  unified_persistence_task, PERSISTENCE_INTERVAL_MINUTES
 
 from .api.utilities.limiter import limiter
+from .api.utilities.role_guard import TeacherRoleGuard
+from .logging.logging_config import setup_logging, stop_logging
+from .tools.http import get_shared_client, close_shared_client
+from .tools.face_verifier import drain_background_submissions, BatchSubmitter
 
 # Logging yapılandırması
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +37,11 @@ logger = logging.getLogger(__name__)
 #adding empty cors for building frontend
 from fastapi.middleware.cors import CORSMiddleware
 
+# Redis anahtar düzeni geçişinin adı; geçiş tamamlanınca Redis'te kalıcı olarak işaretlenir.
+KEY_LAYOUT_MIGRATION = "attendance_key_layout_v2"
+# Yarıda kalan (ör. worker çökmesi) geçişin işareti bu süre sonra düşer ve geçiş tekrar denenir.
+KEY_LAYOUT_MIGRATION_TTL_SECONDS = 600
+
 
 
 
@@ -36,33 +50,76 @@ async def lifespan(app: FastAPI):
     """
     Uygulama başlatıldığında ve durdurulduğunda çalışacak olan yaşam döngüsü yöneticisi.
     """
+    # Loglar kuyruk üzerinden arka plan thread'inde yazılır.
+    setup_logging()
+
     # Rate limiter'ı uygulama state'ine ekle
     app.state.limiter = limiter
     
     logger.info("Uygulama başlatılıyor...")
+
+    # Aksis'e giden TCP/TLS bağlantıları tüm login'ler arasında paylaşılır.
+    # Çerez kutusu (cookie jar) ise her login için ayrı bir AsyncClient'ta tutulur.
+    # HTTP/2 ile aynı login'in eşzamanlı istekleri tek bağlantı üzerinde çoklanır.
+    app.state.aksis_transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=500, keepalive_expiry=60)
+    )
+    # Çerez gerektirmeyen dış istekler (ör. referans fotoğraf indirme) için paylaşılan istemci.
+    get_shared_client()
     
     postgres_pool = None
     redis_pool = None
     scheduler = None
 
     try:
+        # asyncpg, min_size kadar bağlantıyı havuz oluşturulurken açar; ilk istekler
+        # soğuk bağlantı kurulumunu beklemez.
         postgres_pool = await asyncpg.create_pool(
-            dsn=settings.DATABASE_URL, min_size=5, max_size=20
+            dsn=settings.DATABASE_URL, min_size=10, max_size=50
         )
-        redis_pool = redis.ConnectionPool.from_url(
-            settings.APPLICATION_REDIS_URL, decode_responses=True
+        # Sınır aşıldığında hata fırlatmak yerine boşalan bir bağlantıyı bekler.
+        redis_pool = redis.BlockingConnectionPool.from_url(
+            settings.APPLICATION_REDIS_URL, decode_responses=True, max_connections=64, timeout=5
         )
         
         app.state.postgres_pool = postgres_pool
         app.state.redis_pool = redis_pool
         logger.info("PostgreSQL ve Redis bağlantı havuzları başarıyla oluşturuldu.")
 
+        # İstemciler havuz başına bir kez oluşturulur; istek başına yeniden kurulmaz.
         db_client = AsyncPostgresClient(pool=postgres_pool)
         redis_client = RedisClient(pool=redis_pool)
+        app.state.db_client = db_client
+        app.state.redis_client = redis_client
+        # Servisler durumsuz olduğundan uygulama ömrü boyunca tek örnek olarak tutulur.
+        app.state.teacher_service = TeacherService(redis_client=redis_client, db_client=db_client)
+        # Toplu gönderim açıksa kuyruk ve işçisi uygulama ömrü boyunca tek örnektir.
+        app.state.batch_submitter = BatchSubmitter() if settings.FACE_VERIFIER_BATCH_ENABLED else None
+        app.state.student_service = StudentService(
+            redis_client=redis_client, db_client=db_client, batch_submitter=app.state.batch_submitter
+        )
+
         
-        
+        # Eski anahtar düzeniyle kaydedilmiş canlı oturumlar ve kayıtlar yeni düzene taşınır;
+        # böylece hem cron hem de öğrenci/öğretmen okumaları onları bulabilir. Geçiş tüm
+        # keyspace'i taradığı için worker başına ya da her açılışta değil, yalnızca bir kez çalışır.
+        if await redis_client.try_begin_migration(KEY_LAYOUT_MIGRATION, ttl=KEY_LAYOUT_MIGRATION_TTL_SECONDS):
+            backfilled = await redis_client.backfill_session_indexes()
+            if backfilled:
+                logger.info(f"{backfilled} yoklama oturumu bitiş zamanı indeksine eklendi.")
+            migrated = await redis_client.migrate_legacy_attendance_records()
+            if migrated:
+                logger.info(f"{migrated} eski yoklama kaydı hash düzenine taşındı.")
+            await redis_client.finish_migration(KEY_LAYOUT_MIGRATION)
+
         scheduler = Scheduler()
-        scheduler.add_job(unified_persistence_task, "interval", minutes=5, args=[redis_client, db_client], id="sweep_attendances")
+        # Süresi dolmuş oturum yoksa bir tur tek bir ZRANGEBYSCORE'dan ibarettir; bu yüzden
+        # sık çalıştırılır ve oturumun bitişi ile kalıcı hale gelmesi arasındaki gecikme kısalır.
+        scheduler.add_job(
+            unified_persistence_task, "interval", minutes=PERSISTENCE_INTERVAL_MINUTES,
+            args=[redis_client, db_client], id="sweep_attendances", coalesce=True,
+        )
         scheduler.start()
         
         app.state.scheduler = scheduler
@@ -73,20 +130,39 @@ async def lifespan(app: FastAPI):
         # Hata durumunda state'i temizle
         app.state.postgres_pool = None
         app.state.redis_pool = None
+        app.state.db_client = None
+        app.state.redis_client = None
+        app.state.teacher_service = None
+        app.state.student_service = None
+        app.state.batch_submitter = None
         app.state.scheduler = None
 
     yield
 
     logger.info("Uygulama kapatılıyor...")
-    if hasattr(app.state, 'scheduler') and app.state.scheduler:
-        await app.state.scheduler.shutdown()
-        logger.info("Scheduler kapatıldı.")
-    if hasattr(app.state, 'postgres_pool') and app.state.postgres_pool:
-        await app.state.postgres_pool.close()
-        logger.info("PostgreSQL bağlantı havuzu kapatıldı.")
-    if hasattr(app.state, 'redis_pool') and app.state.redis_pool:
-        await app.state.redis_pool.disconnect()
-        logger.info("Redis bağlantı havuzu kapatıldı.")
+    try:
+        # Arka plandaki yüz tanıma gönderimleri; Redis havuzu ve paylaşılan istemci kapanmadan önce tamamlanır.
+        await drain_background_submissions()
+        if hasattr(app.state, 'batch_submitter') and app.state.batch_submitter:
+            await app.state.batch_submitter.close()
+            logger.info("Toplu yüz tanıma kuyruğu boşaltıldı.")
+        if hasattr(app.state, 'scheduler') and app.state.scheduler:
+            # APScheduler 3.x'te shutdown() senkrondur ve None döner; await edilmez.
+            app.state.scheduler.shutdown()
+            logger.info("Scheduler kapatıldı.")
+        if hasattr(app.state, 'postgres_pool') and app.state.postgres_pool:
+            await app.state.postgres_pool.close()
+            logger.info("PostgreSQL bağlantı havuzu kapatıldı.")
+        if hasattr(app.state, 'redis_pool') and app.state.redis_pool:
+            await app.state.redis_pool.disconnect()
+            logger.info("Redis bağlantı havuzu kapatıldı.")
+        if hasattr(app.state, 'aksis_transport') and app.state.aksis_transport:
+            await app.state.aksis_transport.aclose()
+            logger.info("Aksis HTTP bağlantı havuzu kapatıldı.")
+        await close_shared_client()
+    finally:
+        # Kapanış adımlarından biri hata verse bile kuyruktaki son log kayıtları yazılır.
+        stop_logging()
 
 
 # Ana FastAPI uygulamasını oluştur
@@ -94,13 +170,19 @@ app = FastAPI(
     title="ATTN API",
     description="Yoklama ve Öğrenci Yönetim Sistemi API'si",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # Yanıtlar stdlib json yerine orjson ile serileştirilir (datetime/UUID dahil).
+    default_response_class=ORJSONResponse,
 )
 
 origins = [
    "*"
 ]
 
+# Öğretmen rotalarında rolü token'dan okuyup erken 403 döner.
+# CORS'tan önce eklenir ki CORS en dışta kalsın ve 403 yanıtları da CORS başlıklarını alsın.
+app.add_middleware(TeacherRoleGuard)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -118,8 +200,13 @@ app.include_router(teacher.router, prefix="/api/v1")
 app.include_router(student.router, prefix="/api/v1")
 app.include_router(webhooks.router, prefix="/api/v1")
 
+# Sağlık yanıtı sabit olduğundan bir kez serileştirilir; her istekte aynı byte'lar döner.
+_HEALTH_RESPONSE_BODY = orjson.dumps({"status": "ok", "message": "ATTN API is running."})
+
+
 @app.get("/health", tags=["System"])
-def health_check():
+async def health_check():
     """Uygulamanın ayakta ve sağlıklı olup olmadığını kontrol etmek için basit bir endpoint."""
-    return {"status": "ok", "message": "ATTN API is running."}
+    # async def: iş bloklamadığı için threadpool'a gönderilmeden event loop'ta çalışır.
+    return Response(content=_HEALTH_RESPONSE_BODY, media_type="application/json")
 
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 from typing import Optional
 from uuid import UUID
@@ -7,7 +7,11 @@ from .db_models import User  # Importing the User model from our db_models
 class UserSessionRedis(BaseModel):
     """
     Represents a user's session data stored in Redis.
+    Sessions are never modified after creation (a new one is written on login),
+    and the same instance is shared through the in-process session cache, so it is frozen.
     """
+    model_config = ConfigDict(frozen=True)
+
     user_data: User = Field(..., description="The core user data from the database.")
     session_id: UUID = Field(..., description="Unique ID for this specific session.")
     session_start_time: datetime = Field(..., description="The time this session began.")
@@ -2,7 +2,7 @@
 
 import httpx
 import asyncio
-from bs4 import BeautifulSoup
+from selectolax.parser import HTMLParser
 from datetime import datetime
 import re
 import base64
@@ -14,6 +14,17 @@ from .lesson_finder import find_lessons_for_day
 # Bu modül için özel bir logger oluşturuyoruz.
 logger = logging.getLogger(__name__)
 
+# Ders programı sayfasındaki script içinde geçen dinamik Plans_Read URL'si.
+PLANS_RE = re.compile(rb'Plans_Read\?[^"\']*')
+
+# Aksis sayfalarında aranan seçiciler ve metinler; çağrı başına yeniden oluşturulmaz.
+_TOKEN_SELECTOR = 'input[name="__RequestVerificationToken"]'
+_LOGIN_ERROR_SELECTOR = "div.validation-summary-errors"
+_TEACHER_NAME_SELECTOR = "h5.m-t-0.m-b-0"
+_TEACHER_ROLE_TEXT = "ÖYS AKADEMİSYEN"
+_FULL_NAME_HEADER = "Ad Soyad"
+_SCHOOL_NUMBER_HEADER = "Numara"
+
 # Custom exceptions for clearer error handling
 class AksisAuthError(Exception):
     """Raised when login credentials are incorrect."""
@@ -24,6 +35,16 @@ class AksisSessionError(Exception):
     pass
 
 
+def _next_td_text(node) -> str:
+    """Bir <th> düğümünden sonra gelen ilk <td> kardeşin metnini döndürür."""
+    sibling = node.next
+    while sibling is not None and sibling.tag != "td":
+        sibling = sibling.next
+    if sibling is None:
+        raise AksisSessionError("Profil tablosunda beklenen değer hücresi bulunamadı.")
+    return sibling.text()
+
+
 class AksisClient:
     """
     Client for interacting with the Aksis system.
@@ -48,12 +69,13 @@ class AksisClient:
             response = await client.get(settings.AKSIS_LOGIN_URL)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            token_input = soup.find('input', {'name': '__RequestVerificationToken'})
-            if not token_input:
+            tree = HTMLParser(response.text)
+            token_input = tree.css_first(_TOKEN_SELECTOR)
+            # selectolax eksik özellik için KeyError yerine None döner; token'sız POST sessizce gönderilmemeli.
+            token = token_input.attributes.get('value') if token_input is not None else None
+            if not token:
                 logger.error("Aksis login sayfasında __RequestVerificationToken bulunamadı.")
                 raise AksisSessionError("Login sayfasından doğrulama anahtarı alınamadı.")
-            token = token_input['value']
 
             # 2. Post the login credentials
             login_data = {
@@ -64,17 +86,17 @@ class AksisClient:
             response = await client.post(settings.AKSIS_LOGIN_URL, data=login_data)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
+            tree = HTMLParser(response.text)
             
             # 3. Check for login errors on the new page
-            if soup.find("div", "validation-summary-errors"):
+            if tree.css_first(_LOGIN_ERROR_SELECTOR) is not None:
                 logger.warning(f"Kullanıcı '{self._school_number}' için geçersiz parola veya kullanıcı adı.")
                 raise AksisAuthError("Kullanıcı adı veya şifre hatalı.")
 
             # 4. Determine the user's role and return appropriate data
-            if soup.find("h4", string="ÖYS AKADEMİSYEN"):
-                raw_name_tag = soup.find("h5", class_="m-t-0 m-b-0")
-                raw_name = raw_name_tag.text if raw_name_tag else ""
+            if any(h4.text(strip=True) == _TEACHER_ROLE_TEXT for h4 in tree.css("h4")):
+                raw_name_tag = tree.css_first(_TEACHER_NAME_SELECTOR)
+                raw_name = raw_name_tag.text() if raw_name_tag else ""
                 name_list = raw_name.split(".")
                 full_name = name_list[-1].strip() if name_list else ""
                 logger.info(f"Kullanıcı '{self._school_number}' öğretmen olarak başarıyla giriş yaptı.")
@@ -101,18 +123,20 @@ class AksisClient:
         try:
             response = await client.get(settings.AKSIS_OBS_URL)
             response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
+            tree = HTMLParser(response.text)
             
-            full_name_tag = soup.find("th", string="Ad Soyad")
-            school_number_tag = soup.find("th", string="Numara")
+            # Başlık hücreleri tek geçişte metinlerine göre indekslenir.
+            headers = {th.text(strip=True): th for th in tree.css("th")}
+            full_name_tag = headers.get(_FULL_NAME_HEADER)
+            school_number_tag = headers.get(_SCHOOL_NUMBER_HEADER)
             image_tag = "img"
 
             if not all([full_name_tag, school_number_tag, image_tag]):
                 logger.error(f"Kullanıcı '{self._school_number}' için OBS profil sayfasında gerekli tüm elementler bulunamadı.")
                 raise AksisSessionError("Profil sayfasındaki tüm gerekli bilgiler bulunamadı.")
 
-            full_name = full_name_tag.find_next_sibling("td").text
-            school_number = school_number_tag.find_next_sibling("td").text
+            full_name = _next_td_text(full_name_tag)
+            school_number = _next_td_text(school_number_tag)
             image_url = "sdfdsfsdfdsdsfsdffs"
             
             logger.info(f"Kullanıcı '{self._school_number}' için OBS profil bilgileri başarıyla çekildi.")
@@ -133,16 +157,13 @@ class AksisClient:
         try:
             response = await client.get(settings.AKSIS_LESSON_SCHEDULE_URL)
             response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            script_content = "".join(script.text for script in soup.find_all("script"))
-            
-            match = re.search(r'Plans_Read\?[^"\']*', script_content)
+            # Sayfa DOM'a çevrilmez; URL doğrudan ham gövde üzerinde aranır.
+            match = PLANS_RE.search(response.content)
             if not match:
                 logger.warning(f"Kullanıcı '{self._school_number}' için ders programı verisi bulunamadı.")
                 return []
             
-            dynamic_url_path = match.group(0).replace("\\u0026", "&")
+            dynamic_url_path = match.group(0).decode().replace("\\u0026", "&")
             full_schedule_url = f"{settings.AKSIS_OBS_URL}OgrenimBilgileri/DersProgramiYeni/{dynamic_url_path}"
 
             response = await client.post(full_schedule_url)
@@ -159,9 +180,9 @@ class AksisClient:
             logger.error(f"Ders programı işlenirken beklenmedik bir hata: {e}", exc_info=True)
             raise AksisSessionError(f"Ders programı işlenirken beklenmedik bir hata oluştu: {e}")
 
-    async def get_profile_image_base64(self, image_url: str) -> str:
+    async def get_profile_image_bytes(self, image_url: str) -> bytes:
         """
-        Downloads an image from a URL and returns it as a base64 encoded string.
+        Downloads an image from a URL and returns its raw bytes.
         """
         logger.info(f"Profil resmi indiriliyor: {image_url}")
         client = self._client
@@ -169,13 +190,19 @@ class AksisClient:
             response = await client.get(image_url)
             response.raise_for_status()
             logger.info(f"Profil resmi başarıyla indirildi.")
-            return base64.b64encode(response.content).decode('utf-8')
+            return response.content
         except httpx.RequestError as e:
             logger.error(f"Profil resmi indirilirken ağ hatası: {e}", exc_info=True)
             raise AksisSessionError("Profil resmi indirilirken bir ağ sorunu yaşandı.")
         except Exception as e:
-            logger.error(f"Profil resmi Base64'e çevrilirken hata: {e}", exc_info=True)
+            logger.error(f"Profil resmi işlenirken hata: {e}", exc_info=True)
             raise AksisSessionError(f"Profil resmi işlenirken bir hata oluştu: {e}")
 
+    async def get_profile_image_base64(self, image_url: str) -> str:
+        """
+        Downloads an image from a URL and returns it as a base64 encoded string.
+        """
+        return base64.b64encode(await self.get_profile_image_bytes(image_url)).decode('utf-8')
+
     # Note: HTTP client lifecycle is managed by the caller
     # AksisClient no longer manages client lifecycle
@@ -1,35 +1,40 @@
 # app/backend/modules/lesson_finder.py
 
-from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any
+from datetime import datetime, timezone, timedelta, time
+from typing import List, Dict, Any, Optional
+
+# Aksis schedule times are interpreted in UTC+3 (Turkey).
+_TARGET_TZ = timezone(timedelta(hours=3))
+_DAY_MS = 86_400_000
+
+def _timestamp_ms(date_str: str) -> Optional[int]:
+    """Extracts the epoch milliseconds from a "/Date(xxx)/" string, or None if malformed."""
+    # Slicing off the fixed "/Date(" prefix and ")/" suffix avoids strip()'s character-set scan.
+    if not isinstance(date_str, str) or not date_str.startswith("/Date("):
+        return None
+    try:
+        return int(date_str[6:-2])
+    except ValueError:
+        return None
 
 def _datetime_converter(date_str: str) -> datetime:
     """
     Parses the Microsoft JSON date format, converts it from UTC to a naive
     datetime object representing the time in UTC+3.
     """
-    try:
-        timestamp_ms = int(date_str.strip("/Date()/"))
-        timestamp_s = timestamp_ms / 1000
-        
-        # 1. Create a timezone-aware datetime object in UTC.
-        #    This is the modern, recommended way and avoids deprecation warnings.
-        utc_datetime = datetime.fromtimestamp(timestamp_s, tz=timezone.utc)
-        
-        # 2. Define the target timezone (UTC+3).
-        target_timezone = timezone(timedelta(hours=3))
-        
-        # 3. Convert the UTC datetime to the target timezone.
-        target_datetime_aware = utc_datetime.astimezone(target_timezone)
-        
-        # 4. Return a naive datetime object by removing the timezone info,
-        #    which matches the expectation of the original test.
-        return target_datetime_aware.replace(tzinfo=None)
-        
-    except (ValueError, TypeError):
+    timestamp_ms = _timestamp_ms(date_str)
+    if timestamp_ms is None:
         # Handle cases where date_str is not in the expected format.
         return datetime.min
 
+    # 1. Create a timezone-aware datetime directly in the target timezone (UTC+3),
+    #    using the module-level tzinfo instead of rebuilding it on every call.
+    target_datetime_aware = datetime.fromtimestamp(timestamp_ms / 1000, tz=_TARGET_TZ)
+    
+    # 2. Return a naive datetime object by removing the timezone info,
+    #    which matches the expectation of the original test.
+    return target_datetime_aware.replace(tzinfo=None)
+
 def find_lessons_for_day(schedule_data: List[Dict[str, Any]], target_date: datetime) -> List[Dict[str, Any]]:
     """
     Finds all lessons scheduled for a specific day from the raw schedule data.
@@ -42,12 +47,19 @@ def find_lessons_for_day(schedule_data: List[Dict[str, Any]], target_date: datet
         A list of dictionaries, where each dictionary represents a lesson for the target day.
     """
     lessons_for_day = []
+
+    # The target day's UTC+3 window in epoch milliseconds, computed once. Lessons are
+    # filtered with integer comparisons; datetimes are only built for matching lessons.
+    day_start_ms = int(datetime.combine(target_date.date(), time.min, tzinfo=_TARGET_TZ).timestamp()) * 1000
+    day_end_ms = day_start_ms + _DAY_MS
     
     for lesson in schedule_data:
-        lesson_start_time = _datetime_converter(lesson.get("Start", ""))
+        start_str = lesson.get("Start", "")
+        start_ms = _timestamp_ms(start_str)
         
         # Check if the lesson's start date matches the target date
-        if lesson_start_time.date() == target_date.date():
+        if start_ms is not None and day_start_ms <= start_ms < day_end_ms:
+            lesson_start_time = _datetime_converter(start_str)
             # Extract raw teacher name, split and get the last part
             raw_teacher = lesson.get("Hocalar", "")
             teacher_parts = raw_teacher.split(".")
@@ -1,9 +1,11 @@
+import asyncio
 import logging
 import base64
+import time
 from typing import List, Optional
 from uuid import UUID
 from datetime import datetime, timezone
-import httpx
+from fastapi import UploadFile
 
 # --- Gerekli tüm istemciler ve modeller ---
 from ..db.redis_client import RedisClient
@@ -11,12 +13,17 @@ from ..db.db_client import AsyncPostgresClient
 from ..models.db_models import User
 from ..models.redis_models import AttendanceRedis, AttendanceRecordRedis
 # --- DEĞİŞİKLİK: Yeni face_verifier fonksiyonunu import ediyoruz ---
-from ..tools.face_verifier import submit_face_verification_job, VerificationError
+from ..tools.face_verifier import submit_face_verification_job, VerificationError, BatchSubmitter
 from ..tools.wifi_verifier import verify_wifi
+from ..tools.http import get_shared_client
 from ..modules.aksis import AksisClient
 
 logger = logging.getLogger(__name__)
 
+# Katılım kilidinin ömrü; referans fotoğraf indirme ve doğrulama işi gönderme
+# zaman aşımlarını kapsayacak kadar uzun tutulur.
+ATTEND_LOCK_TTL_SECONDS = 60
+
 class ServiceError(Exception):
     """Servis katmanı için genel hata sınıfı."""
     pass
@@ -25,24 +32,22 @@ class StudentService:
     """
     Öğrenciyle ilgili tüm iş mantığını yürüten servis katmanı.
     """
-    def __init__(self, redis_client: RedisClient, db_client: AsyncPostgresClient):
+    def __init__(self, redis_client: RedisClient, db_client: AsyncPostgresClient, batch_submitter: Optional[BatchSubmitter] = None):
         self.redis_client = redis_client
         self.db_client = db_client
+        # Toplu gönderim açıksa lifespan'de oluşturulan tek örnek; kapalıysa None.
+        self.batch_submitter = batch_submitter
 
     async def find_active_sessions_by_name(self, lesson_name: str, teacher_name: str) -> List[AttendanceRedis]:
         """
         Bir ders adı ve öğretmen adına göre tüm aktif yoklama oturumlarını Redis'ten bulur.
-        Bu metod artık süresi dolmuş oturumları filtreler.
+        Süresi dolmuş oturumlar Redis tarafında (bitiş zamanı indeksiyle) elenir.
         """
         logger.info(f"Aktif ders aranıyor: Ders='{lesson_name}', Öğretmen='{teacher_name}'")
         try:
-            sessions = await self.redis_client.get_attendance_sessions_by_name(lesson_name, teacher_name)
-            
-            # Sadece süresi dolmamış (aktif) oturumları döndür.
-            now = datetime.now(timezone.utc)
-            active_sessions = [session for session in sessions if session.end_time > now]
-            
-            return active_sessions
+            return await self.redis_client.get_attendance_sessions_by_name(
+                lesson_name, teacher_name, now=time.time()
+            )
         except Exception as e:
             logger.error("Aktif dersler aranırken Redis hatası oluştu.", exc_info=True)
             raise ServiceError("Dersler aranırken bir sunucu hatası oluştu.") from e
@@ -51,70 +56,111 @@ class StudentService:
                                          student: User,
                                          attendance_id: UUID,
                                          student_ip: Optional[str] = None,
-                                         normal_image_bytes: Optional[bytes] = None
+                                         normal_image: Optional[UploadFile] = None
                                          ) -> AttendanceRecordRedis:
         """Bir öğrencinin belirli bir ID'ye sahip derse katılımını işler."""
         logger.info(f"Öğrenci '{student.user_school_number}' yoklamaya ({attendance_id}) katılma girişiminde bulunuyor.")
         
-        active_attendance = await self.redis_client.get_attendance_session(attendance_id)
+        # Aynı öğrencinin çift tıklamasıyla iki doğrulama işinin birden gönderilmesini önlemek için
+        # kontrol + gönderim + kayıt adımları kısa ömürlü bir Redis kilidiyle korunur.
+        # Oturum okuma ile kilit alma birbirinden bağımsız olduğundan eşzamanlı yapılır (tek round-trip süresi).
+        # Öğrenci kaydı ise bilerek kilit alındıktan sonra okunur; aksi halde eski bir okuma çift gönderime yol açar.
+        lock_key = f"lock:attend:{attendance_id}:{student.user_school_number}"
+        active_attendance, lock_token = await asyncio.gather(
+            self.redis_client.get_attendance_session(attendance_id),
+            self.redis_client.acquire_lock(lock_key, ttl=ATTEND_LOCK_TTL_SECONDS),
+        )
+
+        session_error: Optional[str] = None
         if not active_attendance:
             logger.warning(f"Öğrenci '{student.user_school_number}' var olmayan bir derse ({attendance_id}) katılmaya çalıştı.")
-            raise ServiceError("This attendance session does not exist.")
-
-        if active_attendance.end_time <= datetime.now(timezone.utc):
+            session_error = "This attendance session does not exist."
+        elif active_attendance.end_time <= datetime.now(timezone.utc):
             logger.warning(f"Öğrenci '{student.user_school_number}' süresi dolmuş bir derse ({attendance_id}) katılmaya çalıştı.")
-            raise ServiceError("This attendance session has already ended.")
-
-        existing_record = await self.redis_client.get_attendance_record_by_id(attendance_id, student.user_school_number)
-        if existing_record:
-            if existing_record.is_attended:
-                raise ServiceError("You have already successfully joined this session.")
-            if existing_record.fail_reason == "FACE_RECOGNITION_PENDING":
-                raise ServiceError("Your attendance is already pending verification. Please wait.")
+            session_error = "This attendance session has already ended."
+        if session_error:
+            if lock_token is not None:
+                await self.redis_client.release_lock(lock_key, lock_token)
+            raise ServiceError(session_error)
 
-        fail_reason: Optional[str] = None
-        security_option = active_attendance.security_option
-        logger.info(f"Yoklama ({attendance_id}) güvenlik seviyesi: {security_option}")
+        if lock_token is None:
+            logger.warning(f"Öğrenci '{student.user_school_number}' için yoklama ({attendance_id}) zaten işleniyor.")
+            raise ServiceError("Your attendance is already being processed. Please wait.")
 
-        # --- Güvenlik Kontrolleri ---
         try:
-            if security_option >= 2:
-                logger.info(f"WiFi check - Student IP: '{student_ip}', Session IP: '{active_attendance.ip_address}', Match: {student_ip == active_attendance.ip_address if student_ip and active_attendance.ip_address else False}")
-                if not student_ip or not verify_wifi(active_attendance, student_ip):
-                    logger.warning(f"WiFi verification FAILED - Student IP: '{student_ip}', Session IP: '{active_attendance.ip_address}'")
-                    fail_reason = "WIFI_FAILED"
+            existing_record = await self.redis_client.get_attendance_record_by_id(attendance_id, student.user_school_number)
+            if existing_record:
+                if existing_record.is_attended:
+                    raise ServiceError("You have already successfully joined this session.")
+                if existing_record.fail_reason == "FACE_RECOGNITION_PENDING":
+                    raise ServiceError("Your attendance is already pending verification. Please wait.")
+
+            fail_reason: Optional[str] = None
+            security_option = active_attendance.security_option
+            logger.info(f"Yoklama ({attendance_id}) güvenlik seviyesi: {security_option}")
+
+            # --- Güvenlik Kontrolleri ---
+            try:
+                if security_option >= 2:
+                    logger.info(f"WiFi check - Student IP: '{student_ip}', Session IP: '{active_attendance.ip_address}', Match: {student_ip == active_attendance.ip_address if student_ip and active_attendance.ip_address else False}")
+                    if not student_ip or not verify_wifi(active_attendance, student_ip):
+                        logger.warning(f"WiFi verification FAILED - Student IP: '{student_ip}', Session IP: '{active_attendance.ip_address}'")
+                        fail_reason = "WIFI_FAILED"
             
-            if security_option == 3 and fail_reason is None:
-                if not normal_image_bytes:
-                    fail_reason = "FACE_VERIFICATION_REQUIRED_BUT_IMAGE_MISSING"
-                else:
-                    user_session = await self.redis_client.get_user_session(student.user_school_number)
-                    if not user_session or not user_session.image_url:
-                        fail_reason = "REFERENCE_IMAGE_NOT_FOUND"
+                if security_option == 3 and fail_reason is None:
+                    # Fotoğraf yalnızca yüz doğrulaması gerçekten gerektiğinde ve kilit alınmışken okunur;
+                    # iş yanıt gönderildikten sonra (dosya kapatılmışken) arka planda iletildiği için
+                    # burada byte'lara çevrilmesi gerekir. Okuma, diske taşmış dosyalarda threadpool'da yapılır.
+                    normal_image_bytes = await normal_image.read() if normal_image is not None else None
+                    if not normal_image_bytes:
+                        fail_reason = "FACE_VERIFICATION_REQUIRED_BUT_IMAGE_MISSING"
                     else:
-                        try:
-                            # Isolated HTTP client for image download
-                            async with httpx.AsyncClient(
-                                timeout=30.0,
-                                cookies=httpx.Cookies()
-                            ) as http_client:
-                                aksis_client = AksisClient(school_number="", password="", http_client=http_client)
-                                ref_image_b64 = await aksis_client.get_profile_image_base64(user_session.image_url)
-                                reference_image_bytes = base64.b64decode(ref_image_b64)
-                                
+                        # Referans fotoğraf günde bir kez Aksis'ten indirilir; sonraki denemeler
+                        # (ör. aynı sınıftaki tekrar girişler) Redis'teki kopyayı kullanır.
+                        # Önbellekte varsa fotoğraf URL'si için kullanıcı oturumunun okunmasına da gerek kalmaz.
+                        reference_image_bytes: Optional[bytes] = None
+                        ref_image_b64 = await self.redis_client.get_reference_image(student.user_school_number)
+                        if ref_image_b64 is not None:
+                            reference_image_bytes = base64.b64decode(ref_image_b64)
+                        else:
+                            user_session = await self.redis_client.get_user_session(student.user_school_number)
+                            if user_session and user_session.image_url:
+                                # Paylaşılan (çerez kabul etmeyen) istemci; bağlantılar istekler arasında yeniden kullanılır.
+                                aksis_client = AksisClient(school_number="", password="", http_client=get_shared_client())
+                                # İndirilen ham byte'lar doğrudan kullanılır; base64'e yalnızca önbelleğe yazmak için çevrilir.
+                                reference_image_bytes = await aksis_client.get_profile_image_bytes(user_session.image_url)
+                                await self.redis_client.save_reference_image(
+                                    student.user_school_number, base64.b64encode(reference_image_bytes).decode('ascii')
+                                )
+                        if reference_image_bytes is None:
+                            fail_reason = "REFERENCE_IMAGE_NOT_FOUND"
+                        else:
+                            try:
                                 # ================================================================= #
                                 # --- REFACTORING BURADA BAŞLIYOR ---
                                 # ================================================================= #
                                 # Eski polling (sorgulama) mantığı yerine yeni webhook sistemini kullanıyoruz.
                                 # Artık bir 'job_id' almıyoruz ve kullanıcıyı bir sıraya eklemiyoruz.
 
+                                # Bekleme kaydı, doğrulama eşleşmesiyle aynı pipeline'da istekten önce yazılır:
+                                # ayrı bir round-trip gerekmez ve webhook, kayıt yazılmadan önce gelemez.
+                                pending_record = AttendanceRecordRedis(
+                                    attendance_id=active_attendance.attendance_id,
+                                    student_number=student.user_school_number,
+                                    student_full_name=student.user_full_name,
+                                    fail_reason="FACE_RECOGNITION_PENDING"
+                                )
                                 await submit_face_verification_job(
                                     student=student,
                                     attendance_id=active_attendance.attendance_id,
                                     normal_image_bytes=normal_image_bytes,
                                     reference_image_bytes=reference_image_bytes,
                                     # Bu servis instance'ının sahip olduğu redis_client'ı doğrudan iletiyoruz.
-                                    redis_client=self.redis_client
+                                    redis_client=self.redis_client,
+                                    pending_record=pending_record,
+                                    # Mikroservis isteği arka planda gönderilir; öğrenci yanıtını beklemez.
+                                    background=True,
+                                    batch_submitter=self.batch_submitter
                                 )
                                 # Durum hala "beklemede", ama artık arka planda bir cron job tarafından
                                 # sorgulanmayacak. Sonuç doğrudan webhook ile gelecek.
@@ -123,27 +169,34 @@ class StudentService:
                                 # --- REFACTORING BURADA BİTİYOR ---
                                 # ================================================================= #
 
-                        except VerificationError as e:
-                            fail_reason = "FACE_VERIFICATION_SUBMISSION_FAILED"
-                            logger.error(f"Yüz tanıma işi gönderilirken hata oluştu: {e}", exc_info=True)
-
-        except Exception as e:
-            logger.error(f"Katılım işlemi sırasında beklenmedik bir hata oluştu: {e}", exc_info=True)
-            raise ServiceError("An unexpected error occurred during the attendance process.")
-
-        # --- Sonuç Kaydını Oluşturma ---
-        final_is_attended = fail_reason is None
-        new_record = AttendanceRecordRedis(
-            attendance_id=active_attendance.attendance_id,
-            student_number=student.user_school_number,
-            student_full_name=student.user_full_name,
-            is_attended=final_is_attended,
-            attendance_time=datetime.now(timezone.utc) if final_is_attended else None,
-            fail_reason=fail_reason
-        )
+                            except VerificationError as e:
+                                fail_reason = "FACE_VERIFICATION_SUBMISSION_FAILED"
+                                logger.error(f"Yüz tanıma işi gönderilirken hata oluştu: {e}", exc_info=True)
+
+            except Exception as e:
+                logger.error(f"Katılım işlemi sırasında beklenmedik bir hata oluştu: {e}", exc_info=True)
+                raise ServiceError("An unexpected error occurred during the attendance process.")
+
+            if fail_reason == "FACE_RECOGNITION_PENDING":
+                # Bekleme kaydı gönderimden önce yazıldı; tekrar yazmak, o arada gelen
+                # webhook sonucunun üzerine yazılmasına yol açardı.
+                return pending_record
+
+            # --- Sonuç Kaydını Oluşturma ---
+            final_is_attended = fail_reason is None
+            new_record = AttendanceRecordRedis(
+                attendance_id=active_attendance.attendance_id,
+                student_number=student.user_school_number,
+                student_full_name=student.user_full_name,
+                is_attended=final_is_attended,
+                attendance_time=datetime.now(timezone.utc) if final_is_attended else None,
+                fail_reason=fail_reason
+            )
         
-        await self.redis_client.add_attendance_record(new_record)
-        return new_record
+            await self.redis_client.add_attendance_record(new_record)
+            return new_record
+        finally:
+            await self.redis_client.release_lock(lock_key, lock_token)
 
     async def get_my_attendance_status(self, attendance_id: UUID, student: User) -> Optional[AttendanceRecordRedis]:
         """Bir öğrencinin belirli bir dersteki yoklama durumunu getirir."""
@@ -33,30 +33,44 @@ class TeacherService:
     def __init__(self, redis_client: RedisClient, db_client: AsyncPostgresClient):
         self.redis_client = redis_client
         self.db_client = db_client
+        # Live sessions live in Redis, finished ones in Postgres; the record source is picked by type.
+        self._record_fetchers = {
+            AttendanceRedis: self.get_live_attendance_records,
+            Attendance: self.get_historical_attendance_records,
+        }
 
     async def _enrich_records_with_user_data(self, records: List[Union[AttendanceRecord, AttendanceRecordRedis]]) -> List[EnrichedAttendanceRecord]:
         if not records:
             return []
         
-        db_records_to_process = [rec for rec in records if isinstance(rec, AttendanceRecord)]
-        redis_records_to_process = [rec for rec in records if isinstance(rec, AttendanceRecordRedis)]
-
-        student_numbers_to_fetch = {rec.student_number for rec in db_records_to_process}
-        user_map = {}
-        if student_numbers_to_fetch:
-            try:
-                users = await self.db_client.get_users(list(student_numbers_to_fetch))
-                user_map = {user.user_school_number: user for user in users}
-            except Exception as e:
-                logger.error("Database error while enriching records.", exc_info=True)
-                raise ServiceError("A database error occurred while fetching user information.") from e
+        # Single pass: live (Redis) records already carry the student's name and are enriched
+        # immediately; historical (DB) records keep their slot until user data is fetched.
+        enriched_or_pending: List[Union[EnrichedAttendanceRecord, AttendanceRecord]] = []
+        student_numbers_to_fetch = set()
+        for record in records:
+            if isinstance(record, AttendanceRecordRedis):
+                student_user = User(user_school_number=record.student_number, user_full_name=record.student_full_name, role="Student")
+                enriched_or_pending.append(EnrichedAttendanceRecord(**record.model_dump(), student=student_user))
+            else:
+                enriched_or_pending.append(record)
+                student_numbers_to_fetch.add(record.student_number)
 
-        enriched_records = []
-        for record in redis_records_to_process:
-            student_user = User(user_school_number=record.student_number, user_full_name=record.student_full_name, role="Student")
-            enriched_records.append(EnrichedAttendanceRecord(**record.model_dump(), student=student_user))
+        if not student_numbers_to_fetch:
+            return enriched_or_pending
+
+        try:
+            users = await self.db_client.get_users(list(student_numbers_to_fetch))
+            user_map = {user.user_school_number: user for user in users}
+        except Exception as e:
+            logger.error("Database error while enriching records.", exc_info=True)
+            raise ServiceError("A database error occurred while fetching user information.") from e
 
-        for record in db_records_to_process:
+        # Input order is preserved; historical records without user data are dropped.
+        enriched_records = []
+        for record in enriched_or_pending:
+            if isinstance(record, EnrichedAttendanceRecord):
+                enriched_records.append(record)
+                continue
             student_user = user_map.get(record.student_number)
             if student_user:
                 enriched_records.append(EnrichedAttendanceRecord(**record.model_dump(), student=student_user))
@@ -102,7 +116,8 @@ class TeacherService:
                 raise AuthorizationError("Attendance not found or you are not authorized to end it.")
             
             # Update the end time to the current time.
-            session_to_finish.end_time = datetime.now(timezone.utc)
+            # The fetched session may be the shared cached instance, so a copy is saved instead.
+            session_to_finish = session_to_finish.model_copy(update={"end_time": datetime.now(timezone.utc)})
             
             # Save the updated session back to Redis.
             # This makes it "expired" and ready for the cron job.
@@ -136,6 +151,10 @@ class TeacherService:
             raise AuthorizationError("Attendance not found or you are not authorized to access it.")
         return db_attendance
 
+    async def get_records(self, attendance: Union[Attendance, AttendanceRedis]) -> List[EnrichedAttendanceRecord]:
+        """Returns the enriched records of a live or historical attendance."""
+        return await self._record_fetchers[type(attendance)](attendance.attendance_id)
+
     async def get_live_attendance_records(self, attendance_id: UUID) -> List[EnrichedAttendanceRecord]:
         records = await self.redis_client.get_attendance_records(attendance_id)
         return await self._enrich_records_with_user_data(records)
@@ -180,16 +199,13 @@ class TeacherService:
 
     async def add_student_to_historical_attendance(self, attendance_id: UUID, student: User, is_attended: bool, reason: Optional[str] = None):
         try:
-            if not await self.db_client.get_attendance_by_id(attendance_id):
-                raise ServiceError(f"Attendance session ({attendance_id}) not found in the database.")
-            
-            await self.db_client.add_users([student])
-
-            new_record = AttendanceRecord(
-                attendance_id=attendance_id, student_number=student.user_school_number, is_attended=is_attended,
+            # Existence check, user upsert and record upsert happen in a single round trip.
+            found = await self.db_client.add_student_to_attendance(
+                attendance_id, student, is_attended,
                 attendance_time=datetime.now(timezone.utc) if is_attended else None, fail_reason=reason
             )
-            await self.db_client.add_attendance_records([new_record])
+            if not found:
+                raise ServiceError(f"Attendance session ({attendance_id}) not found in the database.")
         except Exception as e:
             logger.error(f"Error adding student {student.user_school_number} to historical attendance.", exc_info=True)
             raise ServiceError("An error occurred while adding the student to the historical attendance.") from e
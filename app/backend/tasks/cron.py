@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime, timezone
+from typing import Dict, List, Set
 from uuid import UUID
 import asyncio
 import json
@@ -13,6 +14,56 @@ from ..models.redis_models import AttendanceRedis, AttendanceRecordRedis
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Kalıcılaştırma görevinin çalışma aralığı (dakika).
+PERSISTENCE_INTERVAL_MINUTES = 1
+
+# Bir cron turunda aynı anda işlenecek en fazla oturum sayısı.
+PERSISTENCE_CONCURRENCY = 10
+
+
+# Redis'ten okunan modeller yazılırken zaten doğrulanmıştır; veritabanı modellerine
+# kopyalanırken Pydantic doğrulaması model_construct ile atlanır.
+
+def _teacher_user(session: AttendanceRedis) -> User:
+    return User.model_construct(
+        user_school_number=session.teacher_school_number,
+        user_full_name=session.teacher_full_name,
+        role="Teacher",
+    )
+
+
+def _student_user(rec: AttendanceRecordRedis) -> User:
+    return User.model_construct(
+        user_school_number=rec.student_number,
+        user_full_name=rec.student_full_name,
+        role="Student",
+    )
+
+
+def _db_attendance(session: AttendanceRedis) -> Attendance:
+    return Attendance.model_construct(
+        attendance_id=session.attendance_id,
+        teacher_school_number=session.teacher_school_number,
+        lesson_name=session.lesson_name,
+        ip_address=session.ip_address,
+        start_time=session.start_time,
+        end_time=session.end_time,
+        security_option=session.security_option,
+        is_deleted=session.is_deleted,
+        deletion_reason=session.deletion_reason,
+        deletion_time=session.deletion_time,
+    )
+
+
+def _db_record(rec: AttendanceRecordRedis) -> AttendanceRecord:
+    return AttendanceRecord.model_construct(
+        attendance_id=rec.attendance_id,
+        student_number=rec.student_number,
+        is_attended=rec.is_attended,
+        attendance_time=rec.attendance_time,
+        fail_reason=rec.fail_reason,
+    )
+
 
 async def unified_persistence_task(redis_client: RedisClient, db_client: AsyncPostgresClient):
     """
@@ -22,60 +73,137 @@ async def unified_persistence_task(redis_client: RedisClient, db_client: AsyncPo
     logger.info("Running unified_persistence_task...")
     now = datetime.now(timezone.utc)
 
-    async for session_key in redis_client._redis.scan_iter("attendance_session:*"):
-        attendance_session: AttendanceRedis = None
-        try:
-            session_json = await redis_client._redis.get(session_key)
-            if not session_json:
-                continue
-            
-            attendance_session = AttendanceRedis.model_validate_json(session_json)
-            attendance_id = attendance_session.attendance_id
-
-            if attendance_session.end_time >= now:
-                continue
-
-            logger.info(f"Processing expired attendance session: {attendance_id}")
-
-            # --- DB Persistence (Strict Order) ---
-            teacher_user = User(
-                user_school_number=attendance_session.teacher_school_number,
-                user_full_name=attendance_session.teacher_full_name,
-                role="Teacher"
-            )
-            await db_client.add_users([teacher_user])
-
-            associated_redis_records = await redis_client.get_attendance_records(attendance_id)
-
-            students_to_upsert = []
-            records_to_db = []
-            if associated_redis_records:
-                for rec in associated_redis_records:
-                    students_to_upsert.append(
-                        User(user_school_number=rec.student_number, user_full_name=rec.student_full_name, role="Student")
-                    )
-                    records_to_db.append(AttendanceRecord(**rec.model_dump(include={'attendance_id', 'student_number', 'is_attended', 'attendance_time', 'fail_reason'})))
-                await db_client.add_users(students_to_upsert)
-
-            attendance_to_db = Attendance(**attendance_session.model_dump())
-            await db_client.add_attendances([attendance_to_db])
-
-            if records_to_db:
-                await db_client.add_attendance_records(records_to_db)
-                logger.info(f"Saved {len(records_to_db)} student records for session {attendance_id}.")
-
-            # --- Redis Cleanup ---
-            logger.info(f"Cleaning up Redis for session {attendance_id}...")
-            await redis_client.delete_attendance_session(attendance_session)
-
-            record_keys_to_delete = [f"attendance_records:{attendance_id}:{rec.student_number}" for rec in associated_redis_records]
-            if record_keys_to_delete:
-                await redis_client._redis.delete(*record_keys_to_delete)
-            
-            logger.info(f"Cleanup complete for session {attendance_id}.")
-
-        except Exception as e:
-            session_id_for_log = attendance_session.attendance_id if attendance_session else f"from key {session_key}"
-            logger.error(f"Failed to process session {session_id_for_log}: {e}", exc_info=True)
-
-
+    # Süresi dolmuş oturumlar bitiş zamanı indeksinden (ZSET) bulunur; tüm keyspace taranmaz
+    # ve yalnızca süresi dolmuş oturumların JSON'u tek bir MGET ile okunur.
+    expired_ids = await redis_client.get_expired_attendance_ids(now.timestamp())
+    if not expired_ids:
+        return
+    expired_sessions = await redis_client.get_many_attendance_sessions(expired_ids)
+
+    # Oturum anahtarı artık yoksa indeksteki kayıt sahipsiz kalmıştır; tekrar listelenmemesi için silinir.
+    found_ids = {str(session.attendance_id) for session in expired_sessions}
+    orphan_ids = [aid for aid in expired_ids if aid not in found_ids]
+    if orphan_ids:
+        await redis_client.remove_from_end_time_index(orphan_ids)
+
+    # Tüm süresi dolmuş oturumların öğrenci kayıtları tek bir pipeline ile okunur.
+    records_by_attendance = await redis_client.get_many_attendance_records(list(found_ids))
+
+    # Oturumlar sınırlı eşzamanlılıkla işlenir; havuz tek bir cron turu tarafından tüketilmez.
+    semaphore = asyncio.Semaphore(PERSISTENCE_CONCURRENCY)
+
+    # Tüm oturumların satırları tek seferde yazılır: kullanıcılar, yoklamalar ve kayıtlar için
+    # toplam üç çağrı (büyük partilerde db_client COPY kullanır).
+    try:
+        await _flush_expired_sessions(expired_sessions, records_by_attendance, db_client)
+    except Exception as e:
+        # Toplu yazma başarısız olursa hatalı oturum diğerlerini engellemesin diye
+        # oturum bazında (eski yol) tekrar denenir; tüm eklemeler çakışmada bir şey yapmaz.
+        logger.error(f"Batched persistence failed, falling back to per-session processing: {e}", exc_info=True)
+
+        # Redis temizliği arka plan görevi olarak başlatılır; semafor bir sonraki oturumun
+        # veritabanı yazımına hemen geçer. Görevler tur sonunda toplu olarak beklenir.
+        pending_cleanups: Set[asyncio.Task] = set()
+
+        async def _bounded(attendance_session: AttendanceRedis):
+            async with semaphore:
+                await _persist_expired_session(
+                    attendance_session,
+                    records_by_attendance.get(str(attendance_session.attendance_id), []),
+                    redis_client,
+                    db_client,
+                    pending_cleanups,
+                )
+
+        await asyncio.gather(*(_bounded(session) for session in expired_sessions))
+        await asyncio.gather(*pending_cleanups, return_exceptions=True)
+        return
+
+    logger.info(f"Persisted {len(expired_sessions)} expired sessions; cleaning up Redis...")
+
+    async def _cleanup(attendance_session: AttendanceRedis):
+        async with semaphore:
+            await _cleanup_redis_session(attendance_session, redis_client)
+
+    await asyncio.gather(*(_cleanup(session) for session in expired_sessions))
+
+
+async def _flush_expired_sessions(
+    expired_sessions: List[AttendanceRedis],
+    records_by_attendance: Dict[str, List[AttendanceRecordRedis]],
+    db_client: AsyncPostgresClient,
+):
+    """Bir cron turundaki tüm süresi dolmuş oturumları üç toplu çağrıyla veritabanına yazar."""
+    users: Dict[str, User] = {}
+    attendances_to_db = []
+    records_to_db = []
+    for attendance_session in expired_sessions:
+        if attendance_session.teacher_school_number not in users:
+            users[attendance_session.teacher_school_number] = _teacher_user(attendance_session)
+        attendances_to_db.append(_db_attendance(attendance_session))
+        for rec in records_by_attendance.get(str(attendance_session.attendance_id), []):
+            if rec.student_number not in users:
+                users[rec.student_number] = _student_user(rec)
+            records_to_db.append(_db_record(rec))
+
+    # --- DB Persistence (Strict Order) ---
+    await db_client.add_users([users[number] for number in sorted(users)])
+    await db_client.add_attendances(attendances_to_db)
+    if records_to_db:
+        await db_client.add_attendance_records(records_to_db)
+        logger.info(f"Saved {len(records_to_db)} student records across {len(attendances_to_db)} sessions.")
+
+
+async def _persist_expired_session(
+    attendance_session: AttendanceRedis,
+    associated_redis_records: List[AttendanceRecordRedis],
+    redis_client: RedisClient,
+    db_client: AsyncPostgresClient,
+    pending_cleanups: Set[asyncio.Task],
+):
+    """
+    Tek bir süresi dolmuş oturumu veritabanına yazar ve Redis temizliğini arka planda başlatır.
+    Temizlik görevi pending_cleanups kümesine eklenir. Hataları loglar, yükseltmez.
+    """
+    attendance_id = attendance_session.attendance_id
+    try:
+        logger.info(f"Processing expired attendance session: {attendance_id}")
+
+        # --- DB Persistence (Strict Order) ---
+        await db_client.add_users([_teacher_user(attendance_session)])
+
+        students_to_upsert = []
+        records_to_db = []
+        if associated_redis_records:
+            for rec in associated_redis_records:
+                students_to_upsert.append(_student_user(rec))
+                records_to_db.append(_db_record(rec))
+            # Eşzamanlı oturumlar aynı öğrencileri ekleyebilir; satırlar her seferinde aynı
+            # sırayla kilitlensin diye okul numarasına göre sıralanır (deadlock önlemi).
+            students_to_upsert.sort(key=lambda user: user.user_school_number)
+            await db_client.add_users(students_to_upsert)
+
+        attendance_to_db = _db_attendance(attendance_session)
+        await db_client.add_attendances([attendance_to_db])
+
+        if records_to_db:
+            await db_client.add_attendance_records(records_to_db)
+            logger.info(f"Saved {len(records_to_db)} student records for session {attendance_id}.")
+
+        # --- Redis Cleanup ---
+        # Veritabanı yazımı tamamlandı; temizlik başarısız olsa bile bir sonraki turda tekrar denenir.
+        pending_cleanups.add(asyncio.create_task(_cleanup_redis_session(attendance_session, redis_client)))
+
+    except Exception as e:
+        logger.error(f"Failed to process session {attendance_id}: {e}", exc_info=True)
+
+
+async def _cleanup_redis_session(attendance_session: AttendanceRedis, redis_client: RedisClient):
+    """Oturumu, indekslerini ve öğrenci kayıtlarını tek bir pipeline ile Redis'ten siler. Hataları loglar."""
+    attendance_id = attendance_session.attendance_id
+    try:
+        logger.info(f"Cleaning up Redis for session {attendance_id}...")
+        await redis_client.delete_attendance_session(attendance_session)
+        logger.info(f"Cleanup complete for session {attendance_id}.")
+    except Exception as e:
+        logger.error(f"Failed to clean up session {attendance_id}: {e}", exc_info=True)
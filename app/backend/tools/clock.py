@@ -0,0 +1,23 @@
+# app/backend/tools/clock.py
+
+import time
+from datetime import datetime, timezone
+
+# (milisaniye, datetime) çifti; aynı milisaniye içindeki çağrılar aynı nesneyi paylaşır.
+_last: tuple = (0, None)
+
+
+def utcnow_ms() -> datetime:
+    """
+    Milisaniye çözünürlüğünde, timezone-aware UTC şimdiki zamanı döndürür.
+
+    Soft-delete ve doğrulama zamanı gibi milisaniye altı hassasiyetin önemsiz olduğu
+    yerlerde kullanılır; aynı milisaniyede gelen çağrılar için datetime yeniden oluşturulmaz.
+    """
+    global _last
+    now_ms = time.time_ns() // 1_000_000
+    if _last[0] == now_ms:
+        return _last[1]
+    dt = datetime.fromtimestamp(now_ms / 1000, tz=timezone.utc)
+    _last = (now_ms, dt)
+    return dt
@@ -1,11 +1,33 @@
+import asyncio
+import base64
+import logging
+import os
 import httpx
+import orjson
 import uuid
-from typing import Dict
+from typing import Dict, List, NamedTuple, Optional, Set
 
 # Gerekli ayarları ve modelleri import edelim
 from ..config.config import settings
 from ..db.redis_client import RedisClient
 from ..models.db_models import User
+from ..models.redis_models import AttendanceRecordRedis
+from .http import get_shared_client
+
+# URL'ler ayarlardan modül yüklenirken bir kez oluşturulur.
+_VERIFY_FACE_URL = f"{settings.FACE_VERIFIER_MICROSERVICE_URL}/verify-face-async"
+_VERIFY_FACE_BATCH_URL = f"{settings.FACE_VERIFIER_MICROSERVICE_URL}/verify-face-async-batch"
+_WEBHOOK_URL_PREFIX = f"{settings.MAIN_APP_BASE_URL}/api/v1/webhooks/verification-result/"
+
+# Toplu gönderimde ilk işten sonra diğerlerinin bekleneceği süre (saniye) ve bir istekteki en fazla iş sayısı.
+BATCH_WINDOW_SECONDS = 0.05
+BATCH_MAX_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+# Arka planda devam eden gönderim görevleri. Referans tutulmazsa görevler tamamlanmadan
+# çöp toplayıcı tarafından silinebilir; kapanışta drain_background_submissions ile beklenir.
+_background_submissions: Set[asyncio.Task] = set()
 
 class VerificationError(Exception):
     """Yüz tanıma işlemi sırasında oluşan hatalar için özel exception."""
@@ -17,21 +39,34 @@ async def submit_face_verification_job(
     attendance_id: uuid.UUID,
     normal_image_bytes: bytes,
     reference_image_bytes: bytes,
-    redis_client: RedisClient
+    redis_client: RedisClient,
+    pending_record: Optional[AttendanceRecordRedis] = None,
+    background: bool = False,
+    batch_submitter: Optional["BatchSubmitter"] = None
 ) -> str:
     """
     Yüz tanıma işini, geri çağrı (webhook) URL'i ile birlikte mikroservise gönderir.
 
     Bu fonksiyon artık bir 'job_id' beklemez. Bunun yerine, mikroservisin işi
     bitirdiğinde sonucu göndereceği eşsiz bir URL oluşturur ve bu URL'i mikroservise iletir.
+    `pending_record` verilirse öğrencinin bekleme kaydı, eşleşmeyle birlikte istekten önce yazılır.
+
+    `background=True` ise mikroservis isteği arka plan görevi olarak gönderilir ve fonksiyon
+    beklemeden döner. Bu modda `pending_record` zorunludur: gönderim başarısız olursa kayıt
+    FACE_VERIFICATION_SUBMISSION_FAILED olarak güncellenir. Arka plan modunda `batch_submitter`
+    verilirse iş tek başına gönderilmek yerine toplu gönderim kuyruğuna eklenir.
     """
+    if background and pending_record is None:
+        raise ValueError("Arka plan gönderimi için pending_record gereklidir.")
     # 1. Bu doğrulama işlemi için eşsiz ve tahmin edilemez bir ID oluştur
-    verification_id = str(uuid.uuid4())
+    #    128 bit rastgele değer URL-güvenli base64 ile 22 karaktere kodlanır (UUID metni 36 karakter);
+    #    Redis anahtarı ve webhook URL'i kısalır.
+    verification_id = base64.urlsafe_b64encode(os.urandom(16)).rstrip(b'=').decode('ascii')
 
     # 2. Mikroservisin geri arayacağı tam webhook URL'ini oluştur.
     #    Bu URL, bizim Adım 1'de oluşturduğumuz endpoint'i işaret eder.
     #    MAIN_APP_BASE_URL .env dosyanızda tanımlı olmalı (örn: https://api.sizin-domaininiz.com)
-    webhook_url = f"{settings.MAIN_APP_BASE_URL}/api/v1/webhooks/verification-result/{verification_id}"
+    webhook_url = f"{_WEBHOOK_URL_PREFIX}{verification_id}"
 
     # 3. Mikroservise gönderilecek veriyi hazırla.
     #    'data' kısmı, form verisi olarak gönderilir.
@@ -41,6 +76,9 @@ async def submit_face_verification_job(
         "student_school_number": student.user_school_number,
     }
     # 'files' kısmı ise resim dosyalarını içerir.
+    # Her iki resim de bellekteki byte'lar olarak gelir ve multipart gövdeye olduğu gibi yazılır
+    # (akış yapılmaz): öğrenci fotoğrafı servis tarafından okunur, çünkü iş arka planda
+    # gönderildiğinde yüklenen dosya çoktan kapatılmış olur.
     files = {
         'picture': ('image.jpg', normal_image_bytes, 'image/jpeg'),
         'intended_picture': ('reference_image.jpeg', reference_image_bytes, 'image/jpeg')
@@ -51,33 +89,148 @@ async def submit_face_verification_job(
     await redis_client.map_verification_to_user(
         verification_id=verification_id,
         user_school_number=student.user_school_number,
-        attendance_id=str(attendance_id)
+        attendance_id=str(attendance_id),
+        pending_record=pending_record
     )
 
     # 5. İsteği mikroservise gönder.
-    #    Not: Mikroservisin URL'i .env dosyasında FACE_VERIFIER_MICROSERVICE_URL olarak tanımlı olmalı.
-    async with httpx.AsyncClient(timeout=30.0) as client:
+    #    Sonuç zaten webhook ile geldiğinden, arka plan modunda öğrenci mikroservisin yanıtını beklemez.
+    if background and batch_submitter is not None:
+        batch_submitter.submit(_BatchItem(data, normal_image_bytes, reference_image_bytes, redis_client, pending_record))
+        return "SUBMITTED"
+    if background:
+        task = asyncio.create_task(_post_in_background(files, data, redis_client, pending_record))
+        _background_submissions.add(task)
+        task.add_done_callback(_background_submissions.discard)
+        return "SUBMITTED"
+    return await _post_verification_job(files, data)
+
+
+async def _post_in_background(files: Dict, data: Dict, redis_client: RedisClient, pending_record: AttendanceRecordRedis):
+    """İşi gönderir; başarısız olursa bekleme kaydını hata nedeniyle günceller. Hataları yükseltmez."""
+    try:
+        await _post_verification_job(files, data)
+    except VerificationError as e:
+        logger.error(f"Yüz tanıma işi arka planda gönderilemedi: {e}")
+        await _mark_submission_failed(redis_client, pending_record)
+
+
+async def _mark_submission_failed(redis_client: RedisClient, pending_record: AttendanceRecordRedis):
+    """Gönderilemeyen işin bekleme kaydını hata nedeniyle günceller; öğrenci tekrar deneyebilir."""
+    try:
+        await redis_client.update_attendance_record(
+            pending_record.model_copy(update={"fail_reason": "FACE_VERIFICATION_SUBMISSION_FAILED"})
+        )
+    except Exception as update_error:
+        logger.error(f"Başarısız gönderim kaydı güncellenemedi: {update_error}", exc_info=True)
+
+
+class _BatchItem(NamedTuple):
+    data: Dict
+    normal_image_bytes: bytes
+    reference_image_bytes: bytes
+    redis_client: RedisClient
+    pending_record: AttendanceRecordRedis
+
+
+class BatchSubmitter:
+    """
+    Kısa bir pencere içinde gelen yüz tanıma işlerini biriktirip mikroservise tek bir
+    multipart istekle gönderir. İlk iş geldikten sonra en fazla `window` saniye ya da
+    `max_size` iş kadar beklenir. Arka plan görevi ilk gönderimde başlatılır.
+    Uygulama ömrüne bağlıdır: lifespan'de oluşturulur, kapanışta close() ile boşaltılır.
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW_SECONDS, max_size: int = BATCH_MAX_SIZE):
+        self._window = window
+        self._max_size = max_size
+        # Kuyruk bir kez oluşturulur; görev yeniden başlatılsa bile içindeki işler kaybolmaz.
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    def submit(self, item: _BatchItem) -> None:
+        """İşi kuyruğa ekler; gönderim arka planda yapılır."""
+        self._queue.put_nowait(item)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Kuyruktaki tüm işler gönderilene kadar bekler ve arka plan görevini durdurur."""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                deadline = loop.time() + self._window
+                while len(batch) < self._max_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await self._send(batch)
+            except Exception as e:
+                # Tek bir partideki beklenmedik hata görevi sonlandırmamalı; sonraki işler gönderilmeye devam eder.
+                logger.error(f"Toplu yüz tanıma gönderimi sırasında beklenmedik hata: {e}", exc_info=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _send(self, batch: List[_BatchItem]) -> None:
+        # Her iş için numaralı iki resim parçası; form alanları ise sıralı bir JSON listesi olarak gönderilir.
+        files = []
+        for index, item in enumerate(batch):
+            files.append((f"picture_{index}", ('image.jpg', item.normal_image_bytes, 'image/jpeg')))
+            files.append((f"intended_picture_{index}", ('reference_image.jpeg', item.reference_image_bytes, 'image/jpeg')))
+        jobs = orjson.dumps([item.data for item in batch]).decode('utf-8')
         try:
-            # Artık /submit-job değil, doğrudan asenkron çalışacak bir endpoint'e gönderiyoruz.
-            # Bu endpoint'i bir sonraki adımda mikroserviste oluşturacağız.
-            response = await client.post(
-                f"{settings.FACE_VERIFIER_MICROSERVICE_URL}/verify-face-async",
-                files=files,
-                data=data # `data` parametresi form verisi gönderir
-            )
-            response.raise_for_status() # HTTP 4xx veya 5xx hatalarında exception fırlatır
-
-            # Mikroservis artık anında bir "kabul edildi" mesajı dönecek.
-            # Gerçek sonuç daha sonra webhook ile gelecek.
-            return "SUBMITTED"
-
-        except httpx.HTTPStatusError as e:
-            # İstek başarısız olursa, Redis'teki eşleşmeyi temizlememiz gerekir ki çöp veri kalmasın.
-            await redis_client.delete_verification_mapping(verification_id)
-            raise VerificationError(f"Submit Job - Mikroservis hatası: {e.response.status_code} - {e.response.text}")
+            response = await get_shared_client().post(_VERIFY_FACE_BATCH_URL, files=files, data={'jobs': jobs})
+            response.raise_for_status()
         except Exception as e:
-            await redis_client.delete_verification_mapping(verification_id)
-            raise VerificationError(f"Submit Job - Beklenmedik bir hata: {str(e)}")
+            logger.error(f"{len(batch)} yüz tanıma işi toplu olarak gönderilemedi: {e}")
+            await asyncio.gather(*(_mark_submission_failed(item.redis_client, item.pending_record) for item in batch))
+
+
+async def drain_background_submissions() -> None:
+    """Kapanışta devam eden arka plan gönderimlerinin bitmesini bekler."""
+    if _background_submissions:
+        await asyncio.gather(*_background_submissions, return_exceptions=True)
+
+
+async def _post_verification_job(files: Dict, data: Dict) -> str:
+    """İşi mikroservise gönderir; başarısızlıkta VerificationError yükseltir."""
+    # Not: Mikroservisin URL'i .env dosyasında FACE_VERIFIER_MICROSERVICE_URL olarak tanımlı olmalı.
+    # Paylaşılan istemci kullanılır; mikroservise açılan bağlantılar istekler arasında yeniden kullanılır.
+    client = get_shared_client()
+    try:
+        # Artık /submit-job değil, doğrudan asenkron çalışacak bir endpoint'e gönderiyoruz.
+        # Bu endpoint'i bir sonraki adımda mikroserviste oluşturacağız.
+        response = await client.post(
+            _VERIFY_FACE_URL,
+            files=files,
+            data=data # `data` parametresi form verisi gönderir
+        )
+        response.raise_for_status() # HTTP 4xx veya 5xx hatalarında exception fırlatır
+
+        # Mikroservis artık anında bir "kabul edildi" mesajı dönecek.
+        # Gerçek sonuç daha sonra webhook ile gelecek.
+        return "SUBMITTED"
+
+    except httpx.HTTPStatusError as e:
+        # Başarısız gönderimlerde eşleşme ayrıca silinmez (ek bir round-trip); TTL ile kendiliğinden düşer.
+        # Her denemede yeni bir doğrulama ID'si üretildiğinden kalan eşleşme sonraki denemeleri etkilemez.
+        raise VerificationError(f"Submit Job - Mikroservis hatası: {e.response.status_code} - {e.response.text}")
+    except Exception as e:
+        raise VerificationError(f"Submit Job - Beklenmedik bir hata: {str(e)}")
 
 
 # --- ARTIK GEREKLİ DEĞİL ---
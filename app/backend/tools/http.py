@@ -0,0 +1,41 @@
+# app/backend/tools/http.py
+
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Optional
+
+import httpx
+
+# Uygulama ömrü boyunca paylaşılan HTTP istemcisi; ilk kullanımda oluşturulur,
+# lifespan kapanışında kapatılır.
+_client: Optional[httpx.AsyncClient] = None
+
+# Erişilemeyen bir sunucu bağlantı ya da havuz beklemesinde hızla başarısız olur;
+# yavaş ama ilerleyen bir indirme (ör. profil fotoğrafı) için okuma süresi daha uzun tutulur.
+_TIMEOUT = httpx.Timeout(20.0, connect=5.0, write=5.0, pool=5.0)
+
+
+def get_shared_client() -> httpx.AsyncClient:
+    """
+    Aksis dışı (çerez gerektirmeyen) istekler için paylaşılan AsyncClient'ı döndürür.
+
+    Bağlantılar (TCP/TLS) istekler arasında yeniden kullanılır ve HTTP/2 ile çoklanır.
+    Çerez kutusu hiçbir çerezi kabul etmez; böylece kullanıcılar arasında oturum
+    bilgisi sızmaz ve her istek için ayrı bir istemciye gerek kalmaz.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=_TIMEOUT,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=200),
+            cookies=httpx.Cookies(CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))),
+        )
+    return _client
+
+
+async def close_shared_client() -> None:
+    """Paylaşılan istemciyi ve bağlantı havuzunu kapatır."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -2,7 +2,50 @@
 
 from ..models.db_models import Attendance
 
-import ipaddress
+import socket
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# Aynı ağ kabul edilen alt ağ maskeleri: IPv4 için /24 (Class C), IPv6 için /64.
+_IPV4_MASK = 0xFFFFFF00
+_IPV6_MASK = ((1 << 64) - 1) << 64
+
+
+def _parse_ip(ip: str) -> Optional[Tuple[int, int]]:
+    """
+    IP adresini (alt ağ maskesi, tamsayı değer) çiftine çevirir; geçersizse None döner.
+    ipaddress nesneleri yerine inet_pton (C) ve tamsayı karşılaştırması kullanılır.
+    """
+    family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+    if family == socket.AF_INET6:
+        # inet_pton bölge kimliğini (ör. "fe80::1%eth0") kabul etmez; alt ağ karşılaştırması için önemsizdir.
+        ip = ip.partition("%")[0]
+    try:
+        packed = socket.inet_pton(family, ip)
+    except OSError:
+        return None
+    mask = _IPV6_MASK if family == socket.AF_INET6 else _IPV4_MASK
+    return mask, int.from_bytes(packed, "big")
+
+
+@lru_cache(maxsize=4096)
+def _same_subnet(session_ip_str: str, student_ip_str: str) -> bool:
+    """
+    İki IP adresinin aynı alt ağda olup olmadığını döndürür.
+    Aynı öğrenci aynı oturum için tekrar tekrar istek attığından sonuç (LRU ile sınırlı) önbelleklenir.
+    """
+    session_ip = _parse_ip(session_ip_str)
+    student_ip = _parse_ip(student_ip_str)
+    # If IP parsing fails, the exact string comparison in verify_wifi was the only possible match
+    if session_ip is None or student_ip is None:
+        return False
+
+    session_mask, session_int = session_ip
+    student_mask, student_int = student_ip
+    # Farklı maskeler farklı IP sürümleri demektir (IPv4 / IPv6); bunlar farklı ağlardır.
+    # Aynı sürümde ise maskelenmiş bitlerin eşit olması aynı alt ağda olmak demektir.
+    return session_mask == student_mask and (session_int ^ student_int) & session_mask == 0
+
 
 def verify_wifi(attendance: Attendance, ip_address: str) -> bool:
     """
@@ -23,23 +66,4 @@ def verify_wifi(attendance: Attendance, ip_address: str) -> bool:
     if attendance.ip_address == ip_address:
         return True
     
-    try:
-        session_ip = ipaddress.ip_address(attendance.ip_address)
-        student_ip = ipaddress.ip_address(ip_address)
-        
-        # If both are IPv6, check if they're in the same /64 subnet
-        if isinstance(session_ip, ipaddress.IPv6Address) and isinstance(student_ip, ipaddress.IPv6Address):
-            session_network = ipaddress.IPv6Network(f"{session_ip}/64", strict=False)
-            return student_ip in session_network
-        
-        # If both are IPv4, check if they're in the same /24 subnet (Class C)
-        elif isinstance(session_ip, ipaddress.IPv4Address) and isinstance(student_ip, ipaddress.IPv4Address):
-            session_network = ipaddress.IPv4Network(f"{session_ip}/24", strict=False)
-            return student_ip in session_network
-        
-        # If IP versions don't match, they're different networks
-        return False
-        
-    except ValueError:
-        # If IP parsing fails, fall back to exact string comparison
-        return attendance.ip_address == ip_address
+    return _same_subnet(attendance.ip_address, ip_address)
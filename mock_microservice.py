@@ -1,5 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
+import json
 import uuid
 
 app = FastAPI(
@@ -34,6 +35,30 @@ async def verify_face_asynchronously(
         content={"status": "Job accepted", "verification_id": verification_id}
     )
 
+@app.post("/verify-face-async-batch")
+async def verify_faces_in_batch(request: Request):
+    """
+    Toplu gönderim uç noktası: `jobs` alanında her işin form verilerini içeren bir JSON listesi,
+    her iş için de `picture_{i}` ve `intended_picture_{i}` dosya parçalarını bekler.
+    Tekil uç nokta gibi işleri kabul eder ve anında 202 (Accepted) yanıtı döner.
+    """
+    form = await request.form()
+    try:
+        jobs = json.loads(form["jobs"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=422, detail="Missing or invalid jobs field.")
+
+    for index in range(len(jobs)):
+        for field in (f"picture_{index}", f"intended_picture_{index}"):
+            upload = form.get(field)
+            if upload is None or getattr(upload, "content_type", None) not in ("image/jpeg", "image/png"):
+                raise HTTPException(status_code=415, detail=f"Missing or invalid file for {field}.")
+
+    return JSONResponse(
+        status_code=202,
+        content={"status": "Jobs accepted", "verification_ids": [job["verification_id"] for job in jobs]}
+    )
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
@@ -176,6 +176,9 @@ class TestAttendanceRecordAPI:
         records = response.json()
         assert len(records) == 1
         assert records[0]["student"]["user_school_number"] == STUDENT_SCHOOL_NUMBER
+        # Yanıt yalnızca AttendanceRecordResponse/UserResponse alanlarını içerir.
+        assert set(records[0]) == {"attendance_id", "is_attended", "attendance_time", "fail_reason", "student"}
+        assert set(records[0]["student"]) == {"user_school_number", "user_full_name", "role"}
 
     async def test_accept_student_in_live_attendance(self, teacher_client: httpx.AsyncClient, redis_pool):
         created_att = await create_live_attendance(teacher_client)
@@ -1,6 +1,7 @@
 import pytest
 import pytest_asyncio
 import uuid
+import base64
 import hmac
 import hashlib
 import json
@@ -78,7 +79,8 @@ async def test_webhook_success_verification_passed(http_client: AsyncClient, red
     Senaryo: Geçerli ve başarılı bir webhook isteği geldiğinde yoklama kaydı güncellenir.
     """
     redis_client = RedisClient(pool=redis_pool)
-    verification_id = uuid.uuid4()
+    # Yeni format: 22 karakterlik URL-güvenli base64 (diğer testler eski UUID formatını kapsar).
+    verification_id = base64.urlsafe_b64encode(uuid.uuid4().bytes).rstrip(b'=').decode('ascii')
     student_number = "S-SUCCESS"
     attendance_id = uuid.uuid4()
 
@@ -71,6 +71,37 @@ async def test_add_and_get_users(db_pool: asyncpg.Pool):
     retrieved_students = await client.get_users(student_numbers)
     assert len(retrieved_students) == 3
 
+@pytest.mark.asyncio
+async def test_bulk_add_users_and_records_via_copy(db_pool: asyncpg.Pool):
+    """
+    Senaryo: COPY_THRESHOLD üzerindeki yığınlar geçici tablo + COPY yolundan yazılır.
+    Beklenti: Tüm kullanıcılar ve kayıtlar eklenir; tekrar eden kayıtlardan sonuncusu kalır.
+    """
+    client = AsyncPostgresClient(pool=db_pool)
+    teacher = create_sample_teacher()
+    students = create_sample_students(150)
+    await client.add_users([teacher] + students)
+    assert len(await client.get_users([s.user_school_number for s in students])) == 150
+
+    attendance_session = create_sample_attendance(teacher.user_school_number)
+    await client.add_attendances([attendance_session])
+
+    records = [
+        AttendanceRecord(attendance_id=attendance_session.attendance_id, student_number=s.user_school_number, is_attended=False)
+        for s in students
+    ]
+    records.append(AttendanceRecord(
+        attendance_id=attendance_session.attendance_id, student_number=students[0].user_school_number,
+        is_attended=True, attendance_time=datetime.now(timezone.utc)
+    ))
+    await client.add_attendance_records(records)
+
+    retrieved = await client.get_attendance_records(attendance_session.attendance_id)
+    assert len(retrieved) == 150
+    first = next(r for r in retrieved if r.student_number == students[0].user_school_number)
+    assert first.is_attended is True
+
+
 @pytest.mark.asyncio
 async def test_add_and_get_attendance_records(db_pool: asyncpg.Pool):
     """
@@ -106,6 +137,31 @@ async def test_add_and_get_attendance_records(db_pool: asyncpg.Pool):
     assert len(retrieved_records) == 2
 
 
+@pytest.mark.asyncio
+async def test_add_student_to_attendance_single_round_trip(db_pool: asyncpg.Pool):
+    """
+    Senaryo: Henüz Users tablosunda olmayan bir öğrenci geçmiş bir yoklamaya eklenir.
+    Beklenti: Kullanıcı ve kayıt tek sorguda oluşturulur; olmayan yoklama için False döner.
+    """
+    client = AsyncPostgresClient(pool=db_pool)
+    teacher, student = create_sample_teacher(), create_sample_students(1)[0]
+    await client.add_users([teacher])
+    attendance_session = create_sample_attendance(teacher.user_school_number)
+    await client.add_attendances([attendance_session])
+
+    found = await client.add_student_to_attendance(
+        attendance_session.attendance_id, student, True,
+        attendance_time=datetime.now(timezone.utc), fail_reason=None
+    )
+    assert found is True
+    assert len(await client.get_users([student.user_school_number])) == 1
+    records = await client.get_attendance_records(attendance_session.attendance_id)
+    assert len(records) == 1 and records[0].is_attended is True
+
+    missing = await client.add_student_to_attendance(uuid.uuid4(), student, False, attendance_time=None, fail_reason="x")
+    assert missing is False
+
+
 @pytest.mark.asyncio
 async def test_accept_historical_record(db_pool: asyncpg.Pool):
     """Senaryo: Geçmiş bir yoklama kaydını 'başarılı' olarak günceller."""
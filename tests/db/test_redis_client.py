@@ -102,6 +102,30 @@ async def test_save_and_get_attendance_session(redis_pool):
     assert retrieved is not None
     assert retrieved.model_dump() == attendance_session.model_dump()
 
+@pytest.mark.asyncio
+async def test_get_attendance_session_cache_is_invalidated_on_save(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    attendance_session = create_sample_attendance_redis()
+    await client.save_attendance_session(attendance_session)
+    first = await client.get_attendance_session(attendance_session.attendance_id)
+    assert await client.get_attendance_session(attendance_session.attendance_id) is first
+
+    finished = attendance_session.model_copy(update={"end_time": datetime.now(timezone.utc)})
+    await client.save_attendance_session(finished)
+    retrieved = await client.get_attendance_session(attendance_session.attendance_id)
+    assert retrieved.end_time == finished.end_time
+
+@pytest.mark.asyncio
+async def test_concurrent_get_attendance_session_shares_one_lookup(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    attendance_session = create_sample_attendance_redis()
+    await client.save_attendance_session(attendance_session)
+    results = await asyncio.gather(
+        *(client.get_attendance_session(attendance_session.attendance_id) for _ in range(5))
+    )
+    assert all(result is results[0] for result in results)
+    assert results[0].attendance_id == attendance_session.attendance_id
+
 @pytest.mark.asyncio
 async def test_delete_attendance_session_removes_all_data(redis_pool):
     client = RedisClient(pool=redis_pool)
@@ -111,11 +135,76 @@ async def test_delete_attendance_session_removes_all_data(redis_pool):
     assert await client.get_attendance_session(attendance_session.attendance_id) is None
     
     raw_redis_client = redis.Redis(connection_pool=redis_pool, decode_responses=True)
-    index_key_by_name = f"attendance_index:name:{attendance_session.lesson_name}:{attendance_session.teacher_full_name}"
+    index_key_by_name = f"attendance_index:name_by_end_time:{attendance_session.lesson_name}:{attendance_session.teacher_full_name}"
     index_key_by_teacher = f"attendance_index:teacher:{attendance_session.teacher_school_number}"
     assert not await raw_redis_client.exists(index_key_by_name)
     assert not await raw_redis_client.exists(index_key_by_teacher)
 
+@pytest.mark.asyncio
+async def test_expired_attendance_ids_follow_end_time_index(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    expired = create_sample_attendance_redis(teacher_school_number="T_EXP", end_time=datetime.now(timezone.utc) - timedelta(minutes=5))
+    active = create_sample_attendance_redis(teacher_school_number="T_ACT")
+    await client.save_attendance_session(expired)
+    await client.save_attendance_session(active)
+
+    now = datetime.now(timezone.utc).timestamp()
+    assert await client.get_expired_attendance_ids(now) == [str(expired.attendance_id)]
+
+    await client.delete_attendance_session(expired)
+    assert await client.get_expired_attendance_ids(now) == []
+
+@pytest.mark.asyncio
+async def test_migration_marker_runs_once(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    assert await client.try_begin_migration("test_layout", ttl=60) is True
+    # Başka bir worker geçiş sürerken de, tamamlandıktan sonra da geçişi başlatamaz.
+    assert await client.try_begin_migration("test_layout", ttl=60) is False
+    await client.finish_migration("test_layout")
+    assert await client.try_begin_migration("test_layout", ttl=60) is False
+
+@pytest.mark.asyncio
+async def test_backfill_session_indexes_adds_unindexed_sessions(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    legacy_session = create_sample_attendance_redis(end_time=datetime.now(timezone.utc) - timedelta(minutes=1))
+    raw_redis_client = redis.Redis(connection_pool=redis_pool, decode_responses=True)
+    await raw_redis_client.set(f"attendance_session:{legacy_session.attendance_id}", legacy_session.model_dump_json())
+
+    assert await client.backfill_session_indexes() == 1
+    assert await client.backfill_session_indexes() == 0
+    expired_ids = await client.get_expired_attendance_ids(datetime.now(timezone.utc).timestamp())
+    assert expired_ids == [str(legacy_session.attendance_id)]
+
+@pytest.mark.asyncio
+async def test_backfill_session_indexes_rebuilds_name_index(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    legacy_session = create_sample_attendance_redis(lesson_name="Calculus", teacher_full_name="Dr. Turing")
+    raw_redis_client = redis.Redis(connection_pool=redis_pool, decode_responses=True)
+    await raw_redis_client.set(f"attendance_session:{legacy_session.attendance_id}", legacy_session.model_dump_json())
+    await raw_redis_client.sadd("attendance_index:name:Calculus:Dr. Turing", str(legacy_session.attendance_id))
+
+    await client.backfill_session_indexes()
+
+    found_sessions = await client.get_attendance_sessions_by_name("Calculus", "Dr. Turing", now=datetime.now(timezone.utc).timestamp())
+    assert [s.attendance_id for s in found_sessions] == [legacy_session.attendance_id]
+    assert await raw_redis_client.exists("attendance_index:name:Calculus:Dr. Turing") == 0
+
+@pytest.mark.asyncio
+async def test_migrate_legacy_attendance_records_moves_string_keys_into_hash(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    attendance_id = uuid.uuid4()
+    legacy_record = create_sample_attendance_record_redis(attendance_id, "S_LEGACY")
+    current_record = create_sample_attendance_record_redis(attendance_id, "S_CURRENT")
+    raw_redis_client = redis.Redis(connection_pool=redis_pool, decode_responses=True)
+    await raw_redis_client.set(f"attendance_records:{attendance_id}:S_LEGACY", legacy_record.model_dump_json())
+    await client.add_attendance_record(current_record)
+
+    assert await client.migrate_legacy_attendance_records() == 1
+    assert await client.migrate_legacy_attendance_records() == 0
+    records = await client.get_attendance_records(attendance_id)
+    assert {r.student_number for r in records} == {"S_LEGACY", "S_CURRENT"}
+    assert await raw_redis_client.exists(f"attendance_records:{attendance_id}:S_LEGACY") == 0
+
 @pytest.mark.asyncio
 async def test_get_attendance_sessions_by_name(redis_pool):
     client = RedisClient(pool=redis_pool)
@@ -126,6 +215,16 @@ async def test_get_attendance_sessions_by_name(redis_pool):
     found_sessions = await client.get_attendance_sessions_by_name("Calculus", "Dr. Turing")
     assert len(found_sessions) == 2
 
+@pytest.mark.asyncio
+async def test_get_attendance_sessions_by_name_skips_expired(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    active = create_sample_attendance_redis(lesson_name="Calculus", teacher_full_name="Dr. Turing")
+    expired = create_sample_attendance_redis(lesson_name="Calculus", teacher_full_name="Dr. Turing", end_time=datetime.now(timezone.utc) - timedelta(minutes=1))
+    await client.save_attendance_session(active)
+    await client.save_attendance_session(expired)
+    found_sessions = await client.get_attendance_sessions_by_name("Calculus", "Dr. Turing", now=datetime.now(timezone.utc).timestamp())
+    assert [s.attendance_id for s in found_sessions] == [active.attendance_id]
+
 @pytest.mark.asyncio
 async def test_get_attendance_session_of_teacher_with_active_session(redis_pool):
     client = RedisClient(pool=redis_pool)
@@ -190,4 +289,30 @@ async def test_webhook_verification_mapping(redis_pool):
 
     # Verinin artık mevcut olmadığını teyit et
     retrieved_data_after_delete = await client.get_user_and_attendance_for_verification(verification_id)
-    assert retrieved_data_after_delete is None
\ No newline at end of file
+    assert retrieved_data_after_delete is None
+
+
+@pytest.mark.asyncio
+async def test_map_verification_writes_pending_record(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    attendance_id = uuid.uuid4()
+    pending_record = create_sample_attendance_record_redis(attendance_id, "S12345")
+    pending_record.fail_reason = "FACE_RECOGNITION_PENDING"
+
+    await client.map_verification_to_user("vid-pending", "S12345", str(attendance_id), pending_record=pending_record)
+
+    mapping = await client.get_user_and_attendance_for_verification("vid-pending")
+    assert mapping == {"user_school_number": "S12345", "attendance_id": str(attendance_id)}
+    stored = await client.get_attendance_record_by_id(attendance_id, "S12345")
+    assert stored.fail_reason == "FACE_RECOGNITION_PENDING"
+
+@pytest.mark.asyncio
+async def test_pop_verification_mapping_reads_once(redis_pool):
+    client = RedisClient(pool=redis_pool)
+    verification_id = str(uuid.uuid4())
+    attendance_id = str(uuid.uuid4())
+    await client.map_verification_to_user(verification_id, "S12345", attendance_id)
+
+    popped = await client.pop_user_and_attendance_for_verification(verification_id)
+    assert popped == {"user_school_number": "S12345", "attendance_id": attendance_id}
+    assert await client.pop_user_and_attendance_for_verification(verification_id) is None
@@ -2,8 +2,10 @@
 
 import pytest
 import pytest_asyncio
+import httpx
 from datetime import datetime
-from app.backend.modules.aksis import AksisClient, AksisAuthError
+from unittest.mock import patch
+from app.backend.modules.aksis import AksisClient, AksisAuthError, AksisSessionError
 from app.backend.config.config import settings # Import the settings object
 
 # --- Pytest Markers ---
@@ -105,3 +107,26 @@ class TestAksisClientIntegration:
         assert isinstance(base64_image, str)
         assert len(base64_image) > 100 # A real base64 image will be long
         
+
+
+# --- Birim Testleri (Aksis yanıtları taklit edilir) ---
+
+@pytest.mark.asyncio
+async def test_login_without_token_value_raises_session_error():
+    """
+    Senaryo: Login sayfasındaki doğrulama alanının 'value' özelliği yoksa giriş POST'u
+    hiç gönderilmeden AksisSessionError yükseltilir.
+    """
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, text='<form><input name="__RequestVerificationToken"></form>')
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http_client:
+        client = AksisClient(school_number="S001", password="secret", http_client=http_client)
+        with patch.object(settings, "AKSIS_LOGIN_URL", "https://aksis.test/login"):
+            with pytest.raises(AksisSessionError, match="doğrulama anahtarı"):
+                await client.login()
+
+    assert [request.method for request in requests] == ["GET"]
@@ -1,9 +1,11 @@
 import pytest
 import pytest_asyncio
+import io
 import uuid
 import base64
 from datetime import datetime, timezone, timedelta
 from unittest.mock import patch, AsyncMock
+from fastapi import UploadFile
 
 # Test edilecek servis ve modeller
 from app.backend.services.student_service import StudentService, ServiceError
@@ -78,18 +80,18 @@ class TestStudentService:
 
     # --- find_active_sessions_by_name Metodu Testleri ---
     
-    async def test_find_active_sessions_filters_expired_sessions(self, service_instance, active_attendance_session, expired_attendance_session):
-        """Senaryo: Ders arandığında, süresi dolmuş olanların filtrelendiğini doğrular."""
+    async def test_find_active_sessions_filters_expired_sessions(self, service_instance, active_attendance_session):
+        """Senaryo: Ders arandığında, süre filtresinin Redis sorgusuna 'now' olarak iletildiğini doğrular."""
         service, mock_redis_client, _ = service_instance
-        mock_redis_client.get_attendance_sessions_by_name.return_value = [
-            active_attendance_session,
-            expired_attendance_session
-        ]
+        mock_redis_client.get_attendance_sessions_by_name.return_value = [active_attendance_session]
         
+        before = datetime.now(timezone.utc).timestamp()
         result = await service.find_active_sessions_by_name("Mixed Lessons", "Dr. Ada Lovelace")
         
-        assert len(result) == 1
-        assert result[0].attendance_id == active_attendance_session.attendance_id
+        assert result == [active_attendance_session]
+        args, kwargs = mock_redis_client.get_attendance_sessions_by_name.call_args
+        assert args == ("Mixed Lessons", "Dr. Ada Lovelace")
+        assert kwargs["now"] >= before
 
     # --- attend_to_attendance Metodu Testleri ---
 
@@ -100,6 +102,20 @@ class TestStudentService:
         with pytest.raises(ServiceError, match="This attendance session has already ended."):
             await service.attend_to_attendance(student_user, expired_attendance_session.attendance_id)
 
+    async def test_attend_to_expired_session_releases_lock(self, service_instance, student_user, expired_attendance_session):
+        """Senaryo: Kilit oturum okunurken eşzamanlı alındığından, oturum geçersizse hemen bırakılır."""
+        service, mock_redis_client, _ = service_instance
+        mock_redis_client.get_attendance_session.return_value = expired_attendance_session
+        mock_redis_client.acquire_lock.return_value = "token"
+
+        with pytest.raises(ServiceError, match="This attendance session has already ended."):
+            await service.attend_to_attendance(student_user, expired_attendance_session.attendance_id)
+
+        mock_redis_client.get_attendance_record_by_id.assert_not_called()
+        mock_redis_client.release_lock.assert_awaited_once_with(
+            f"lock:attend:{expired_attendance_session.attendance_id}:{student_user.user_school_number}", "token"
+        )
+
     async def test_attend_sec_1_success(self, service_instance, student_user, active_attendance_session):
         """Senaryo (Seviye 1): Güvenlik olmadığında katılım direkt başarılı olur."""
         service, mock_redis_client, _ = service_instance
@@ -112,7 +128,20 @@ class TestStudentService:
         assert record.is_attended is True
         assert record.fail_reason is None
         mock_redis_client.add_attendance_record.assert_called_once()
-        
+
+    async def test_attend_sec_1_does_not_read_upload(self, service_instance, student_user, active_attendance_session):
+        """Senaryo (Seviye 1): Yüz doğrulaması gerekmediğinde yüklenen fotoğraf hiç okunmaz."""
+        service, mock_redis_client, _ = service_instance
+        active_attendance_session.security_option = 1
+        mock_redis_client.get_attendance_session.return_value = active_attendance_session
+        mock_redis_client.get_attendance_record_by_id.return_value = None
+        upload = AsyncMock(spec=UploadFile)
+
+        record = await service.attend_to_attendance(student_user, active_attendance_session.attendance_id, normal_image=upload)
+
+        assert record.is_attended is True
+        upload.read.assert_not_awaited()
+
     async def test_attend_already_attended_raises_error(self, service_instance, student_user, active_attendance_session):
         service, mock_redis_client, _ = service_instance
         mock_redis_client.get_attendance_session.return_value = active_attendance_session
@@ -122,6 +151,33 @@ class TestStudentService:
         with pytest.raises(ServiceError, match="You have already successfully joined this session."):
             await service.attend_to_attendance(student_user, active_attendance_session.attendance_id)
 
+    async def test_attend_while_locked_raises_error(self, service_instance, student_user, active_attendance_session):
+        """Senaryo: Aynı öğrencinin katılımı zaten işleniyorsa ikinci istek reddedilir."""
+        service, mock_redis_client, _ = service_instance
+        mock_redis_client.get_attendance_session.return_value = active_attendance_session
+        mock_redis_client.acquire_lock.return_value = None
+
+        with pytest.raises(ServiceError, match="already being processed"):
+            await service.attend_to_attendance(student_user, active_attendance_session.attendance_id)
+
+        mock_redis_client.get_attendance_record_by_id.assert_not_called()
+        mock_redis_client.release_lock.assert_not_called()
+
+    async def test_attend_releases_lock_on_error(self, service_instance, student_user, active_attendance_session):
+        """Senaryo: Katılım hata ile bitse bile alınan kilit bırakılır."""
+        service, mock_redis_client, _ = service_instance
+        mock_redis_client.get_attendance_session.return_value = active_attendance_session
+        mock_redis_client.acquire_lock.return_value = "token"
+        existing_record = AttendanceRecordRedis(attendance_id=active_attendance_session.attendance_id, student_number=student_user.user_school_number, student_full_name=student_user.user_full_name, is_attended=True)
+        mock_redis_client.get_attendance_record_by_id.return_value = existing_record
+
+        with pytest.raises(ServiceError):
+            await service.attend_to_attendance(student_user, active_attendance_session.attendance_id)
+
+        mock_redis_client.release_lock.assert_awaited_once_with(
+            f"lock:attend:{active_attendance_session.attendance_id}:{student_user.user_school_number}", "token"
+        )
+
     @patch('app.backend.services.student_service.verify_wifi', return_value=False)
     async def test_attend_sec_2_wifi_fails(self, mock_wifi, service_instance, student_user, active_attendance_session):
         """Senaryo (Seviye 2): Wi-Fi kontrolü başarısız olur."""
@@ -138,7 +194,7 @@ class TestStudentService:
     # ================================================================= #
     # --- REFACTOR EDİLMİŞ TEST ---
     # ================================================================= #
-    @patch('app.backend.services.student_service.AksisClient.get_profile_image_base64', new_callable=AsyncMock)
+    @patch('app.backend.services.student_service.AksisClient.get_profile_image_bytes', new_callable=AsyncMock)
     @patch('app.backend.services.student_service.submit_face_verification_job', new_callable=AsyncMock) # DEĞİŞİKLİK: Yeni fonksiyonu patch'liyoruz
     @patch('app.backend.services.student_service.verify_wifi', return_value=True)
     async def test_attend_sec_3_webhook_flow_is_pending(self, mock_wifi, mock_face_submit, mock_aksis, service_instance, student_user, active_attendance_session, student_user_session, dummy_image_bytes):
@@ -148,12 +204,13 @@ class TestStudentService:
         mock_redis_client.get_attendance_session.return_value = active_attendance_session
         mock_redis_client.get_attendance_record_by_id.return_value = None
         mock_redis_client.get_user_session.return_value = student_user_session
-        mock_aksis.return_value = base64.b64encode(dummy_image_bytes).decode('utf-8')
+        mock_redis_client.get_reference_image.return_value = None
+        mock_aksis.return_value = dummy_image_bytes
         # DEĞİŞİKLİK: submit_face_verification_job artık bir şey döndürmüyor (veya "SUBMITTED" gibi basit bir string)
         mock_face_submit.return_value = "SUBMITTED"
 
         record = await service.attend_to_attendance(
-            student_user, active_attendance_session.attendance_id, student_ip="192.168.1.100", normal_image_bytes=dummy_image_bytes
+            student_user, active_attendance_session.attendance_id, student_ip="192.168.1.100", normal_image=UploadFile(file=io.BytesIO(dummy_image_bytes))
         )
 
         assert record.is_attended is False
@@ -163,6 +220,51 @@ class TestStudentService:
         mock_redis_client.add_user_to_face_verification_queue.assert_not_called()
         # Bunun yerine, submit işinin doğru parametrelerle çağrıldığını kontrol edebiliriz.
         mock_face_submit.assert_awaited_once()
+        assert mock_face_submit.await_args.kwargs["pending_record"] == record
+        assert mock_face_submit.await_args.kwargs["background"] is True
+        mock_redis_client.add_attendance_record.assert_not_awaited()
+        mock_redis_client.save_reference_image.assert_awaited_once_with(
+            student_user.user_school_number, base64.b64encode(dummy_image_bytes).decode('ascii')
+        )
+        assert mock_face_submit.await_args.kwargs["reference_image_bytes"] == dummy_image_bytes
+
+    @patch('app.backend.services.student_service.AksisClient.get_profile_image_bytes', new_callable=AsyncMock)
+    @patch('app.backend.services.student_service.submit_face_verification_job', new_callable=AsyncMock)
+    @patch('app.backend.services.student_service.verify_wifi', return_value=True)
+    async def test_attend_sec_3_uses_cached_reference_image(self, mock_wifi, mock_face_submit, mock_aksis, service_instance, student_user, active_attendance_session, student_user_session, dummy_image_bytes):
+        """Senaryo (Seviye 3): Referans fotoğraf önbellekteyse Aksis'ten tekrar indirilmez."""
+        service, mock_redis_client, _ = service_instance
+        active_attendance_session.security_option = 3
+        mock_redis_client.get_attendance_session.return_value = active_attendance_session
+        mock_redis_client.get_attendance_record_by_id.return_value = None
+        mock_redis_client.get_user_session.return_value = student_user_session
+        mock_redis_client.get_reference_image.return_value = base64.b64encode(dummy_image_bytes).decode('utf-8')
+
+        record = await service.attend_to_attendance(
+            student_user, active_attendance_session.attendance_id, student_ip="192.168.1.100", normal_image=UploadFile(file=io.BytesIO(dummy_image_bytes))
+        )
+
+        assert record.fail_reason == "FACE_RECOGNITION_PENDING"
+        mock_aksis.assert_not_awaited()
+        mock_redis_client.get_user_session.assert_not_awaited()
+        mock_redis_client.save_reference_image.assert_not_awaited()
+        assert mock_face_submit.await_args.kwargs["reference_image_bytes"] == dummy_image_bytes
+
+    @patch('app.backend.services.student_service.submit_face_verification_job', new_callable=AsyncMock)
+    @patch('app.backend.services.student_service.verify_wifi', return_value=True)
+    async def test_attend_sec_3_empty_image_is_missing(self, mock_wifi, mock_face_submit, service_instance, student_user, active_attendance_session):
+        """Senaryo (Seviye 3): Boş (0 byte) yüklenen fotoğraf, hiç yüklenmemiş gibi değerlendirilir."""
+        service, mock_redis_client, _ = service_instance
+        active_attendance_session.security_option = 3
+        mock_redis_client.get_attendance_session.return_value = active_attendance_session
+        mock_redis_client.get_attendance_record_by_id.return_value = None
+
+        record = await service.attend_to_attendance(
+            student_user, active_attendance_session.attendance_id, student_ip="192.168.1.100", normal_image=UploadFile(file=io.BytesIO(b""))
+        )
+
+        assert record.fail_reason == "FACE_VERIFICATION_REQUIRED_BUT_IMAGE_MISSING"
+        mock_face_submit.assert_not_awaited()
 
     # --- get_my_attendance_status Metodu Testleri ---
 
@@ -157,15 +157,30 @@ class TestTeacherService:
         assert len(result) == 1
         assert isinstance(result[0], EnrichedAttendanceRecord)
 
+    async def test_get_records_dispatches_on_attendance_type(self, service_instance, live_attendance_session):
+        service, mock_redis_client, mock_db_client = service_instance
+        mock_redis_client.get_attendance_records.return_value = []
+        mock_db_client.get_attendance_records.return_value = []
+
+        await service.get_records(live_attendance_session)
+        mock_redis_client.get_attendance_records.assert_called_once_with(live_attendance_session.attendance_id)
+        mock_db_client.get_attendance_records.assert_not_called()
+
+        historical = Attendance(attendance_id=uuid.uuid4(), teacher_school_number="any", lesson_name="any", start_time=datetime.now(), end_time=datetime.now(), security_option=1)
+        await service.get_records(historical)
+        mock_db_client.get_attendance_records.assert_called_once_with(historical.attendance_id)
+
     async def test_add_student_to_historical_attendance(self, service_instance, student_user):
         service, _, mock_db_client = service_instance
         attendance_id = uuid.uuid4()
-        mock_db_client.get_attendance_by_id.return_value = Attendance(attendance_id=attendance_id, teacher_school_number="any", lesson_name="any", start_time=datetime.now(), end_time=datetime.now(), security_option=1)
+        mock_db_client.add_student_to_attendance.return_value = True
         
         await service.add_student_to_historical_attendance(attendance_id, student_user, is_attended=True)
         
-        mock_db_client.add_users.assert_called_once_with([student_user])
-        mock_db_client.add_attendance_records.assert_called_once()
+        mock_db_client.add_student_to_attendance.assert_called_once()
+        args = mock_db_client.add_student_to_attendance.call_args
+        assert args.args[:3] == (attendance_id, student_user, True)
+        assert args.kwargs["attendance_time"] is not None
 
     async def test_accept_student_in_historical_attendance(self, service_instance, student_user):
         service, _, mock_db_client = service_instance
@@ -1,12 +1,13 @@
 import pytest
 import uuid
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock, patch
 from pathlib import Path
 
 # Test edilecek refactor edilmiş fonksiyon ve exception
-from app.backend.tools.face_verifier import submit_face_verification_job, VerificationError
+from app.backend.tools.face_verifier import submit_face_verification_job, drain_background_submissions, BatchSubmitter, VerificationError, _BatchItem
 from app.backend.config.config import settings
 from app.backend.models.db_models import User
+from app.backend.models.redis_models import AttendanceRecordRedis
 
 # --- Pytest İşaretleri ---
 integration_test = pytest.mark.skipif(
@@ -44,6 +45,21 @@ def mock_redis_client() -> AsyncMock:
     """RedisClient'ın davranışlarını taklit eden bir mock nesnesi sağlar."""
     return AsyncMock()
 
+def _make_pending_record(student_number: str, attendance_id: uuid.UUID = None) -> AttendanceRecordRedis:
+    """Gönderimden önce yazılan FACE_RECOGNITION_PENDING bekleme kaydını oluşturur."""
+    return AttendanceRecordRedis(
+        attendance_id=attendance_id or uuid.uuid4(),
+        student_number=student_number,
+        student_full_name="Test Öğrenci",
+        fail_reason="FACE_RECOGNITION_PENDING"
+    )
+
+def _make_batch_item(index: int, redis_client, data=None) -> _BatchItem:
+    return _BatchItem(
+        data if data is not None else {"verification_id": f"vid-{index}"},
+        b"normal", b"reference", redis_client, _make_pending_record(f"S{index}")
+    )
+
 # --- Refactor Edilmiş Entegrasyon Testleri ---
 
 @integration_test
@@ -103,6 +119,108 @@ async def test_submit_job_microservice_returns_error(
             redis_client=mock_redis_client
         )
 
-    # 3. Temizlik Doğrulama
+    # 3. Temizlik Doğrulama: eşleşme silinmez, TTL ile kendiliğinden düşer
     mock_redis_client.map_verification_to_user.assert_awaited_once()
-    mock_redis_client.delete_verification_mapping.assert_awaited_once()
+    mock_redis_client.delete_verification_mapping.assert_not_awaited()
+
+
+@integration_test
+@pytest.mark.asyncio
+async def test_background_submit_marks_record_failed_on_error(
+    real_image_bytes,
+    mock_student,
+    mock_redis_client,
+    httpx_mock
+):
+    """
+    Senaryo: Arka planda gönderilen iş başarısız olursa bekleme kaydı hata nedeniyle güncellenir.
+    """
+    microservice_url = f"{settings.FACE_VERIFIER_MICROSERVICE_URL}/verify-face-async"
+    httpx_mock.add_response(method="POST", url=microservice_url, status_code=500, text="Internal Server Error")
+
+    attendance_id = uuid.uuid4()
+    pending_record = _make_pending_record(mock_student.user_school_number, attendance_id)
+    result = await submit_face_verification_job(
+        student=mock_student,
+        attendance_id=attendance_id,
+        normal_image_bytes=real_image_bytes["normal"],
+        reference_image_bytes=real_image_bytes["reference"],
+        redis_client=mock_redis_client,
+        pending_record=pending_record,
+        background=True
+    )
+    assert result == "SUBMITTED"
+
+    await drain_background_submissions()
+    updated_record = mock_redis_client.update_attendance_record.await_args.args[0]
+    assert updated_record.fail_reason == "FACE_VERIFICATION_SUBMISSION_FAILED"
+
+
+# --- BatchSubmitter Birim Testleri (paylaşılan istemci taklit edilir) ---
+
+@pytest.fixture
+def mock_shared_client():
+    """Toplu gönderimde kullanılan paylaşılan httpx istemcisini taklit eder."""
+    client = MagicMock()
+    client.post = AsyncMock(return_value=MagicMock(raise_for_status=MagicMock()))
+    with patch("app.backend.tools.face_verifier.get_shared_client", return_value=client):
+        yield client
+
+@pytest.mark.asyncio
+async def test_batch_submitter_sends_window_as_single_request(mock_shared_client, mock_redis_client):
+    """
+    Senaryo: Aynı pencerede gelen işler tek bir istekte, sıralı form alanlarıyla gönderilir.
+    """
+    submitter = BatchSubmitter(window=0.05, max_size=16)
+    for index in range(3):
+        submitter.submit(_make_batch_item(index, mock_redis_client))
+    await submitter.close()
+
+    assert mock_shared_client.post.await_count == 1
+    kwargs = mock_shared_client.post.await_args.kwargs
+    assert len(kwargs["files"]) == 6
+    assert '"vid-2"' in kwargs["data"]["jobs"]
+    mock_redis_client.update_attendance_record.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_batch_submitter_respects_max_size(mock_shared_client, mock_redis_client):
+    """
+    Senaryo: Pencere dolmadan `max_size` işe ulaşılırsa parti hemen gönderilir.
+    """
+    submitter = BatchSubmitter(window=0.05, max_size=2)
+    for index in range(5):
+        submitter.submit(_make_batch_item(index, mock_redis_client))
+    await submitter.close()
+
+    assert mock_shared_client.post.await_count == 3
+    sent_sizes = [len(call.kwargs["files"]) // 2 for call in mock_shared_client.post.await_args_list]
+    assert sent_sizes == [2, 2, 1]
+
+@pytest.mark.asyncio
+async def test_batch_submitter_marks_all_records_failed_on_error(mock_shared_client, mock_redis_client):
+    """
+    Senaryo: Toplu istek başarısız olursa partideki her bekleme kaydı hata nedeniyle güncellenir.
+    """
+    mock_shared_client.post.side_effect = Exception("connection refused")
+
+    submitter = BatchSubmitter(window=0.05, max_size=16)
+    for index in range(3):
+        submitter.submit(_make_batch_item(index, mock_redis_client))
+    await submitter.close()
+
+    assert mock_redis_client.update_attendance_record.await_count == 3
+    for call in mock_redis_client.update_attendance_record.await_args_list:
+        assert call.args[0].fail_reason == "FACE_VERIFICATION_SUBMISSION_FAILED"
+
+@pytest.mark.asyncio
+async def test_batch_submitter_survives_unexpected_error(mock_shared_client, mock_redis_client):
+    """
+    Senaryo: Bir partide beklenmedik hata oluşsa da işçi görev ayakta kalır ve sonraki işler gönderilir.
+    """
+    submitter = BatchSubmitter(window=0.01, max_size=1)
+    # JSON'a çevrilemeyen veri, _send içinde beklenmedik bir hataya yol açar.
+    submitter.submit(_make_batch_item(0, mock_redis_client, data={"verification_id": object()}))
+    submitter.submit(_make_batch_item(1, mock_redis_client))
+    await submitter.close()
+
+    assert mock_shared_client.post.await_count == 1
@@ -5,6 +5,9 @@ import httpx
 import uuid
 from datetime import datetime, timezone
 
+from app.backend.models.db_models import Attendance
+from app.backend.tools.wifi_verifier import verify_wifi
+
 # --- Test Ayarları ---
 # Testin bağlanacağı, çalışan FastAPI uygulamasının adresi.
 TEST_APP_URL = "http://127.0.0.1:8000/verify-wifi"
@@ -74,3 +77,32 @@ async def test_wifi_verification_with_mismatching_ip(incorrect_ip_attendance_pay
     data = response.json()
     assert data["is_wifi_valid"] is False
     assert data["checked_ip"] == YOUR_REAL_WIFI_IP
+
+
+# --- verify_wifi Birim Testleri ---
+
+def _attendance_with_ip(ip_address):
+    return Attendance(
+        attendance_id=uuid.uuid4(),
+        teacher_school_number="T-UNIT-01",
+        lesson_name="Birim Testi",
+        ip_address=ip_address,
+        start_time=datetime.now(timezone.utc),
+        end_time=datetime.now(timezone.utc),
+        security_option=2
+    )
+
+@pytest.mark.parametrize("session_ip, student_ip, expected", [
+    ("192.168.1.1", "192.168.1.254", True),
+    ("192.168.1.1", "192.168.2.1", False),
+    ("2001:db8::1", "2001:db8::ffff:1", True),
+    ("2001:db8::1", "2001:db8:0:1::1", False),
+    ("192.168.1.1", "::ffff:192.168.1.2", False),
+    ("fe80::1", "fe80::2%eth0", True),
+    ("fe80::1%eth0", "fe80::2%wlan0", True),
+    ("fe80::1", "fe80:0:0:1::2%eth0", False),
+    ("not-an-ip", "not-an-ip-either", False),
+    (None, "192.168.1.1", False),
+])
+def test_verify_wifi_subnet_rules(session_ip, student_ip, expected):
+    assert verify_wifi(_attendance_with_ip(session_ip), student_ip) is expected